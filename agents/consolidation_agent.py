@@ -1,13 +1,28 @@
 """
 Consolidation agent
 """
-from typing import Dict, Any
-import json
+import logging
+from typing import Dict, Any, List, Optional
 from langchain.chat_models.base import BaseChatModel
-from langchain.chains import LLMChain
-from langchain.prompts import ChatPromptTemplate
 from memory.shared_memory import SharedMemory
-from config.constants import CONSOLIDATION_PROMPT  
+from config.constants import (
+    CONSOLIDATION_PROMPT, CONSOLIDATION_PROMPTS_BY_QUERY_TYPE, MAX_CONCURRENT_LLM_CALLS, LOCAL_CONSOLIDATION_ENABLED,
+    LOCAL_CONSOLIDATION_QUERY_TYPES, LOCAL_CONSOLIDATION_DEFAULT_FINDINGS
+)
+from langchain_core.output_parsers import StrOutputParser
+from utils.llm_helpers import ainvoke_limited, run_sync, compiled_prompt_switch
+from utils.llm_cache import cache_name_for
+from utils.json_helpers import jdumps, jloads
+
+logger = logging.getLogger(__name__)
+
+# Per locally consolidated query type: (text analysis pattern list, finding category,
+# specific_numbers count field, summary phrases for one and several findings)
+_LOCAL_RANKINGS = {
+    "current_strengths": ("strengths", "strength", "strengths_requested", ("strength", "strengths")),
+    "areas_for_improvement": ("improvements", "improvement", "improvements_requested",
+                              ("area for improvement", "areas for improvement")),
+}
 
 class ConsolidationAgent:
     """
@@ -18,52 +33,82 @@ class ConsolidationAgent:
         self.llm = llm
         self.shared_memory = shared_memory
         
-        # Use the enhanced prompt from constants
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("human", CONSOLIDATION_PROMPT)
-        ])
+        # Use the enhanced prompt from constants, carrying only the guidance for the query type
+        self.prompt = compiled_prompt_switch(
+            "query_type", tuple((query_type, prompt, None) for query_type, prompt in CONSOLIDATION_PROMPTS_BY_QUERY_TYPE.items()),
+            CONSOLIDATION_PROMPT
+        )
         
-        self.chain = LLMChain(llm=llm, prompt=self.prompt)
+        self.chain = self.prompt | llm | StrOutputParser()
+        # Responses are cached only for deterministic (temperature 0) models
+        self.cache_name = cache_name_for(llm, "consolidation")
     
-    def run(self) -> Dict[str, Any]:
+    def run(self, user_query: Optional[str] = None, structured_query: Optional[Dict[str, Any]] = None,
+            numeric_analysis: Optional[Dict[str, Any]] = None, text_analysis: Optional[Dict[str, Any]] = None,
+            structured_query_json: Optional[str] = None) -> Dict[str, Any]:
         """
         Use LLM to intelligently consolidate all analysis results
         """
-        # Get all the analysis results
-        user_query = self.shared_memory.get("user_query")
-        structured_query = self.shared_memory.get("structured_query")
-        numeric_analysis = self.shared_memory.get("numeric_analysis")
-        text_analysis = self.shared_memory.get("text_analysis")
+        return run_sync(self.arun(user_query, structured_query, numeric_analysis, text_analysis, structured_query_json))
+    
+    async def arun(self, user_query: Optional[str] = None, structured_query: Optional[Dict[str, Any]] = None,
+                   numeric_analysis: Optional[Dict[str, Any]] = None, text_analysis: Optional[Dict[str, Any]] = None,
+                   structured_query_json: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Async consolidation - awaits the LLM without blocking the event loop
+        
+        Args:
+            user_query: User query text
+            structured_query: Output of the query understanding agent
+            numeric_analysis: Output of the numeric analysis agent
+            text_analysis: Output of the text analysis agent
+            structured_query_json: Pre-serialized structured_query for the prompt
+            
+        Inputs that are omitted are read from shared memory.
+        """
+        # Get all the analysis results not passed in
+        memory = self.shared_memory.get_many((
+            "user_query", "structured_query", "structured_query_json", "numeric_analysis", "text_analysis"
+        ))
+        if user_query is None:
+            user_query = memory["user_query"]
+        if structured_query is None:
+            structured_query = memory["structured_query"]
+            structured_query_json = memory["structured_query_json"]
+        if numeric_analysis is None:
+            numeric_analysis = memory["numeric_analysis"]
+        if text_analysis is None:
+            text_analysis = memory["text_analysis"]
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Consolidation starting...")
+            logger.debug("  User query: %s", user_query)
+            logger.debug("  Text analysis available: %s", text_analysis is not None)
+            logger.debug("  Numeric analysis available: %s", numeric_analysis is not None)
         
-        print("DEBUG: Consolidation starting...")
-        print(f"  User query: {user_query}")
-        print(f"  Text analysis available: {text_analysis is not None}")
-        print(f"  Numeric analysis available: {numeric_analysis is not None}")
+        consolidated_summary = self._local_consolidation(user_query, structured_query, numeric_analysis, text_analysis)
+        if consolidated_summary is not None:
+            logger.debug("Consolidated locally, skipping the LLM call")
+            self.shared_memory.publish("consolidated_summary", consolidated_summary)
+            return consolidated_summary
         
         try:
-            # FIXED: Use .invoke() with proper response extraction
-            response_dict = self.chain.invoke({
-                "user_query": user_query,
-                "structured_query": json.dumps(structured_query, indent=2),
-                "numeric_analysis": json.dumps(numeric_analysis, indent=2) if numeric_analysis else "No numeric data",
-                "text_analysis": json.dumps(text_analysis, indent=2) if text_analysis else "No text analysis"
-            })
-            
-            # Extract the actual text response from the dict
-            if isinstance(response_dict, dict):
-                response = response_dict.get("text", str(response_dict))
-            else:
-                response = str(response_dict)
+            response = await ainvoke_limited(self.chain, self._build_inputs(
+                user_query, structured_query, numeric_analysis, text_analysis,
+                structured_query_json=structured_query_json
+            ), cache_name=self.cache_name)
             
             # Parse the LLM response
-            consolidated_summary = json.loads(response)
+            consolidated_summary = jloads(response)
             
-            print("DEBUG: LLM consolidation successful")
-            print(f"  Key findings: {len(consolidated_summary.get('key_findings', []))}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("LLM consolidation successful")
+                logger.debug("  Key findings: %d", len(consolidated_summary.get('key_findings', [])))
             
         except Exception as e:
-            print(f"DEBUG: LLM consolidation failed: {e}")
-            print(f"Raw LLM response: {response if 'response' in locals() else 'No response'}")
+            logger.warning("LLM consolidation failed: %s", e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw LLM response: %s", response if 'response' in locals() else 'No response')
             
             # Simple fallback consolidation
             consolidated_summary = self._fallback_consolidation(
@@ -71,15 +116,165 @@ class ConsolidationAgent:
             )
         
         # Save to shared memory
-        self.shared_memory.set("consolidated_summary", consolidated_summary)
+        self.shared_memory.publish("consolidated_summary", consolidated_summary)
         return consolidated_summary
     
+    def run_many(self, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Consolidate several queries with one batched LLM call so the provider can reuse connections
+        
+        Args:
+            queries: Dicts with "user_query", "structured_query", "numeric_analysis" and "text_analysis"
+            
+        Returns:
+            Consolidated summary per query, in input order
+        """
+        results = [
+            self._local_consolidation(q.get("user_query"), q.get("structured_query"),
+                                      q.get("numeric_analysis"), q.get("text_analysis"))
+            for q in queries
+        ]
+        # Only queries that could not be consolidated locally go to the LLM
+        pending = [index for index, result in enumerate(results) if result is None]
+        inputs = [
+            self._build_inputs(queries[index].get("user_query"), queries[index].get("structured_query"),
+                               queries[index].get("numeric_analysis"), queries[index].get("text_analysis"))
+            for index in pending
+        ]
+        responses = self.chain.batch(
+            inputs, config={"max_concurrency": MAX_CONCURRENT_LLM_CALLS}, return_exceptions=True
+        )
+        
+        for index, response in zip(pending, responses):
+            query = queries[index]
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                results[index] = jloads(response)
+            except Exception as e:
+                logger.warning("LLM consolidation failed: %s", e)
+                results[index] = self._fallback_consolidation(
+                    query.get("user_query"), query.get("structured_query"),
+                    query.get("numeric_analysis"), query.get("text_analysis")
+                )
+        return results
+    
+    def _build_inputs(self, user_query: str, structured_query: Dict[str, Any],
+                      numeric_analysis: Dict[str, Any], text_analysis: Dict[str, Any],
+                      structured_query_json: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Build the prompt input variables for one query
+        
+        Args:
+            structured_query_json: Pre-rendered structured query JSON from query understanding, if available
+        """
+        return {
+            "user_query": user_query,
+            # Selects the prompt variant
+            "query_type": (structured_query or {}).get("query_type"),
+            # Compact JSON, since indentation roughly doubles the tokens
+            "structured_query": structured_query_json or jdumps(structured_query),
+            "numeric_analysis": jdumps(numeric_analysis) if numeric_analysis else "No numeric data",
+            "text_analysis": jdumps(text_analysis) if text_analysis else "No text analysis"
+        }
+    
+    def _local_consolidation(self, user_query: str, structured_query: Optional[Dict[str, Any]],
+                             numeric_analysis: Optional[Dict[str, Any]],
+                             text_analysis: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Consolidate a strengths / improvements query without the LLM: rank the text analysis
+        patterns by confidence and attach the matching scores
+        
+        Returns:
+            Consolidated summary, or None when the query needs the LLM (other query types,
+            temporal or comparative questions, or no patterns to rank)
+        """
+        if not LOCAL_CONSOLIDATION_ENABLED or not structured_query:
+            return None
+        query_type = structured_query.get("query_type")
+        if (query_type not in LOCAL_CONSOLIDATION_QUERY_TYPES or structured_query.get("temporal_dimension")
+                or structured_query.get("comparison_elements")):
+            return None
+        
+        pattern_key, category, count_field, phrases = _LOCAL_RANKINGS[query_type]
+        patterns = [
+            pattern for pattern in ((text_analysis or {}).get("competency_analysis") or {}).get(pattern_key) or []
+            if isinstance(pattern, dict) and pattern.get("supporting_evidence")
+        ]
+        if not patterns:
+            return None
+        
+        # Highest confidence first, more evidence breaking ties (sort is stable)
+        patterns.sort(key=lambda p: (p.get("confidence_info", {}).get("score", 0), len(p["supporting_evidence"])),
+                      reverse=True)
+        specific_numbers = structured_query.get("specific_numbers") or {}
+        count = (specific_numbers.get(count_field) or specific_numbers.get("top_requested")
+                 or LOCAL_CONSOLIDATION_DEFAULT_FINDINGS)
+        
+        key_findings = []
+        rotation_points: Dict[str, List[str]] = {}
+        evaluator_types = set()
+        for pattern in patterns[:count]:
+            evidence = [ev for ev in pattern["supporting_evidence"] if isinstance(ev, dict)]
+            title = pattern.get("pattern_text") or f"Unnamed {category}"
+            rotations = {ev.get("rotation") for ev in evidence if ev.get("rotation")}
+            dates = sorted(str(ev["date"]) for ev in evidence if ev.get("date") and ev["date"] != "Unknown date")
+            evaluator_types.update(ev["evaluator_role"] for ev in evidence if ev.get("evaluator_role"))
+            for rotation in rotations:
+                rotation_points.setdefault(rotation, []).append(title)
+            
+            key_findings.append({
+                "category": category,
+                "title": title,
+                "description": pattern.get("confidence_description") or pattern.get("confidence_info", {}).get("description", ""),
+                "evidence": [ev.get("text", "") for ev in evidence if ev.get("text")],
+                "confidence": pattern.get("confidence", "low"),
+                "source_count": f"{len(evidence)} evaluator{'s' if len(evidence) != 1 else ''} across "
+                                f"{len(rotations)} rotation{'s' if len(rotations) != 1 else ''}",
+                "temporal_context": f"{dates[0]} to {dates[-1]}" if dates else None
+            })
+        
+        numeric_analysis = numeric_analysis or {}
+        rotation_scores = (numeric_analysis.get("query_specific_analysis") or {}).get("rotation_comparison") or {}
+        # A weighted composite of 0 means no evaluation is recent enough to carry weight
+        relevant_scores = {
+            competency: composite.get("composite_score") or composite.get("raw_composite_score")
+            for competency, composite in (numeric_analysis.get("by_competency") or {}).items()
+        }
+        field_counts = [
+            stats.get("count", 0)
+            for bucket in ("by_epa", "by_communication", "by_professionalism")
+            for stats in (numeric_analysis.get(bucket) or {}).values()
+        ]
+        
+        return {
+            "summary": f"Your {len(key_findings)} most consistently noted {phrases[len(key_findings) != 1]}: "
+                       + "; ".join(finding["title"] for finding in key_findings),
+            "key_findings": key_findings,
+            "numeric_context": {
+                "relevant_scores": relevant_scores,
+                "trends": " ".join(numeric_analysis.get("summary_insights") or []) or "Limited trend data available"
+            },
+            "rotation_breakdown": {
+                rotation: {"key_points": titles, "scores": rotation_scores.get(rotation, {}).get("avg_scores", {})}
+                for rotation, titles in rotation_points.items()
+            },
+            "data_quality": {
+                "total_evaluations": max(field_counts) if field_counts else sum(
+                    len(pattern["supporting_evidence"]) for pattern in patterns
+                ),
+                "evaluator_types": sorted(evaluator_types),
+                "rotations_covered": list(rotation_points),
+                "confidence_assessment": f"Ranked from {len(patterns)} evidence-backed patterns by pattern confidence"
+            }
+        }
+    
     def _fallback_consolidation(self, user_query: str, structured_query: Dict[str, Any], 
                                numeric_analysis: Dict[str, Any], text_analysis: Dict[str, Any]) -> Dict[str, Any]:
         """
         Simple fallback when LLM consolidation fails
         """
-        print("DEBUG: Using fallback consolidation")
+        logger.debug("Using fallback consolidation")
         
         key_findings = []
         
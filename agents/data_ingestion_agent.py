@@ -1,21 +1,64 @@
 """
 Data ingestion agent - Processes raw CSV data and converts to structured JSON with recency weighting
 """
-from typing import List, Dict, Any
-import json
+import sys
+from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
 
 from langchain.chat_models.base import BaseChatModel
-from langchain.chains import LLMChain
-from langchain.prompts import ChatPromptTemplate
 from langchain_community.chat_models import ChatOpenAI
 from memory.shared_memory import SharedMemory
 from config.constants import DATA_INGESTION_PROMPT
+from utils.llm_helpers import compiled_prompt, compiled_chain
 
 import os
 from openai import AzureOpenAI, OpenAI
 
+# Placeholder strings treated as missing values
+_NULL_STRINGS = ["", "#NAME?", "N/A"]
+_DATE_CAST_FORMATS = ("%m/%d/%Y", "%Y-%m-%d", "%d/%m/%y")
+_ISO_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+def _null_mask(series: pd.Series) -> pd.Series:
+    """Missing values and placeholder strings (whitespace-insensitive)"""
+    stripped = series.map(lambda value: value.strip() if isinstance(value, str) else value)
+    return series.isna() | stripped.isin(_NULL_STRINGS)
+
+def _cast_int_column(series: pd.Series) -> pd.Series:
+    values = pd.to_numeric(series, errors="coerce")
+    values = values.where(np.isfinite(values))
+    return np.trunc(values).astype("Int64")
+
+def _cast_float_column(series: pd.Series) -> pd.Series:
+    return pd.to_numeric(series, errors="coerce")
+
+def _cast_date_column(series: pd.Series) -> pd.Series:
+    parsed = pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]")
+    for fmt in _DATE_CAST_FORMATS:
+        parsed = parsed.fillna(pd.to_datetime(series, format=fmt, errors="coerce"))
+    # Unparseable dates pass through unchanged
+    return parsed.dt.strftime(_ISO_FORMAT).where(parsed.notna(), series).mask(_null_mask(series))
+
+def _cast_text_column(series: pd.Series) -> pd.Series:
+    return series.mask(_null_mask(series))
+
+# Low-cardinality text columns whose values are interned, so the thousands of repeated
+# rotation / role / date strings share one object each and hash by identity downstream
+_INTERNED_COLUMNS = ("form_name", "evaluator_role", "release_date_str")
+
+def _intern_strings(series: pd.Series) -> pd.Series:
+    return series.map(lambda value: sys.intern(value) if isinstance(value, str) else value)
+
+# Column type name -> vectorized caster, applied once per column
+_COLUMN_CASTERS = {
+    "int": _cast_int_column,
+    "float": _cast_float_column,
+    "date": _cast_date_column,
+    "text": _cast_text_column,
+}
+
 class DataIngestionAgent:
     """
     Data ingestion agent responsible for converting raw CSV table data into standardized JSON format.
@@ -27,135 +70,109 @@ class DataIngestionAgent:
         self.llm = llm
         self.shared_memory = shared_memory
         
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("human", DATA_INGESTION_PROMPT)
-        ])
-        self.chain = LLMChain(llm=llm, prompt=self.prompt)
+        self.prompt = compiled_prompt(DATA_INGESTION_PROMPT)
+        self.chain = compiled_chain(llm, DATA_INGESTION_PROMPT)
     
-    def _safe_cast(self, value: Any, type_name: str) -> Any:
-        if value is None or (isinstance(value, str) and value.strip() in ["", "#NAME?", "N/A"]):
-            return None
-            
-        try:
-            if type_name == "int":
-                if isinstance(value, float):
-                    return int(value) if not pd.isna(value) else None
-                return int(float(value)) if value else None
-            elif type_name == "float":
-                return float(value) if value else None
-            elif type_name == "date":
-                if isinstance(value, str):
-                    for fmt in ["%m/%d/%Y", "%Y-%m-%d", "%d/%m/%y"]:
-                        try:
-                            return datetime.strptime(value, fmt).isoformat()
-                        except ValueError:
-                            continue
-                return value
-            else:
-                return value
-        except Exception:
-            return value
-    
-    def _calculate_recency_weight(self, date_str: str) -> float:
+    def _build_parsed_frame(self, raw_table: List[List[Any]], columns: List[str]) -> pd.DataFrame:
         """
-        Calculate recency weight based on release date.
-        - Full weight (1.0) for assessments in the last 3 months
-        - Linear decay from 3-9 months
-        - Zero weight after 9 months
-        
-        Args:
-            date_str: Release date string in various formats
-            
-        Returns:
-            Recency weight between 0.0 and 1.0
+        Process data using static mapping, without relying on LLM, into a columnar frame.
+        Adds a datetime64 "release_dt" column alongside the fields carried by parsed_data rows.
         """
-        if not date_str:
-            return 0.0
-            
-        try:
-            # FIXED: Try multiple date formats to handle different input formats
-            release_date = None
-            date_formats = [
-                "%Y-%m-%d",    # 2023-03-02 (your actual format)
-                "%m/%d/%y",    # 3/2/23
-                "%m/%d/%Y",    # 3/2/2023
-                "%d/%m/%Y",    # 2/3/2023
-                "%Y/%m/%d"     # 2023/03/02
-            ]
-            
-            for fmt in date_formats:
-                try:
-                    release_date = datetime.strptime(date_str, fmt)
-                    break
-                except ValueError:
-                    continue
-            
-            if release_date is None:
-                print(f"Could not parse date: {date_str}")
-                return 0.5  # Default weight if parsing fails
-            
-            # Calculate months between release date and current date
-            current_date = datetime.now()
-            months_difference = (current_date.year - release_date.year) * 12 + (current_date.month - release_date.month)
-            
-            # Apply weighting rule
-            if months_difference <= 3:
-                # Full weight for assessments in the last 3 months
-                return 1.0
-            elif months_difference >= 9:
-                # Zero weight after 9 months
-                return 0.0
-            else:
-                # Linear decay between 3-9 months
-                return 1.0 - (months_difference - 3) / 6
-                
-        except Exception as e:
-            print(f"Error calculating recency weight for '{date_str}': {e}")
-            return 0.5  # Default to mid-weight if there's an error
-    
-    def _process_data_with_map(self) -> List[Dict[str, Any]]:
-        """Process data using static mapping, without relying on LLM"""
-        raw_table = self.shared_memory.get("raw_table")
-        columns = self.shared_memory.get("columns")
         column_type_map = self.shared_memory.get_static_mapping("column_type_map")
         
-        parsed_data = []
+        if not raw_table:
+            return pd.DataFrame()
         
-        for row in raw_table:
-            parsed_row = {}
-            for i, col_name in enumerate(columns):
-                if i >= len(row):
-                    continue
-                    
-                value = row[i]
-                col_type = column_type_map.get(col_name, "text")
-                parsed_row[col_name] = self._safe_cast(value, col_type)
-            
-            # Calculate and add recency weight based on release_date
-            release_date = None
-            for i, col_name in enumerate(columns):
-                if col_name == "release_date" and i < len(row):
-                    release_date = row[i]
-                    break
-            
-            parsed_row["recency_weight"] = self._calculate_recency_weight(release_date)
-            
-            # Add the original release date string for reference in evidence
-            if release_date:
-                parsed_row["release_date_str"] = release_date
-            
-            parsed_data.append(parsed_row)
+        # Cast whole columns at once instead of cell by cell
+        raw_df = pd.DataFrame(raw_table, columns=columns, dtype=object)
+        df = pd.DataFrame({
+            col_name: _COLUMN_CASTERS.get(column_type_map.get(col_name, "text"), _cast_text_column)(raw_df[col_name])
+            for col_name in columns
+        })
+        
+        # Recency weight: full weight within 3 months, linear decay to zero at 9 months
+        now = datetime.now()
+        release_date = raw_df["release_date"] if "release_date" in raw_df.columns else pd.Series(None, index=raw_df.index, dtype=object)
+        release_dt = pd.to_datetime(release_date, format="mixed", errors="coerce")
+        months_difference = (now.year - release_dt.dt.year) * 12 + (now.month - release_dt.dt.month)
+        has_release_date = release_date.notna() & (release_date != "")
+        df["recency_weight"] = (
+            (1.0 - (months_difference - 3) / 6).clip(0.0, 1.0)
+            .where(release_dt.notna(), 0.5)  # Default weight if parsing fails
+            .where(has_release_date, 0.0)
+        )
+        
+        # Keep the original release date string for reference in evidence, and the parsed
+        # date (ISO string for row consumers, datetime64 for columnar ones) so downstream
+        # agents don't re-run date parsing
+        df["release_date_str"] = release_date.where(has_release_date)
+        df["_release_dt"] = release_dt.dt.strftime(_ISO_FORMAT)
+        df["release_dt"] = release_dt
+        
+        for col_name in _INTERNED_COLUMNS:
+            if col_name in df.columns:
+                df[col_name] = _intern_strings(df[col_name])
+        
+        return df
+    
+    def _frame_to_records(self, frame: pd.DataFrame) -> List[Dict[str, Any]]:
+        """Convert the parsed frame to the list-of-dicts layout used by legacy consumers"""
+        if frame.empty:
+            return []
+        
+        df = frame.drop(columns="release_dt")
+        parsed_data = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+        
+        # Rows without a release date carry no release_date_str key
+        has_release_date = df["release_date_str"].notna()
+        if not has_release_date.all():
+            for parsed_row, has_date in zip(parsed_data, has_release_date):
+                if not has_date:
+                    del parsed_row["release_date_str"]
         
         return parsed_data
     
-    def run(self) -> List[Dict[str, Any]]:
+    def _process_data_with_map(self) -> List[Dict[str, Any]]:
+        """Process data using static mapping, without relying on LLM"""
+        return self._frame_to_records(
+            self._build_parsed_frame(self.shared_memory.get("raw_table"), self.shared_memory.get("columns"))
+        )
+    
+    def ingest(self, raw_table: List[List[Any]], columns: List[str]) -> Dict[str, Any]:
+        """
+        Parse raw CSV data without touching shared memory
+        
+        Args:
+            raw_table: Raw CSV data (list of rows)
+            columns: List of column names
+            
+        Returns:
+            Dict with "parsed_frame" and "parsed_data"
+        """
+        parsed_frame = self._build_parsed_frame(raw_table, columns)
+        parsed_data = self._frame_to_records(parsed_frame)
+        return {
+            "parsed_frame": parsed_frame,
+            "parsed_data": parsed_data
+        }
+    
+    def run(self, raw_table: Optional[List[List[Any]]] = None, columns: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """
         Parse raw CSV data and convert to structured JSON with recency weighting
         
+        Args:
+            raw_table: Raw CSV data (read from shared memory if omitted)
+            columns: List of column names (read from shared memory if omitted)
+        
         Returns:
             List of parsed data dictionaries
         """
-        parsed_data = self._process_data_with_map()
-        self.shared_memory.set("parsed_data", parsed_data)
+        if raw_table is None:
+            raw_table = self.shared_memory.get("raw_table")
+        if columns is None:
+            columns = self.shared_memory.get("columns")
+        
+        ingested = self.ingest(raw_table, columns)
+        self.shared_memory.publish_many(ingested)
         
-        return parsed_data
\ No newline at end of file
+        return ingested["parsed_data"]
\ No newline at end of file
@@ -2,22 +2,63 @@
 Numeric analysis agent
 """
 
-from typing import Dict, Any, List
-import json
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Union
 import re
-import statistics
-from collections import defaultdict
-from datetime import datetime
+import numpy as np
+import pandas as pd
 
 from langchain.chat_models.base import BaseChatModel
-from langchain.chains import LLMChain
-from langchain.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
 from memory.shared_memory import SharedMemory
-from config.constants import NUMERIC_ANALYSIS_PROMPT  # Import from constants
+from config.constants import NUMERIC_ANALYSIS_PROMPT, MAX_CONCURRENT_LLM_CALLS
+from utils.llm_helpers import astream_json_limited, run_sync, compiled_prompt, compiled_chain
+from utils.llm_cache import cache_name_for
+from utils.json_helpers import jdumps, jloads
+from utils.data_helpers import matches_any_term
+
+logger = logging.getLogger(__name__)
+
+# JSON extraction patterns for LLM responses, compiled once
+_JSON_BLOCK = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+_JSON_BRACE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Score field prefixes, and the result section for each keyed by first character
+_NUMERIC_PREFIXES = ("epa", "comm_", "prof_")
+_FIELD_BUCKETS = {"e": "by_epa", "c": "by_communication", "p": "by_professionalism"}
+
+# Score fields averaged into each competency composite: (explicit fields, field prefixes)
+_COMPETENCY_FIELDS = {
+    "clinical_reasoning": (("epa1", "epa2", "epa3", "epa7"), ()),
+    "communication": (("epa6",), ("comm_",)),
+    "professionalism": ((), ("prof_",)),
+    "patient_care": (("epa1", "epa9"), ("prof_",)),
+}
+
+# Query types that get a per-rotation breakdown of scores
+_ROTATION_QUERY_TYPES = ("rotation_specific", "comparative_analysis")
+
+def _as_python_number(value: float) -> Any:
+    """Convert a numpy scalar to int when integral (scores are stored as ints), else float"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+def _records_to_frame(parsed_data: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Build the columnar view of legacy parsed_data rows, with a datetime64 "release_dt" column"""
+    df = pd.DataFrame(parsed_data)
+    if "_release_dt" in df.columns:
+        date_strs = df["release_date_str"] if "release_date_str" in df.columns else df.get("release_date")
+        release_dt = pd.to_datetime(df["_release_dt"], errors="coerce")
+        if date_strs is not None:
+            release_dt = release_dt.where(date_strs.notna() & (date_strs != ""))
+        df["release_dt"] = release_dt
+    return df
 
 class NumericAnalysisAgent:
     """
-    Numeric analysis agent with enhanced temporal analysis using centralized prompt
+    Numeric analysis agent: statistics are computed with pandas, and the LLM only
+    summarizes them into insights using the centralized prompt
     """
     
     def __init__(self, llm: BaseChatModel, shared_memory: SharedMemory):
@@ -25,182 +66,263 @@ class NumericAnalysisAgent:
         self.shared_memory = shared_memory
         
         # Use the enhanced prompt from constants
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("human", NUMERIC_ANALYSIS_PROMPT)
-        ])
-        self.chain = LLMChain(llm=llm, prompt=self.prompt)
+        self.prompt = compiled_prompt(NUMERIC_ANALYSIS_PROMPT)
+        self.chain = compiled_chain(llm, NUMERIC_ANALYSIS_PROMPT)
+        # Streaming variant stops at the closing code fence that ends the JSON block
+        self.stream_chain = self.prompt | llm.bind(stop=["```\n"]) | StrOutputParser()
+        # Responses are cached only for deterministic (temperature 0) models
+        self.cache_name = cache_name_for(llm, "numeric_insights")
     
-    def run(self) -> Dict[str, Any]:
+    def run(self, user_query: Optional[str] = None, structured_query: Optional[Dict[str, Any]] = None,
+            parsed_data: Optional[List[Dict[str, Any]]] = None,
+            parsed_frame: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
         """
         Perform numeric analysis using enhanced prompt from constants
         """
-        user_query = self.shared_memory.get("user_query")
-        structured_query = self.shared_memory.get("structured_query", {})
-        parsed_data = self.shared_memory.get("parsed_data")
-        
-        # Extract query context for the enhanced prompt
-        query_type = structured_query.get("query_type", "general_performance")
-        competency_focus = structured_query.get("competency_focus")
-        temporal_dimension = structured_query.get("temporal_dimension", False)
-        rotation_filters = structured_query.get("rotation_filters", [])
-        epa_filters = structured_query.get("epa_filters", [])
+        return run_sync(self.arun(user_query, structured_query, parsed_data, parsed_frame))
+    
+    async def arun(self, user_query: Optional[str] = None, structured_query: Optional[Dict[str, Any]] = None,
+                   parsed_data: Optional[List[Dict[str, Any]]] = None,
+                   parsed_frame: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
+        """
+        Async numeric analysis so the LLM round-trip can overlap with other agents
         
-        print(f"DEBUG Numeric Analysis:")
-        print(f"  Query type: {query_type}")
-        print(f"  Competency focus: {competency_focus}")
-        print(f"  Temporal analysis: {temporal_dimension}")
-        print(f"  Rotation filters: {rotation_filters}")
+        Args:
+            user_query: User query text
+            structured_query: Output of the query understanding agent
+            parsed_data: Output of the data ingestion agent
+            parsed_frame: Columnar view of parsed_data, used to compute the statistics
+            
+        Inputs that are omitted are read from shared memory; parsed_frame is only read
+        from there along with parsed_data, so both always describe the same rows.
+        """
+        memory = self.shared_memory.get_many(
+            ("user_query", "structured_query", "parsed_data", "parsed_frame")
+        )
+        if user_query is None:
+            user_query = memory["user_query"]
+        if structured_query is None:
+            structured_query = memory["structured_query"] or {}
+        if parsed_data is None:
+            parsed_data = memory["parsed_data"]
+            parsed_frame = memory["parsed_frame"]
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Numeric Analysis:")
+            logger.debug("  Query type: %s", structured_query.get('query_type', 'general_performance'))
+            logger.debug("  Competency focus: %s", structured_query.get('competency_focus'))
+            logger.debug("  Temporal analysis: %s", structured_query.get('temporal_dimension', False))
+            logger.debug("  Rotation filters: %s", structured_query.get('rotation_filters', []))
+        
+        # Statistics are CPU-bound pandas work, so they run in a worker thread
+        numeric_analysis = await asyncio.get_running_loop().run_in_executor(
+            None, self._compute_statistics,
+            parsed_frame if parsed_frame is not None else parsed_data, structured_query
+        )
         
         try:
-            # FIXED: Use .invoke() with proper response extraction
-            response_dict = self.chain.invoke({
-                "user_query": user_query,
-                "query_type": query_type,
-                "competency_focus": competency_focus or "general",
-                "temporal_dimension": temporal_dimension,
-                "rotation_filters": rotation_filters,
-                "epa_filters": epa_filters,
-                "parsed_data": json.dumps(parsed_data[:10], indent=2)  # Sample for LLM
-            })
-            
-            # Extract the actual text response from the dict
-            if isinstance(response_dict, dict):
-                response = response_dict.get("text", str(response_dict))
-            else:
-                response = str(response_dict)
+            # Stream the response and stop once the JSON object is complete
+            response = await astream_json_limited(self.stream_chain, self._build_inputs(
+                user_query, structured_query, numeric_analysis
+            ), cache_name=self.cache_name)
+            numeric_analysis["summary_insights"] = self._parse_insights(response)
             
-            # Extract JSON from the response
-            # Look for JSON block in markdown code blocks
-            json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # Try to find JSON-like structure in the response
-                json_match = re.search(r'\{.*\}', response, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
-                else:
-                    # If still no JSON found, try the whole response
-                    json_str = response
-            
-            # Parse LLM response
-            numeric_analysis = json.loads(json_str)
-            
-            print("DEBUG: LLM numeric analysis successful")
+            logger.debug("LLM numeric insights successful")
             
         except Exception as e:
-            print(f"LLM numeric analysis failed: {e}")
-            print(f"Raw LLM response: {response if 'response' in locals() else 'No response'}")
-            
-            # ENHANCED FALLBACK: Use the sophisticated logic when LLM fails
-            numeric_analysis = self._enhanced_fallback_analysis(parsed_data, structured_query)
+            # The computed statistics stand on their own without the insights
+            logger.warning("LLM numeric insights failed: %s", e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw LLM response: %s", response if 'response' in locals() else 'No response')
         
-        self.shared_memory.set("numeric_analysis", numeric_analysis)
+        self.shared_memory.publish("numeric_analysis", numeric_analysis)
         return numeric_analysis
     
-    def _enhanced_fallback_analysis(self, parsed_data: List[Dict[str, Any]], 
-                                   structured_query: Dict[str, Any]) -> Dict[str, Any]:
+    def run_many(self, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Analyze several queries with one batched LLM call so the provider can reuse connections
+        
+        Args:
+            queries: Dicts with "user_query", "structured_query" and "parsed_data"
+            
+        Returns:
+            Numeric analysis per query, in input order
+        """
+        results = [
+            self._compute_statistics(q.get("parsed_data") or [], q.get("structured_query") or {})
+            for q in queries
+        ]
+        inputs = [
+            self._build_inputs(q.get("user_query"), q.get("structured_query") or {}, statistics)
+            for q, statistics in zip(queries, results)
+        ]
+        responses = self.chain.batch(
+            inputs, config={"max_concurrency": MAX_CONCURRENT_LLM_CALLS}, return_exceptions=True
+        )
+        
+        for statistics, response in zip(results, responses):
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                statistics["summary_insights"] = self._parse_insights(response)
+            except Exception as e:
+                logger.warning("LLM numeric insights failed: %s", e)
+        return results
+    
+    def _build_inputs(self, user_query: str, structured_query: Dict[str, Any],
+                      statistics: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the prompt input variables for one query
+        
+        Args:
+            statistics: Statistics computed by _compute_statistics
+        """
+        return {
+            "user_query": user_query,
+            "query_type": structured_query.get("query_type", "general_performance"),
+            "competency_focus": structured_query.get("competency_focus") or "general",
+            "temporal_dimension": structured_query.get("temporal_dimension", False),
+            "rotation_filters": structured_query.get("rotation_filters", []),
+            "epa_filters": structured_query.get("epa_filters", []),
+            "statistics": jdumps(statistics)
+        }
+    
+    def _parse_response(self, response: str) -> Dict[str, Any]:
+        """
+        Extract and parse the JSON analysis from an LLM response
+        """
+        # Look for JSON block in markdown code blocks
+        json_match = _JSON_BLOCK.search(response)
+        if json_match:
+            json_str = json_match.group(1)
+        else:
+            # Try to find JSON-like structure in the response
+            json_match = _JSON_BRACE.search(response)
+            if json_match:
+                json_str = json_match.group(0)
+            else:
+                # If still no JSON found, try the whole response
+                json_str = response
+        
+        return jloads(json_str)
+    
+    def _parse_insights(self, response: str) -> List[str]:
+        """Extract the summary_insights list from an LLM response"""
+        insights = self._parse_response(response).get("summary_insights") or []
+        return [str(insight) for insight in insights]
+    
+    def _compute_statistics(self, parsed_data: Union[pd.DataFrame, List[Dict[str, Any]]], 
+                            structured_query: Dict[str, Any]) -> Dict[str, Any]:
         """
-        FALLBACK: Use the sophisticated analysis logic when LLM fails
-        This includes all the temporal analysis logic from the previous version
+        Compute per-field, per-competency, temporal and (when asked for) per-rotation statistics
+        
+        Args:
+            parsed_data: Parsed frame from ingestion, or legacy list of row dicts
+            structured_query: Structured query from query understanding
         """
-        print("DEBUG: Using enhanced fallback numeric analysis")
         
-        professionalism_fields = self.shared_memory.get_static_mapping("professionalism_fields")
+        df = parsed_data if isinstance(parsed_data, pd.DataFrame) else _records_to_frame(parsed_data)
         
         result = {
             "by_epa": {},
             "by_communication": {},
             "by_professionalism": {},
+            "by_competency": {},
             "query_specific_analysis": {},
-            "temporal_analysis": self._analyze_temporal_progression(parsed_data, structured_query)
+            "temporal_analysis": self._analyze_temporal_progression(df, structured_query)
         }
         
-        # Get all numeric fields dynamically
-        all_numeric_fields = set()
-        for row in parsed_data:
-            for field, value in row.items():
-                if (field.startswith("epa") or field.startswith("comm_") or field.startswith("prof_")) and \
-                   value is not None and isinstance(value, (int, float)):
-                    all_numeric_fields.add(field)
+        # Per-field statistics run as vectorized column ops
+        numeric_fields = [col for col in df.columns if col.startswith(_NUMERIC_PREFIXES)]
+        numeric_df = df[numeric_fields].apply(pd.to_numeric, errors="coerce").astype(float)
+        if "recency_weight" in df.columns:
+            weights = pd.to_numeric(df["recency_weight"], errors="coerce").fillna(1.0)
+        else:
+            weights = pd.Series(1.0, index=df.index)
+        
+        present = numeric_df.notna()
+        counts = present.sum()
+        raw_avgs = numeric_df.mean()
+        mins = numeric_df.min()
+        maxs = numeric_df.max()
+        weighted_sums = numeric_df.mul(weights, axis=0).sum()
+        weight_totals = present.mul(weights, axis=0).sum()
+        
+        # Dated rows in chronological order (stable, so ties keep row order) for trends
+        release_dt = df["release_dt"] if "release_dt" in df.columns else pd.Series(pd.NaT, index=df.index)
+        dated_order = release_dt[release_dt.notna()].sort_values(kind="stable")
+        dated_scores = numeric_df.loc[dated_order.index]
         
         # Process individual field scores with temporal trend analysis
-        for field in all_numeric_fields:
-            field_scores = []
-            field_weights = []
-            field_scores_with_dates = []
+        for field in numeric_df.columns:
+            count = int(counts[field])
+            if not count:
+                continue
             
-            for row in parsed_data:
-                if field in row and row[field] is not None and isinstance(row[field], (int, float)):
-                    field_scores.append(row[field])
-                    weight = row.get("recency_weight", 1.0)
-                    field_weights.append(weight)
-                    
-                    date_str = row.get("release_date_str") or row.get("release_date")
-                    if date_str:
-                        field_scores_with_dates.append({
-                            "date": date_str,
-                            "score": row[field],
-                            "weight": weight
-                        })
+            weight_total = weight_totals[field]
+            weighted_avg = round(float(weighted_sums[field] / weight_total), 2) if weight_total > 0 else 0
             
-            if field_scores:
-                weighted_avg = round(self._weighted_mean(field_scores, field_weights), 2)
-                
-                field_stats = {
-                    "avg": weighted_avg,
-                    "weighted_avg": weighted_avg,
-                    "raw_avg": round(statistics.mean(field_scores), 2),
-                    "min": min(field_scores),
-                    "max": max(field_scores),
-                    "count": len(field_scores),
-                    "recent_trend": self._calculate_trend_fixed(field_scores_with_dates)
-                }
-                
-                # Categorize by field type
-                if field.startswith("epa"):
-                    result["by_epa"][field] = field_stats
-                elif field.startswith("comm_"):
-                    result["by_communication"][field] = field_stats
-                elif field.startswith("prof_"):
-                    result["by_professionalism"][field] = field_stats
+            field_stats = {
+                "avg": weighted_avg,
+                "weighted_avg": weighted_avg,
+                "raw_avg": round(float(raw_avgs[field]), 2),
+                "min": _as_python_number(mins[field]),
+                "max": _as_python_number(maxs[field]),
+                "count": count,
+                "recent_trend": self._calculate_trend_fixed(dated_scores[field].dropna(), dated_order)
+            }
+            
+            # Categorize by field type
+            result[_FIELD_BUCKETS[field[0]]][field] = field_stats
+        
+        result["by_competency"] = self._competency_composites(result)
+        if (structured_query.get("rotation_filters")
+                or structured_query.get("query_type") in _ROTATION_QUERY_TYPES):
+            result["query_specific_analysis"]["rotation_comparison"] = self._rotation_comparison(
+                df, numeric_df, structured_query.get("rotation_filters")
+            )
         
         return result
     
-    def _weighted_mean(self, values: List[float], weights: List[float]) -> float:
-        """Calculate weighted mean of a list of values"""
-        if not values or not weights or len(values) != len(weights):
-            return 0
-            
-        numerator = sum(value * weight for value, weight in zip(values, weights))
-        denominator = sum(weights)
-        
-        return numerator / denominator if denominator > 0 else 0
+    def _competency_composites(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Average the weighted and raw field averages making up each competency"""
+        field_stats = {**result["by_epa"], **result["by_communication"], **result["by_professionalism"]}
+        composites = {}
+        for competency, (fields, prefixes) in _COMPETENCY_FIELDS.items():
+            members = [
+                field for field in field_stats
+                if field in fields or (prefixes and field.startswith(prefixes))
+            ]
+            if members:
+                composites[competency] = {
+                    "composite_score": round(sum(field_stats[field]["avg"] for field in members) / len(members), 2),
+                    "raw_composite_score": round(sum(field_stats[field]["raw_avg"] for field in members) / len(members), 2),
+                    "fields": members
+                }
+        return composites
     
-    def _parse_date(self, date_str: str) -> datetime:
-        """Parse dates with all possible formats from your data"""
-        if not date_str:
-            return None
-            
-        # Include the actual format used in your data
-        date_formats = [
-            "%Y-%m-%d",    # 2023-03-02 (YOUR ACTUAL FORMAT)
-            "%m/%d/%Y",    # 3/2/2023
-            "%m/%d/%y",    # 3/2/23
-            "%d/%m/%Y",    # 2/3/2023
-            "%Y/%m/%d"     # 2023/03/02
-        ]
-        
-        for fmt in date_formats:
-            try:
-                return datetime.strptime(date_str, fmt)
-            except ValueError:
-                continue
-        
-        print(f"WARNING: Could not parse date: {date_str}")
-        return None
+    def _rotation_comparison(self, df: pd.DataFrame, numeric_df: pd.DataFrame,
+                             rotation_filters: Optional[List[str]]) -> Dict[str, Any]:
+        """
+        Average scores per rotation, limited to the rotations matching rotation_filters when given
+        """
+        if "form_name" not in df.columns or df.empty:
+            return {}
+        rotations = df["form_name"].fillna("Unknown")
+        if rotation_filters:
+            rotations = rotations[matches_any_term(rotations, rotation_filters)]
+        grouped = numeric_df.loc[rotations.index].groupby(rotations, sort=False)
+        avgs = grouped.mean().round(2)
+        counts = grouped.size()
+        return {
+            rotation: {
+                "avg_scores": {field: float(score) for field, score in avgs.loc[rotation].dropna().items()},
+                "evaluation_count": int(counts[rotation])
+            }
+            for rotation in avgs.index
+        }
     
-    def _analyze_temporal_progression(self, parsed_data: List[Dict[str, Any]], 
+    def _analyze_temporal_progression(self, df: pd.DataFrame, 
                                     structured_query: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze temporal progression for clinical reasoning and other competencies"""
         is_temporal_query = structured_query.get("temporal_dimension", False)
@@ -209,64 +331,47 @@ class NumericAnalysisAgent:
         if not is_temporal_query:
             return {"temporal_analysis_performed": False}
         
-        print(f"DEBUG: Performing temporal analysis for competency: {competency_focus}")
+        logger.debug("Performing temporal analysis for competency: %s", competency_focus)
         
-        # Group data by time periods
-        temporal_data = []
+        # Dated evaluations, in row order
+        if "release_dt" in df.columns:
+            temporal_df = df[df["release_dt"].notna()]
+        else:
+            temporal_df = df.iloc[:0]
         
-        for row in parsed_data:
-            date_str = row.get("release_date_str") or row.get("release_date")
-            if not date_str:
-                continue
-                
-            parsed_date = self._parse_date(date_str)
-            if parsed_date is None:
-                continue
-            
-            temporal_data.append({
-                "date": parsed_date,
-                "date_str": date_str,
-                "rotation": row.get("form_name", "Unknown"),
-                "evaluator_role": row.get("evaluator_role", "Unknown"),
-                "epa_scores": {k: v for k, v in row.items() if k.startswith("epa") and isinstance(v, (int, float))},
-                "comm_scores": {k: v for k, v in row.items() if k.startswith("comm_") and isinstance(v, (int, float))},
-                "recency_weight": row.get("recency_weight", 1.0)
-            })
-        
-        # Sort by date
-        temporal_data.sort(key=lambda x: x["date"])
-        
-        if len(temporal_data) < 2:
+        if len(temporal_df) < 2:
             return {
                 "temporal_analysis_performed": True,
                 "insufficient_data": True,
                 "message": "Need at least 2 time points for temporal analysis"
             }
         
-        # Analyze progression by time periods
-        early_period = temporal_data[:len(temporal_data)//2]  # First half
-        recent_period = temporal_data[len(temporal_data)//2:]  # Second half
-        
-        # Analyze EPA trends (EPAs 1-3 are most related to clinical reasoning)
-        reasoning_epas = ["epa1", "epa2", "epa3"]
-        early_epa_scores = []
-        recent_epa_scores = []
-        
-        for period_data, score_list in [(early_period, early_epa_scores), (recent_period, recent_epa_scores)]:
-            for eval_data in period_data:
-                period_scores = []
-                for epa in reasoning_epas:
-                    if epa in eval_data["epa_scores"] and eval_data["epa_scores"][epa] is not None:
-                        period_scores.append(eval_data["epa_scores"][epa])
-                if period_scores:
-                    score_list.append(sum(period_scores) / len(period_scores))
+        # Analyze EPA trends (EPAs 1-3 are most related to clinical reasoning):
+        # average the available reasoning EPAs per evaluation, skipping evaluations with none
+        reasoning_epas = [epa for epa in ("epa1", "epa2", "epa3") if epa in temporal_df.columns]
+        reasoning_scores = temporal_df[reasoning_epas].apply(pd.to_numeric, errors="coerce").astype(float)
+        evaluation_avgs = reasoning_scores.mean(axis=1).to_numpy()
+        
+        # Analyze progression by time periods (earlier half vs later half of evaluations).
+        # Select the earlier half around the middle date in O(N) instead of sorting;
+        # evaluations tied on the middle date fill the earlier half in row order.
+        dates = temporal_df["release_dt"].to_numpy(dtype="datetime64[ns]").view("int64")
+        half = len(dates) // 2
+        middle_date = np.partition(dates, half)[half]
+        early_mask = dates < middle_date
+        early_mask[np.flatnonzero(dates == middle_date)[:half - int(early_mask.sum())]] = True
+        
+        early_epa_scores = evaluation_avgs[early_mask]
+        early_epa_scores = early_epa_scores[~np.isnan(early_epa_scores)]
+        recent_epa_scores = evaluation_avgs[~early_mask]
+        recent_epa_scores = recent_epa_scores[~np.isnan(recent_epa_scores)]
         
         # Calculate trends
         epa_trend = "stable"
         epa_change = 0
-        if early_epa_scores and recent_epa_scores:
-            early_avg = sum(early_epa_scores) / len(early_epa_scores)
-            recent_avg = sum(recent_epa_scores) / len(recent_epa_scores)
+        early_avg = float(early_epa_scores.mean()) if len(early_epa_scores) else None
+        recent_avg = float(recent_epa_scores.mean()) if len(recent_epa_scores) else None
+        if early_avg is not None and recent_avg is not None:
             epa_change = recent_avg - early_avg
             
             if epa_change > 0.3:
@@ -274,47 +379,42 @@ class NumericAnalysisAgent:
             elif epa_change < -0.3:
                 epa_trend = "declining"
         
+        # Earliest is the first row on the minimum date, most recent the last row on the maximum
+        date_strs = temporal_df["release_date_str"] if "release_date_str" in temporal_df.columns else temporal_df["release_date"]
+        earliest_pos = int(np.argmin(dates))
+        most_recent_pos = len(dates) - 1 - int(np.argmax(dates[::-1]))
+        rotations = temporal_df["form_name"] if "form_name" in temporal_df.columns else pd.Series("Unknown", index=temporal_df.index)
+        
         return {
             "temporal_analysis_performed": True,
-            "total_evaluations": len(temporal_data),
+            "total_evaluations": len(temporal_df),
             "time_span": {
-                "earliest": temporal_data[0]["date_str"],
-                "most_recent": temporal_data[-1]["date_str"],
-                "rotations": list(set([d["rotation"] for d in temporal_data]))
+                "earliest": date_strs.iat[earliest_pos],
+                "most_recent": date_strs.iat[most_recent_pos],
+                "rotations": list(set(rotations.astype(object).where(rotations.notna(), None)))
             },
             "epa_progression": {
                 "direction": epa_trend,
                 "change": round(epa_change, 2),
-                "early_avg": round(sum(early_epa_scores) / len(early_epa_scores), 2) if early_epa_scores else None,
-                "recent_avg": round(sum(recent_epa_scores) / len(recent_epa_scores), 2) if recent_epa_scores else None
+                "early_avg": round(early_avg, 2) if early_avg is not None else None,
+                "recent_avg": round(recent_avg, 2) if recent_avg is not None else None
             }
         }
     
-    def _calculate_trend_fixed(self, scores_with_dates: List[Dict]) -> Dict[str, Any]:
-        """Calculate trend information with proper date parsing"""
-        if not scores_with_dates or len(scores_with_dates) < 2:
-            return {"direction": "stable", "magnitude": 0}
+    def _calculate_trend_fixed(self, scores: pd.Series, dates: pd.Series) -> Dict[str, Any]:
+        """
+        Calculate trend information from a field's scores
         
-        # Parse dates properly
-        parsed_scores = []
-        for item in scores_with_dates:
-            parsed_date = self._parse_date(item["date"])
-            if parsed_date:
-                parsed_scores.append({
-                    "date": parsed_date,
-                    "score": item["score"],
-                    "weight": item.get("weight", 1.0)
-                })
-        
-        if len(parsed_scores) < 2:
+        Args:
+            scores: Non-missing scores of one field, in chronological order
+            dates: Release dates indexed like the scores
+        """
+        if len(scores) < 2:
             return {"direction": "stable", "magnitude": 0}
         
-        # Sort by date
-        parsed_scores.sort(key=lambda x: x["date"])
-        
         # Get earliest and most recent scores
-        earliest = parsed_scores[0]["score"]
-        most_recent = parsed_scores[-1]["score"]
+        earliest = _as_python_number(scores.iat[0])
+        most_recent = _as_python_number(scores.iat[-1])
         
         # Calculate change
         change = most_recent - earliest
@@ -334,5 +434,5 @@ class NumericAnalysisAgent:
             "change": round(change, 2),
             "earliest_score": earliest,
             "most_recent_score": most_recent,
-            "time_span": f"{parsed_scores[0]['date'].strftime('%Y-%m')} to {parsed_scores[-1]['date'].strftime('%Y-%m')}"
-        }
\ No newline at end of file
+            "time_span": f"{dates[scores.index[0]].strftime('%Y-%m')} to {dates[scores.index[-1]].strftime('%Y-%m')}"
+        }
@@ -1,23 +1,35 @@
 """
 Orchestrator agent - Main controller of the system
 """
-from typing import List, Dict, Any
-from langchain.chat_models.base import BaseChatModel
-from langchain.chains import LLMChain
-from langchain.prompts import ChatPromptTemplate
+import logging
+import asyncio
+import copy
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Iterator, Optional, Tuple, TYPE_CHECKING
 
 from memory.shared_memory import SharedMemory
-from agents.data_ingestion_agent import DataIngestionAgent
-from agents.query_understanding_agent import QueryUnderstandingAgent
-from agents.numeric_analysis_agent import NumericAnalysisAgent
-from agents.text_analysis_agent import TextAnalysisAgent
-from agents.consolidation_agent import ConsolidationAgent
-from agents.response_generation_agent import ResponseGenerationAgent
 from config.constants import ORCHESTRATOR_PROMPT
+from utils.llm_helpers import run_sync, compiled_prompt, compiled_chain
+from utils.llm_cache import llm_cache, semantic_cache, cache_name_for
+from utils.json_helpers import jdumps
 
-from langchain_community.chat_models import ChatOpenAI
-import os
-from openai import AzureOpenAI, OpenAI
+if TYPE_CHECKING:
+    from langchain.chat_models.base import BaseChatModel
+    from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Child agents (and their compiled chains) built once per LLM and reused across
+# orchestrators; each orchestrator gets shallow copies bound to its own shared memory
+_AGENT_POOL_SIZE = 4
+_agent_pool: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+_agent_pool_lock = threading.Lock()
+
+async def _skipped_analysis(name: str) -> Dict[str, Any]:
+    """Stand-in for an analysis step the query does not need"""
+    logger.info("%s analysis not needed for this query, skipping", name)
+    return {}
 
 class OrchestratorAgent:
     """
@@ -25,23 +37,76 @@ class OrchestratorAgent:
     and returning the final answer.
     """
     
-    def __init__(self, llm: BaseChatModel, shared_memory: SharedMemory):
+    def __init__(self, llm: "BaseChatModel", shared_memory: SharedMemory, embeddings: Optional["Embeddings"] = None):
+        """
+        Args:
+            llm: Chat model shared by the agents
+            shared_memory: Shared memory the agents publish to
+            embeddings: Optional embeddings client; enables the semantic cache of final
+                responses for paraphrased queries (deterministic models only)
+        """
         self.llm = llm
         self.shared_memory = shared_memory
+        self.embeddings = embeddings if cache_name_for(llm, "semantic_response") else None
         
-        # Create all child agents
-        self.data_ingestion_agent = DataIngestionAgent(llm, shared_memory)
-        self.query_understanding_agent = QueryUnderstandingAgent(llm, shared_memory)
-        self.numeric_analysis_agent = NumericAnalysisAgent(llm, shared_memory)
-        self.text_analysis_agent = TextAnalysisAgent(llm, shared_memory)
-        self.consolidation_agent = ConsolidationAgent(llm, shared_memory)
-        self.response_generation_agent = ResponseGenerationAgent(llm, shared_memory)
+        # Reuse pooled child agents; copying only rebinds shared memory, the chains are shared
+        for name, pooled_agent in self._pooled_agents(llm).items():
+            agent = copy.copy(pooled_agent)
+            agent.shared_memory = shared_memory
+            setattr(self, name, agent)
         
         # Create its own LLM chain
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("human", ORCHESTRATOR_PROMPT)
-        ])
-        self.chain = LLMChain(llm=llm, prompt=self.prompt)
+        self.prompt = compiled_prompt(ORCHESTRATOR_PROMPT)
+        self.chain = compiled_chain(llm, ORCHESTRATOR_PROMPT)
+    
+    @classmethod
+    def build_agents(cls, llm: "BaseChatModel", shared_memory: Optional[SharedMemory]) -> Dict[str, Any]:
+        """
+        Create all child agents
+        
+        Args:
+            llm: Chat model shared by the agents
+            shared_memory: Shared memory the agents publish to
+            
+        Returns:
+            Mapping of orchestrator attribute name to agent
+        """
+        # Agent modules (pandas, numpy, LangChain) are imported on first construction
+        # rather than at module load, keeping worker cold start cheap
+        from agents.data_ingestion_agent import DataIngestionAgent
+        from agents.query_understanding_agent import QueryUnderstandingAgent
+        from agents.numeric_analysis_agent import NumericAnalysisAgent
+        from agents.text_analysis_agent import TextAnalysisAgent
+        from agents.consolidation_agent import ConsolidationAgent
+        from agents.response_generation_agent import ResponseGenerationAgent
+        
+        return {
+            "data_ingestion_agent": DataIngestionAgent(llm, shared_memory),
+            "query_understanding_agent": QueryUnderstandingAgent(llm, shared_memory),
+            "numeric_analysis_agent": NumericAnalysisAgent(llm, shared_memory),
+            "text_analysis_agent": TextAnalysisAgent(llm, shared_memory),
+            "consolidation_agent": ConsolidationAgent(llm, shared_memory),
+            "response_generation_agent": ResponseGenerationAgent(llm, shared_memory),
+        }
+    
+    @classmethod
+    def _pooled_agents(cls, llm: "BaseChatModel") -> Dict[str, Any]:
+        """Get the pooled child agents for an LLM, building them on first use"""
+        # Pool entries hold a reference to the LLM, so its id cannot be reused while cached
+        key = id(llm)
+        with _agent_pool_lock:
+            agents = _agent_pool.get(key)
+            if agents is not None:
+                _agent_pool.move_to_end(key)
+                return agents
+        
+        agents = cls.build_agents(llm, None)
+        with _agent_pool_lock:
+            agents = _agent_pool.setdefault(key, agents)
+            _agent_pool.move_to_end(key)
+            while len(_agent_pool) > _AGENT_POOL_SIZE:
+                _agent_pool.popitem(last=False)
+        return agents
     
     def run(self, raw_table: List[List[Any]], columns: List[str], user_query: str) -> str:
         """
@@ -55,56 +120,167 @@ class OrchestratorAgent:
         Returns:
             The final natural language response
         """
-        # 1. Save inputs to shared memory
-        self.shared_memory.set("raw_table", raw_table)
-        self.shared_memory.set("columns", columns)
-        self.shared_memory.set("user_query", user_query)
+        return run_sync(self.arun(raw_table, columns, user_query))
+    
+    def run_stream(self, raw_table: List[List[Any]], columns: List[str], user_query: str) -> Iterator[str]:
+        """
+        Run the system flow and stream the final answer as it is generated
+        
+        Args:
+            raw_table: Raw CSV data (list of rows)
+            columns: List of column names
+            user_query: User query text
+            
+        Returns:
+            Iterator over chunks of the final natural language response
+        """
+        cached_response, analysis, semantic_slot = run_sync(self._arun_analysis(raw_table, columns, user_query))
+        if cached_response is not None:
+            self.shared_memory.set_session_data("last_response", cached_response)
+            yield cached_response
+            return
         
-        # Print status information
-        print(f"Received user query: '{user_query}'")
+        logger.info("Streaming final response...")
+        # Yields the raw chunks and returns the cleaned response. A stream that breaks off
+        # raises here, so a truncated response is never cached.
+        response = yield from self.response_generation_agent.run_stream(**analysis)
+        if semantic_slot is not None:
+            semantic_cache.set(*semantic_slot, response)
+        
+        # Save response to session memory
+        self.shared_memory.set_session_data("last_response", response)
+    
+    async def _aembed_query(self, user_query: str) -> Optional[List[float]]:
+        """Embed the query for the semantic cache, or None when it is disabled or embedding fails"""
+        if self.embeddings is None:
+            return None
+        try:
+            return await self.embeddings.aembed_query(user_query)
+        except Exception as e:
+            logger.warning("Query embedding failed, skipping semantic cache: %s", e)
+            return None
+    
+    def _semantic_scope(self, raw_table: List[List[Any]], columns: List[str], structured_query: Dict[str, Any]) -> str:
+        """
+        Semantic cache scope: paraphrased queries only share a response when they target the
+        same data and the same filters, focus and requested counts
+        """
+        return llm_cache.cache_key(cache_name_for(self.llm, "semantic_response"), {
+            "columns": columns,
+            "raw_table": raw_table,
+            "query_type": structured_query.get("query_type"),
+            "competency_focus": structured_query.get("competency_focus"),
+            "temporal_dimension": structured_query.get("temporal_dimension"),
+            "rotation_filters": structured_query.get("rotation_filters"),
+            "epa_filters": structured_query.get("epa_filters"),
+            "specific_numbers": structured_query.get("specific_numbers"),
+        })
+    
+    async def _arun_analysis(self, raw_table: List[List[Any]], columns: List[str],
+                             user_query: str) -> Tuple[Optional[str], Dict[str, Any], Optional[Tuple[str, Any]]]:
+        """
+        Steps 1-6: ingest, understand the query, analyze and consolidate. Each step's output
+        is passed straight to the agents that need it rather than round-tripped through shared memory.
+        
+        Returns:
+            Tuple of (cached final response for a paraphrase of this query or None, keyword
+            arguments for the response generation agent, (scope, embedding) to cache the
+            final response under or None)
+        """
+        # 1. Print status information
+        logger.info("Received user query: '%s'", user_query)
         raw_table_summary = f"{len(raw_table)} rows x {len(columns)} columns"
-        print(f"Raw data: {raw_table_summary}")
+        logger.info("Raw data: %s", raw_table_summary)
         
-        # 2. Call data ingestion agent
-        print("\nRunning Data Ingestion Agent...")
-        parsed_data = self.data_ingestion_agent.run()
-        print(f"Parsed {len(parsed_data)} records")
+        # 2 + 3. Call data ingestion and query understanding agents concurrently - ingestion
+        # only needs the table and query understanding only needs the query. Ingestion is
+        # CPU-bound, so it runs in a worker thread while the query LLM call is in flight.
+        logger.info("Running Data Ingestion and Query Understanding Agents...")
+        loop = asyncio.get_running_loop()
+        ingested, (structured_query, routing), query_embedding = await asyncio.gather(
+            loop.run_in_executor(None, self.data_ingestion_agent.ingest, raw_table, columns),
+            self.query_understanding_agent.arun_with_routing(user_query),
+            self._aembed_query(user_query)
+        )
+        parsed_data = ingested["parsed_data"]
+        structured_query_json = jdumps(structured_query)
+        logger.info("Parsed %d records", len(parsed_data))
+        logger.info("Structured query: %s", structured_query)
         
-        # 3. Call query understanding agent
-        print("\nRunning Query Understanding Agent...")
-        structured_query = self.query_understanding_agent.run()
-        print(f"Structured query: {structured_query}")
+        semantic_slot = None
+        if query_embedding is not None:
+            semantic_slot = (self._semantic_scope(raw_table, columns, structured_query), query_embedding)
+            cached_response = semantic_cache.get(*semantic_slot)
+            if cached_response is not None:
+                logger.info("Reusing the response to a similar earlier query")
+                return cached_response, {}, None
         
-        # 4. Call numeric analysis agent
-        print("\nRunning Numeric Analysis Agent...")
-        numeric_analysis = self.numeric_analysis_agent.run()
-        print("Numeric analysis complete")
+        # 4 + 5. Call numeric and text analysis agents concurrently, skipping any the
+        # query understanding step marked as unnecessary for this query
+        logger.info("Running Numeric and Text Analysis Agents...")
+        numeric_analysis, text_analysis = await asyncio.gather(
+            self.numeric_analysis_agent.arun(
+                user_query, structured_query, parsed_data,
+                parsed_frame=ingested["parsed_frame"]
+            ) if routing["needs_numeric"] else _skipped_analysis("Numeric"),
+            self.text_analysis_agent.arun(user_query, structured_query, parsed_data, parsed_frame=ingested["parsed_frame"])
+            if routing["needs_text"] else _skipped_analysis("Text")
+        )
+        logger.info("Numeric analysis complete")
+        logger.info("Text analysis complete")
         
-        # 5. Call text analysis agent
-        print("\nRunning Text Analysis Agent...")
-        text_analysis = self.text_analysis_agent.run()
-        print("Text analysis complete")
+        # 6. Call consolidation agent (waits on both analyses)
+        logger.info("Running Consolidation Agent...")
+        consolidated_summary = await self.consolidation_agent.arun(
+            user_query, structured_query, numeric_analysis, text_analysis, structured_query_json
+        )
+        logger.info("Data consolidation complete")
         
-        # 6. Call consolidation agent
-        print("\nRunning Consolidation Agent...")
-        consolidated_summary = self.consolidation_agent.run()
-        print("Data consolidation complete")
+        return None, {
+            "user_query": user_query,
+            "structured_query": structured_query,
+            "consolidated_summary": consolidated_summary,
+            "raw_evidence": parsed_data,
+            "structured_query_json": structured_query_json
+        }, semantic_slot
+    
+    async def arun(self, raw_table: List[List[Any]], columns: List[str], user_query: str) -> str:
+        """
+        Async system flow - numeric and text analysis run concurrently since neither depends on
+        the other, and every LLM call goes through the async client
+        
+        Args:
+            raw_table: Raw CSV data (list of rows)
+            columns: List of column names
+            user_query: User query text
+            
+        Returns:
+            The final natural language response
+        """
+        cached_response, analysis, semantic_slot = await self._arun_analysis(raw_table, columns, user_query)
+        if cached_response is not None:
+            self.shared_memory.set_session_data("last_response", cached_response)
+            return cached_response
         
         # 7. Call response generation agent
-        print("\nGenerating final response...")
-        print(f"DEBUG: ResponseGenerationAgent type: {type(self.response_generation_agent)}")
-        print(f"DEBUG: ResponseGenerationAgent has run method: {hasattr(self.response_generation_agent, 'run')}")
+        logger.info("Generating final response...")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("ResponseGenerationAgent type: %s", type(self.response_generation_agent))
+            logger.debug("ResponseGenerationAgent has arun method: %s", hasattr(self.response_generation_agent, 'arun'))
 
         try:
-            response = self.response_generation_agent.run()
-            print("DEBUG: Response generation completed successfully")
+            response = await self.response_generation_agent.arun(**analysis)
+            logger.debug("Response generation completed successfully")
         except Exception as e:
-            print(f"DEBUG: Response generation failed with error: {e}")
-            print(f"DEBUG: Error type: {type(e)}")
+            logger.warning("Response generation failed with error: %s", e)
+            logger.debug("Error type: %s", type(e))
             import traceback
             traceback.print_exc()
             raise e
         
+        if semantic_slot is not None:
+            semantic_cache.set(*semantic_slot, response)
+        
         # Save response to session memory
         self.shared_memory.set_session_data("last_response", response)
         
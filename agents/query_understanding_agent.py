@@ -2,14 +2,49 @@
 Query understanding agent - takes in user query and uses LLM to understand intent
 """
 
+import logging
 import json
 import re
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 from langchain.chat_models.base import BaseChatModel
-from langchain.chains import LLMChain
-from langchain.prompts import ChatPromptTemplate
 from memory.shared_memory import SharedMemory
 from config.constants import QUERY_UNDERSTANDING_PROMPT  # Import from constants
+from config.schemas import QueryAndRouting
+from utils.llm_helpers import ainvoke_limited, run_sync, compiled_prompt, compiled_chain
+from utils.llm_cache import cache_name_for
+from utils.json_helpers import jdumps, jloads
+
+logger = logging.getLogger(__name__)
+
+# Patterns compiled once at import
+_JSON_FENCE_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+_STRENGTH_RE = re.compile(r'(\d+)\s*strengths?')
+_IMPROVEMENT_RE = re.compile(r'(\d+)\s*(?:improvements?|areas?\s*to\s*improve)')
+
+_DECODER = json.JSONDecoder()
+
+def _parse_json_response(response: str) -> Any:
+    """
+    Parse the JSON object in an LLM response: bare JSON first (the common case),
+    then a ```json fenced block, then the first object embedded in surrounding text
+    """
+    stripped = response.strip()
+    if stripped.startswith("{") and stripped.endswith("}"):
+        return jloads(stripped)
+    
+    # Look for JSON block in markdown code blocks
+    json_match = _JSON_FENCE_RE.search(response)
+    if json_match:
+        return jloads(json_match.group(1))
+    
+    # Decode the first object in place - no greedy {.*} scan needed
+    start = response.find("{")
+    if start >= 0:
+        return _DECODER.raw_decode(response, start)[0]
+    return jloads(response)
+
+def _model_dump_json(model: QueryAndRouting) -> str:
+    return model.model_dump_json()
 
 class QueryUnderstandingAgent:
     """
@@ -21,42 +56,70 @@ class QueryUnderstandingAgent:
         self.shared_memory = shared_memory
         
         # Use the enhanced prompt from constants
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("human", QUERY_UNDERSTANDING_PROMPT)
-        ])
-        self.chain = LLMChain(llm=llm, prompt=self.prompt)
+        self.prompt = compiled_prompt(QUERY_UNDERSTANDING_PROMPT)
+        self.chain = compiled_chain(llm, QUERY_UNDERSTANDING_PROMPT)
+        # Responses are cached only for deterministic (temperature 0) models
+        self.cache_name = cache_name_for(llm, "query_understanding")
+        
+        # Models with tool calling return the structured query (plus which analyses are
+        # needed) already parsed and validated; others use the JSON text chain above. The
+        # result is dumped to JSON text so it can be cached like any other response.
+        try:
+            self.structured_chain = (
+                self.prompt | llm.with_structured_output(QueryAndRouting, method="function_calling") | _model_dump_json
+            )
+        except (NotImplementedError, ValueError, TypeError):
+            self.structured_chain = None
+        self.structured_cache_name = cache_name_for(llm, "query_understanding_structured")
     
-    def run(self) -> Dict[str, Any]:
+    def run(self, user_query: Optional[str] = None) -> Dict[str, Any]:
         """
         Use LLM to understand the user's query intent with enhanced extraction
         """
-        user_query = self.shared_memory.get("user_query")
+        return run_sync(self.arun(user_query))
+    
+    async def arun(self, user_query: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Async query understanding so the LLM round-trip can overlap with data ingestion
         
-        try:
-            # CORRECTED: .invoke() returns a dict, extract the text content
-            response_dict = self.chain.invoke({"user_query": user_query})
-            
-            # Extract the actual text response from the dict
-            if isinstance(response_dict, dict):
-                response = response_dict.get("text", str(response_dict))
-            else:
-                response = str(response_dict)
+        Args:
+            user_query: User query text (read from shared memory if omitted)
+        """
+        structured_query, _ = await self.arun_with_routing(user_query)
+        return structured_query
+    
+    async def arun_with_routing(self, user_query: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, bool]]:
+        """
+        Async query understanding that also reports which downstream analyses the query needs
+        
+        Args:
+            user_query: User query text (read from shared memory if omitted)
             
-            # Extract JSON from the response
-            # Look for JSON block in markdown code blocks
-            json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # Try to find JSON-like structure in the response
-                json_match = re.search(r'\{.*\}', response, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
-                else:
-                    json_str = response
+        Returns:
+            Tuple of (structured query, {"needs_numeric": bool, "needs_text": bool}). Both
+            analyses are marked as needed unless the model returned structured output saying otherwise.
+        """
+        if user_query is None:
+            user_query = self.shared_memory.get("user_query")
+        
+        routing = {"needs_numeric": True, "needs_text": True}
+        if self.structured_chain is not None:
+            try:
+                result = jloads(await ainvoke_limited(
+                    self.structured_chain, {"user_query": user_query}, cache_name=self.structured_cache_name
+                ))
+                structured_query = result["structured_query"]
+                routing = {"needs_numeric": result["needs_numeric"], "needs_text": result["needs_text"]}
+                self._publish(structured_query)
+                return structured_query, routing
+            except Exception as e:
+                logger.warning("Structured query understanding failed, retrying as JSON text: %s", e)
+        
+        try:
+            response = await ainvoke_limited(self.chain, {"user_query": user_query}, cache_name=self.cache_name)
             
             # Parse JSON response
-            structured_query = json.loads(json_str)
+            structured_query = _parse_json_response(response)
             
             # Ensure all required fields exist with defaults
             defaults = {
@@ -74,23 +137,31 @@ class QueryUnderstandingAgent:
                 if key not in structured_query:
                     structured_query[key] = default_value
             
-            print(f"DEBUG Query Understanding:")
-            print(f"  Type: {structured_query.get('query_type')}")
-            print(f"  Focus: {structured_query.get('competency_focus')}")
-            print(f"  Temporal: {structured_query.get('temporal_dimension')}")
-            print(f"  Rotation Filters: {structured_query.get('rotation_filters')}")
-            print(f"  Numbers Requested: {structured_query.get('specific_numbers')}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Query Understanding:")
+                logger.debug("  Type: %s", structured_query.get('query_type'))
+                logger.debug("  Focus: %s", structured_query.get('competency_focus'))
+                logger.debug("  Temporal: %s", structured_query.get('temporal_dimension'))
+                logger.debug("  Rotation Filters: %s", structured_query.get('rotation_filters'))
+                logger.debug("  Numbers Requested: %s", structured_query.get('specific_numbers'))
             
         except Exception as e:
-            print(f"Query understanding failed: {e}")
-            print(f"Raw LLM response: {response if 'response' in locals() else 'No response'}")
+            logger.warning("Query understanding failed: %s", e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw LLM response: %s", response if 'response' in locals() else 'No response')
             
             # Enhanced fallback
             structured_query = self._enhanced_fallback(user_query)
         
-        # Save to shared memory
-        self.shared_memory.set("structured_query", structured_query)
-        return structured_query
+        self._publish(structured_query)
+        return structured_query, routing
+    
+    def _publish(self, structured_query: Dict[str, Any]) -> None:
+        """Save to shared memory, with the prompt-ready JSON rendered once for downstream agents"""
+        self.shared_memory.publish_many({
+            "structured_query": structured_query,
+            "structured_query_json": jdumps(structured_query)
+        })
     
     def _enhanced_fallback(self, user_query: str) -> Dict[str, Any]:
         """
@@ -124,15 +195,14 @@ class QueryUnderstandingAgent:
             query_type = "general_performance"
         
         # Extract numbers for backwards compatibility
-        import re
         strengths_requested = None
         improvements_requested = None
         
-        strength_match = re.search(r'(\d+)\s*strengths?', query_lower)
+        strength_match = _STRENGTH_RE.search(query_lower)
         if strength_match:
             strengths_requested = int(strength_match.group(1))
         
-        improvement_match = re.search(r'(\d+)\s*(?:improvements?|areas?\s*to\s*improve)', query_lower)
+        improvement_match = _IMPROVEMENT_RE.search(query_lower)
         if improvement_match:
             improvements_requested = int(improvement_match.group(1))
         
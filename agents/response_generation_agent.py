@@ -2,13 +2,48 @@
 Response generation agent - UPDATED to use enhanced prompt from constants
 """
 
-import json
-from typing import Dict, Any
+import logging
+import re
+from typing import Dict, Any, Generator, Iterator, List, Optional
 from langchain.chat_models.base import BaseChatModel
-from langchain.chains import LLMChain
-from langchain.prompts import ChatPromptTemplate
 from memory.shared_memory import SharedMemory
-from config.constants import RESPONSE_GENERATION_PROMPT  # Import from constants
+from langchain_core.output_parsers import StrOutputParser
+from config.constants import RESPONSE_GENERATION_PROMPT, RESPONSE_GENERATION_PROMPTS_BY_QUERY_TYPE  # Import from constants
+from utils.llm_helpers import ainvoke_limited, compiled_prompt_switch, run_sync, stream_cached
+from utils.llm_cache import cache_name_for
+from utils.json_helpers import jdumps
+from utils.payload import slim_for
+
+logger = logging.getLogger(__name__)
+
+# Caps applied when projecting the consolidated summary into the prompt
+MAX_PROMPT_FINDINGS = 10
+MAX_PROMPT_EVIDENCE_PER_FINDING = 3
+MAX_PROMPT_RAW_EVIDENCE = 5
+MAX_PROMPT_RAW_EVIDENCE_CHARS = 4000
+
+# Query types whose answer is a list the fallback renderer can produce without the LLM,
+# mapped to the specific_numbers field holding the requested count
+_TRIVIAL_RENDER_COUNT_FIELDS = {
+    "current_strengths": "strengths_requested",
+    "areas_for_improvement": "improvements_requested",
+}
+
+# Runs of 3+ newlines, collapsed to a single blank line
+_MULTI_NL_RE = re.compile(r'\n{3,}')
+
+# Third-person references rewritten to second person
+_PRONOUN_MAP = {
+    "The student": "You",
+    "He ": "You ",
+    "She ": "You ",
+    "His ": "Your ",
+    "Her ": "Your ",
+}
+_PRONOUN_RE = re.compile("|".join(re.escape(phrase) for phrase in _PRONOUN_MAP))
+
+def _replace_pronoun(match: "re.Match") -> str:
+    return _PRONOUN_MAP[match.group(0)]
 
 class ResponseGenerationAgent:
     """
@@ -19,76 +54,268 @@ class ResponseGenerationAgent:
         self.llm = llm
         self.shared_memory = shared_memory
         
-        # Use the enhanced prompt from constants
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("human", RESPONSE_GENERATION_PROMPT)
-        ])
-        self.chain = LLMChain(llm=llm, prompt=self.prompt)
+        # Use the enhanced prompt from constants, carrying only the response format for the query type
+        self.prompt = compiled_prompt_switch(
+            "query_type", tuple((query_type, prompt, None) for query_type, prompt in RESPONSE_GENERATION_PROMPTS_BY_QUERY_TYPE.items()),
+            RESPONSE_GENERATION_PROMPT
+        )
+        self.chain = self.prompt | llm | StrOutputParser()
+        # Responses are cached only for deterministic (temperature 0) models
+        self.cache_name = cache_name_for(llm, "response_generation")
     
-    def run(self) -> str:
+    def run(self, user_query: Optional[str] = None, structured_query: Optional[Dict[str, Any]] = None,
+            consolidated_summary: Optional[Dict[str, Any]] = None, raw_evidence: Optional[List[Dict[str, Any]]] = None,
+            structured_query_json: Optional[str] = None) -> str:
         """
         Generate final response using intelligent prompting from constants
-        """
-        # Get all the data
-        user_query = self.shared_memory.get("user_query")
-        structured_query = self.shared_memory.get("structured_query") 
-        consolidated_summary = self.shared_memory.get("consolidated_summary")
-        pattern_info = self.shared_memory.get("pattern_info", {})  # Optional
-        raw_evidence = self.shared_memory.get("parsed_data", [])
         
-        print("DEBUG: Response Generation starting...")
-        print(f"  User query: {user_query}")
-        print(f"  Consolidated summary available: {consolidated_summary is not None}")
+        Args:
+            user_query: User query text
+            structured_query: Output of the query understanding agent
+            consolidated_summary: Output of the consolidation agent
+            raw_evidence: Parsed data rows from the data ingestion agent
+            structured_query_json: Pre-serialized structured_query for the prompt
+            
+        Inputs that are omitted are read from shared memory.
+        """
+        return run_sync(self.arun(
+            user_query, structured_query, consolidated_summary, raw_evidence, structured_query_json
+        ))
+    
+    async def arun(self, user_query: Optional[str] = None, structured_query: Optional[Dict[str, Any]] = None,
+                   consolidated_summary: Optional[Dict[str, Any]] = None, raw_evidence: Optional[List[Dict[str, Any]]] = None,
+                   structured_query_json: Optional[str] = None) -> str:
+        """
+        Async version of run() - the LLM call goes through the async client, so callers
+        already on an event loop don't tie up a worker thread. Takes the same arguments as run().
+        """
+        context = self._gather_context(
+            user_query, structured_query, consolidated_summary, raw_evidence, structured_query_json
+        )
         
-        if consolidated_summary:
-            print(f"  Consolidated summary keys: {list(consolidated_summary.keys())}")
-            print(f"  Key findings count: {len(consolidated_summary.get('key_findings', []))}")
+        if self._is_trivially_renderable(context["consolidated_summary"], context["structured_query"]):
+            logger.debug("Consolidated summary answers the query directly, skipping the LLM")
+            return self._fallback_response(
+                context["user_query"], context["structured_query"], context["consolidated_summary"]
+            )
         
         try:
-            print(f"DEBUG: About to call LLM with consolidated_summary keys: {list(consolidated_summary.keys()) if consolidated_summary else 'None'}")
+            response = await ainvoke_limited(self.chain, self._llm_inputs(context), cache_name=self.cache_name)
             
-            # FIXED: Use .invoke() with proper response extraction
-            response_dict = self.chain.invoke({
-                "user_query": user_query,
-                "structured_query": json.dumps(structured_query, indent=2),
-                "consolidated_summary": json.dumps(consolidated_summary, indent=2),
-                "pattern_info": json.dumps(pattern_info, indent=2),
-                "raw_evidence": json.dumps(raw_evidence[:5], indent=2) if raw_evidence else "No raw evidence"  # Limit to prevent token overflow
-            })
-            
-            # Extract the actual text response from the dict
-            if isinstance(response_dict, dict):
-                response = response_dict.get("text", str(response_dict))
-            else:
-                response = str(response_dict)
-            
-            print("DEBUG: LLM response generation successful")
+            logger.debug("LLM response generation successful")
             
             # Clean up any formatting issues
             response = self._clean_response(response)
             
         except Exception as e:
-            print(f"DEBUG: LLM response generation failed: {e}")
+            logger.warning("LLM response generation failed: %s", e)
             
             # Simple fallback response
-            response = self._fallback_response(user_query, structured_query, consolidated_summary)
+            response = self._fallback_response(
+                context["user_query"], context["structured_query"], context["consolidated_summary"]
+            )
         
         return response
     
+    def run_stream(self, user_query: Optional[str] = None, structured_query: Optional[Dict[str, Any]] = None,
+                   consolidated_summary: Optional[Dict[str, Any]] = None, raw_evidence: Optional[List[Dict[str, Any]]] = None,
+                   structured_query_json: Optional[str] = None) -> Generator[str, None, str]:
+        """
+        Generate the final response as a stream of text chunks so callers can render it
+        as it arrives. Chunks are raw model output; the generator returns the cleaned full
+        text, as run() does. Takes the same arguments as run().
+        
+        Raises:
+            Exception: The LLM stream failed after some chunks were yielded, so the
+                streamed response is incomplete
+        """
+        context = self._gather_context(
+            user_query, structured_query, consolidated_summary, raw_evidence, structured_query_json
+        )
+        
+        if self._is_trivially_renderable(context["consolidated_summary"], context["structured_query"]):
+            logger.debug("Consolidated summary answers the query directly, skipping the LLM")
+            response = self._fallback_response(
+                context["user_query"], context["structured_query"], context["consolidated_summary"]
+            )
+            yield response
+            return response
+        
+        chunks = []
+        try:
+            for chunk in self._stream_llm(context):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            logger.warning("LLM response generation failed: %s", e)
+            if chunks:
+                # Part of the response is already out; a fallback can't replace it
+                raise
+            response = self._fallback_response(
+                context["user_query"], context["structured_query"], context["consolidated_summary"]
+            )
+            yield response
+            return response
+        
+        return self._clean_response("".join(chunks))
+    
+    def _is_trivially_renderable(self, consolidated_summary: Optional[Dict[str, Any]],
+                                 structured_query: Optional[Dict[str, Any]]) -> bool:
+        """
+        Check whether the fallback renderer can answer the query as well as the LLM would:
+        a plain "list N strengths/improvements" query with no comparison, and a consolidated
+        summary that already has a summary and at least N key findings
+        """
+        if not consolidated_summary or not structured_query:
+            return False
+        
+        count_field = _TRIVIAL_RENDER_COUNT_FIELDS.get(structured_query.get("query_type"))
+        if count_field is None or structured_query.get("comparison_elements") is not None:
+            return False
+        
+        requested = (structured_query.get("specific_numbers") or {}).get(count_field)
+        if not isinstance(requested, int) or requested <= 0:
+            return False
+        
+        key_findings = consolidated_summary.get("key_findings") or []
+        return bool(consolidated_summary.get("summary")) and len(key_findings) >= requested
+    
+    def _gather_context(self, user_query: Optional[str], structured_query: Optional[Dict[str, Any]],
+                        consolidated_summary: Optional[Dict[str, Any]], raw_evidence: Optional[List[Dict[str, Any]]],
+                        structured_query_json: Optional[str]) -> Dict[str, Any]:
+        """
+        Collect everything the response prompt needs, reading inputs not passed in from shared memory
+        """
+        if structured_query is None:
+            structured_query = self.shared_memory.get("structured_query")
+            structured_query_json = self.shared_memory.get("structured_query_json")
+        context = {
+            "user_query": user_query if user_query is not None else self.shared_memory.get("user_query"),
+            "structured_query": structured_query,
+            "structured_query_json": structured_query_json,
+            "consolidated_summary": (
+                consolidated_summary if consolidated_summary is not None else self.shared_memory.get("consolidated_summary")
+            ),
+            "pattern_info": self.shared_memory.get("pattern_info", {}),  # Optional
+            "raw_evidence": raw_evidence if raw_evidence is not None else self.shared_memory.get("parsed_data", [])
+        }
+        consolidated_summary = context["consolidated_summary"]
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Response Generation starting...")
+            logger.debug("  User query: %s", context["user_query"])
+            logger.debug("  Consolidated summary available: %s", consolidated_summary is not None)
+        
+            if consolidated_summary:
+                logger.debug("  Consolidated summary keys: %s", list(consolidated_summary.keys()))
+                logger.debug("  Key findings count: %d", len(consolidated_summary.get('key_findings', [])))
+        
+        return context
+    
+    def _stream_llm(self, context: Dict[str, Any]) -> Iterator[str]:
+        """
+        Stream the LLM response text for the gathered context
+        """
+        return stream_cached(self.chain, self._llm_inputs(context), cache_name=self.cache_name)
+    
+    def _llm_inputs(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the prompt inputs for the gathered context
+        """
+        raw_evidence = context["raw_evidence"]
+        return {
+            "user_query": context["user_query"],
+            # Selects the prompt variant
+            "query_type": (context["structured_query"] or {}).get("query_type"),
+            # Compact JSON throughout, since indentation roughly doubles the tokens
+            "structured_query": context["structured_query_json"] or jdumps(context["structured_query"]),
+            "consolidated_summary": jdumps(self._project_summary(context["consolidated_summary"])),
+            "pattern_info": jdumps(context["pattern_info"]),
+            # Limit to prevent token overflow; only the feedback fields, the scores are summarized already
+            "raw_evidence": jdumps(self._select_evidence(slim_for("response_generation", raw_evidence))) if raw_evidence else "No raw evidence"
+        }
+    
+    def _select_evidence(self, raw_evidence: List[Dict[str, Any]], max_items: int = MAX_PROMPT_RAW_EVIDENCE,
+                         max_chars: int = MAX_PROMPT_RAW_EVIDENCE_CHARS) -> List[Dict[str, Any]]:
+        """
+        Pick evidence records spread evenly across the whole list (rather than the first few
+        in ingestion order), stopping at max_items or once their JSON size reaches max_chars
+        
+        Args:
+            raw_evidence: Parsed data rows
+            max_items: Maximum number of records
+            max_chars: Character budget for the selected records' compact JSON
+            
+        Returns:
+            Selected records, in their original order. The first pick is always kept so
+            the prompt gets some evidence even when a single record exceeds the budget.
+        """
+        count = len(raw_evidence)
+        if count <= max_items:
+            candidates = raw_evidence
+        else:
+            step = count / max_items
+            candidates = [raw_evidence[int(i * step)] for i in range(max_items)]
+        
+        selected = []
+        total_chars = 0
+        for record in candidates:
+            total_chars += len(jdumps(record))
+            if selected and total_chars > max_chars:
+                break
+            selected.append(record)
+        return selected
+    
+    def _project_summary(self, consolidated_summary: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Trim the consolidated summary to the fields the response prompt uses, with capped
+        list sizes, so less is serialized and sent to the LLM
+        
+        Args:
+            consolidated_summary: Full consolidated summary from the consolidation agent
+            
+        Returns:
+            Projection with summary, key findings, numeric context, temporal analysis and evaluation count
+        """
+        if not isinstance(consolidated_summary, dict):
+            return consolidated_summary
+        
+        key_findings = []
+        for finding in consolidated_summary.get("key_findings", [])[:MAX_PROMPT_FINDINGS]:
+            if isinstance(finding, dict) and "evidence" in finding:
+                finding = dict(finding, evidence=finding["evidence"][:MAX_PROMPT_EVIDENCE_PER_FINDING])
+            key_findings.append(finding)
+        
+        projection = {
+            "summary": consolidated_summary.get("summary", ""),
+            "key_findings": key_findings
+        }
+        
+        numeric_context = consolidated_summary.get("numeric_context")
+        if isinstance(numeric_context, dict):
+            projection["numeric_context"] = {
+                key: numeric_context[key] for key in ("relevant_scores", "trends") if key in numeric_context
+            }
+        
+        # Temporal queries are answered from the time span / progression narrative
+        if consolidated_summary.get("temporal_analysis"):
+            projection["temporal_analysis"] = consolidated_summary["temporal_analysis"]
+        
+        data_quality = consolidated_summary.get("data_quality")
+        if isinstance(data_quality, dict) and "total_evaluations" in data_quality:
+            projection["data_quality"] = {"total_evaluations": data_quality["total_evaluations"]}
+        
+        return projection
+    
     def _clean_response(self, response: str) -> str:
         """
         Clean up the response for consistency
         """
-        # Fix any third-person references
-        response = response.replace("The student", "You")
-        response = response.replace("He ", "You ")
-        response = response.replace("She ", "You ")
-        response = response.replace("His ", "Your ")
-        response = response.replace("Her ", "Your ")
+        # Fix any third-person references (single pass over the text)
+        response = _PRONOUN_RE.sub(_replace_pronoun, response)
         
         # Clean up extra whitespace
-        import re
-        response = re.sub(r'\n{3,}', '\n\n', response)  # Max 2 newlines
+        response = _MULTI_NL_RE.sub('\n\n', response)  # Max 2 newlines
         response = response.strip()
         
         return response
@@ -98,22 +325,22 @@ class ResponseGenerationAgent:
         """
         Create a simple fallback response when LLM fails
         """
-        print("DEBUG: Using fallback response generation")
+        logger.debug("Using fallback response generation")
         
         if not consolidated_summary:
             return f"I apologize, but I wasn't able to analyze your clinical performance data for the query: '{user_query}'. Please try rephrasing your question."
         
-        response = f"# Response to: {user_query}\n\n"
+        parts = [f"# Response to: {user_query}\n\n"]
         
         # Extract key findings from the consolidated summary
         key_findings = consolidated_summary.get("key_findings", [])
         summary = consolidated_summary.get("summary", "")
         
         if summary:
-            response += f"{summary}\n\n"
+            parts.append(f"{summary}\n\n")
         
         if key_findings:
-            response += "## Key Findings:\n\n"
+            parts.append("## Key Findings:\n\n")
             
             for i, finding in enumerate(key_findings, 1):
                 category = finding.get("category", "finding")
@@ -122,37 +349,37 @@ class ResponseGenerationAgent:
                 confidence = finding.get("confidence", "medium")
                 source_count = finding.get("source_count", "multiple evaluators")
                 
-                response += f"**{i}. {title}**\n\n"
+                parts.append(f"**{i}. {title}**\n\n")
                 
                 if description:
-                    response += f"Analysis: {description}\n\n"
+                    parts.append(f"Analysis: {description}\n\n")
                 
                 # Add evidence if available
                 evidence = finding.get("evidence", [])
                 if evidence:
-                    response += "Supporting Evidence:\n"
+                    parts.append("Supporting Evidence:\n")
                     for quote in evidence[:3]:  # Limit to 3 quotes
                         if quote:
-                            response += f"- \"{quote}\"\n"
-                    response += "\n"
+                            parts.append(f"- \"{quote}\"\n")
+                    parts.append("\n")
                 
-                response += f"Confidence: {confidence.title()} (based on {source_count})\n\n"
+                parts.append(f"Confidence: {confidence.title()} (based on {source_count})\n\n")
         
         # Add numeric context if available
         numeric_context = consolidated_summary.get("numeric_context", {})
         if numeric_context:
             relevant_scores = numeric_context.get("relevant_scores", {})
             if relevant_scores:
-                response += "## Related Performance Scores:\n\n"
+                parts.append("## Related Performance Scores:\n\n")
                 for score_name, score_value in relevant_scores.items():
                     if score_value is not None:
-                        response += f"- {score_name.upper()}: {score_value}\n"
-                response += "\n"
+                        parts.append(f"- {score_name.upper()}: {score_value}\n")
+                parts.append("\n")
         
         # Add data quality note
         data_quality = consolidated_summary.get("data_quality", {})
         if data_quality:
             evaluator_count = data_quality.get("total_evaluations", "Multiple evaluators")
-            response += f"*Based on feedback from {evaluator_count}.*\n"
+            parts.append(f"*Based on feedback from {evaluator_count}.*\n")
         
-        return response
\ No newline at end of file
+        return "".join(parts)
\ No newline at end of file
@@ -2,15 +2,177 @@
 Text analysis agent
 """
 
-import json
+import bisect
+import logging
 import re
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterable, List, Optional, Tuple, Union
+from collections import defaultdict
 from datetime import datetime
+from functools import lru_cache
+from itertools import compress, product, zip_longest
+import pandas as pd
 from langchain.chat_models.base import BaseChatModel
-from langchain.chains import LLMChain
-from langchain.prompts import ChatPromptTemplate
 from memory.shared_memory import SharedMemory
-from config.constants import TEXT_ANALYSIS_PROMPT  
+from config.constants import TEXT_ANALYSIS_PROMPT, MAX_CONCURRENT_LLM_CALLS
+from config.rubrics import TEXT_ANALYSIS_RUBRIC, TEXT_ANALYSIS_RUBRIC_NON_TEMPORAL
+from config.keywords import HIGH_RELEVANCE_RE, MEDIUM_RELEVANCE_RE, EXCLUSION_RE
+from langchain_core.output_parsers import StrOutputParser
+from utils.llm_helpers import astream_json_limited, run_sync, compiled_prompt_switch
+from utils.llm_cache import cache_name_for, llm_cache
+from utils.json_helpers import jdumps, jloads, extract_json_block
+from utils.payload import PROMPT_FIELDS, slim_for, slim_row
+from utils.data_helpers import matches_any_term
+
+logger = logging.getLogger(__name__)
+
+_JSON_FENCE_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+
+# Evidence date layouts accepted by _calculate_pattern_confidence: %Y-%m-%d, %m/%d/%Y, %m/%d/%y
+_EVIDENCE_DATE_RE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})|(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})')
+
+# Suffix stripped from rotation (form) names before comparing them
+_ROTATION_NAME_SUFFIX = "clinical performance assessment"
+
+# Confidence bands: a score at or above _CONF_THRESHOLDS[i] earns _CONF_LABELS[i + 1]
+_CONF_THRESHOLDS = (0.15, 0.35, 0.60, 0.80)
+_CONF_LABELS = ("low", "low-medium", "medium", "medium-high", "high")
+
+# Confidence description phrases, built once instead of per pattern
+_EVALUATOR_COUNT_DESC = {n: f"{n} evaluator{'s' if n != 1 else ''}" for n in range(1, 21)}
+_ROTATION_COUNT_DESC = {0: "unknown rotations", **{n: f"{n} rotation{'s' if n != 1 else ''}" for n in range(1, 21)}}
+# (cross-rotation, temporal, role diversity) flags -> boost suffix
+_BOOST_NAMES = ("cross-rotation consistency", "temporal consistency", "role diversity")
+_BOOST_DESC = {
+    flags: f" (boosted by {', '.join(compress(_BOOST_NAMES, flags))})" if any(flags) else ""
+    for flags in product((False, True), repeat=3)
+}
+
+# Fewest evidence items that can reach the default confidence threshold (0.15): a single
+# item scores 0.1 and can earn at most the 1.1 role-diversity boost, so it is always dropped
+_MIN_THRESHOLD_EVIDENCE = 2
+
+# Keyword-based relevance used by the fallback analysis
+_RELEVANT_KEYWORDS = {
+    "clinical_reasoning": ["reasoning", "diagnostic", "differential", "decision", "analysis", "thinking", "succinct", "decisive", "assessment", "plan"],
+    "communication": ["communication", "listening", "patient interaction", "bedside manner", "empathy", "compassion"],
+    "professionalism": ["professional", "reliability", "ethics", "responsibility", "punctual", "integrity", "feedback"],
+    "patient_care": ["patient care", "bedside manner", "empathy", "compassion", "advocacy"],
+    "presentation_skills": ["presentation", "presenting", "oral", "rounds"],
+    "teamwork": ["team", "collaboration", "teamwork", "interaction"]
+}
+
+# Keywords as tuples for substring checks against lowercased text
+_RELEVANT_KEYWORD_TUPLES = {
+    competency: tuple(keywords) for competency, keywords in _RELEVANT_KEYWORDS.items()
+}
+
+def _contains_keyword(text_lower: str, keywords: tuple) -> bool:
+    return any(keyword in text_lower for keyword in keywords)
+
+# Rows of (filtered) data included in the LLM prompt
+_PROMPT_SAMPLE_SIZE = 10
+
+# Fallback pattern text is the first comment in the group, truncated
+_PATTERN_TEXT_MAX_CHARS = 150
+_PATTERN_TEXT_SUFFIX = "..."
+
+@lru_cache(maxsize=4096)
+def _parse_evidence_date(date_str: str) -> Optional[datetime]:
+    """
+    Parse an evidence date, picking the format from its shape instead of trying each in turn.
+    Cached because the same dates recur across patterns.
+    """
+    match = _EVIDENCE_DATE_RE.fullmatch(date_str)
+    if match is None:
+        return None
+    
+    iso_year, iso_month, iso_day, month, day, year = match.groups()
+    try:
+        if iso_year is not None:
+            return datetime(int(iso_year), int(iso_month), int(iso_day))
+        year_value = int(year)
+        if len(year) == 2:
+            # Same pivot as strptime's %y
+            year_value += 1900 if year_value >= 69 else 2000
+        return datetime(year_value, int(month), int(day))
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=1024)
+def _clean_rotation_name(rotation: str) -> str:
+    """
+    Rotation name as compared across evidence, cached since a dataset has only a few rotations
+    """
+    return rotation.lower().replace(_ROTATION_NAME_SUFFIX, "").strip()
+
+@lru_cache(maxsize=256)
+def _role_flags(role: str) -> Tuple[bool, bool]:
+    """
+    (is resident, is attending) for an evaluator role, cached since only a few roles occur
+    """
+    role = role.lower()
+    return "resident" in role, "attending" in role
+
+def _stratified_sample(rows: List[Dict[str, Any]], k: int, key: str = "form_name") -> List[Dict[str, Any]]:
+    """
+    Pick up to k rows spread across the distinct values of key (round-robin over the groups
+    in first-seen order), returned in their original order
+    
+    Args:
+        rows: Rows to sample from
+        k: Maximum number of rows
+        key: Field to stratify by
+        
+    Returns:
+        The sampled rows
+    """
+    if len(rows) <= k:
+        return rows
+    
+    # Only the first k rows of each group can ever be picked
+    groups = defaultdict(list)
+    for index, row in enumerate(rows):
+        group = groups[row.get(key)]
+        if len(group) < k:
+            group.append(index)
+    
+    picked = []
+    for round_rows in zip_longest(*groups.values()):
+        picked.extend(index for index in round_rows if index is not None)
+        if len(picked) >= k:
+            break
+    return [rows[index] for index in sorted(picked[:k])]
+
+def _reasoning_relevance(row: Dict[str, Any]) -> str:
+    """
+    Tag a row's comments with the clinical reasoning rubric tiers: "high" or "medium" when they
+    contain a listed reasoning term, "exclude" when they only contain general-trait terms, else "low"
+    """
+    text = " ".join(
+        row[field] for field in ("strengths_comment", "improvements_comment") if isinstance(row.get(field), str)
+    ).lower()
+    if HIGH_RELEVANCE_RE.search(text):
+        return "high"
+    if MEDIUM_RELEVANCE_RE.search(text):
+        return "medium"
+    return "exclude" if EXCLUSION_RE.search(text) else "low"
+
+def _reasoning_prompt_rows(rows: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+    """
+    Prompt rows for a clinical reasoning query: excluded rows are dropped, rows with reasoning
+    terms fill the sample first and the rest only pad it. Each row carries its "relevance" tag,
+    leaving the LLM to judge nuance rather than scan for keywords.
+    """
+    tags = [_reasoning_relevance(row) for row in rows]
+    relevant = [row for row, tag in zip(rows, tags) if tag in ("high", "medium")]
+    other = [row for row, tag in zip(rows, tags) if tag == "low"]
+    picked = _stratified_sample(relevant, k)
+    if len(picked) < k:
+        picked = picked + _stratified_sample(other, k - len(picked))
+    
+    tag_by_row = {id(row): tag for row, tag in zip(rows, tags)}
+    fields = PROMPT_FIELDS["text_analysis"]
+    return [{**slim_row(row, fields), "relevance": tag_by_row[id(row)]} for row in picked]
 
 class TextAnalysisAgent:
     """
@@ -21,106 +183,213 @@ class TextAnalysisAgent:
         self.llm = llm
         self.shared_memory = shared_memory
         
-        # Use the enhanced prompt from constants
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("human", TEXT_ANALYSIS_PROMPT)
-        ])
-        self.chain = LLMChain(llm=llm, prompt=self.prompt)
+        # Use the enhanced prompt from constants, with the relevance rubric as a system message;
+        # the temporal rules are left out of it for queries without a temporal dimension
+        self.prompt = compiled_prompt_switch(
+            "temporal_dimension", ((False, TEXT_ANALYSIS_PROMPT, TEXT_ANALYSIS_RUBRIC_NON_TEMPORAL),),
+            TEXT_ANALYSIS_PROMPT, TEXT_ANALYSIS_RUBRIC
+        )
+        self.chain = self.prompt | llm | StrOutputParser()
+        # Final analyses are cached only for deterministic (temperature 0) models; the prompt
+        # and rubric version is part of the name so edits don't reuse stale results
+        self.cache_name = cache_name_for(llm, "text_analysis")
     
-    def run(self) -> Dict[str, Any]:
+    def run(self, user_query: Optional[str] = None, structured_query: Optional[Dict[str, Any]] = None,
+            parsed_data: Optional[List[Dict[str, Any]]] = None, parsed_frame: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
         """
         Analyze text comments with enhanced query-specific relevance filtering
         """
-        # Get query context from shared memory
-        user_query = self.shared_memory.get("user_query")
-        structured_query = self.shared_memory.get("structured_query")
-        parsed_data = self.shared_memory.get("parsed_data")
+        return run_sync(self.arun(user_query, structured_query, parsed_data, parsed_frame))
+    
+    async def arun(self, user_query: Optional[str] = None, structured_query: Optional[Dict[str, Any]] = None,
+                   parsed_data: Optional[List[Dict[str, Any]]] = None, parsed_frame: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
+        """
+        Async text analysis so the LLM round-trip can overlap with numeric analysis
+        
+        Args:
+            user_query: User query text
+            structured_query: Output of the query understanding agent
+            parsed_data: Output of the data ingestion agent
+            parsed_frame: Columnar view of parsed_data, used by the fallback analysis
+            
+        Inputs that are omitted are read from shared memory; parsed_frame is only read
+        from there along with parsed_data, so both always describe the same rows.
+        """
+        # Get query context from shared memory when not passed in
+        memory = self.shared_memory.get_many(("user_query", "structured_query", "parsed_data", "parsed_frame"))
+        if user_query is None:
+            user_query = memory["user_query"]
+        if structured_query is None:
+            structured_query = memory["structured_query"]
+        if parsed_data is None:
+            parsed_data = memory["parsed_data"]
+            parsed_frame = memory["parsed_frame"]
         
         if not structured_query:
-            print("ERROR: No structured query found. Query understanding must run first.")
+            logger.error("No structured query found. Query understanding must run first.")
             return {}
         
         # Apply rotation filtering if specified
         filtered_data = self._apply_filters(parsed_data, structured_query)
         
-        # Extract query context for the prompt
-        query_type = structured_query.get("query_type", "general_performance")
-        competency_focus = structured_query.get("competency_focus")
-        temporal_dimension = structured_query.get("temporal_dimension", False)
-        rotation_filters = structured_query.get("rotation_filters", [])
-        epa_filters = structured_query.get("epa_filters", [])
-        specific_numbers = structured_query.get("specific_numbers", {})
-        evidence_criteria = structured_query.get("evidence_criteria", "Any relevant feedback")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Text Analysis - Query Context:")
+            logger.debug("  Original query: %s", user_query)
+            logger.debug("  Query type: %s", structured_query.get("query_type", "general_performance"))
+            logger.debug("  Competency focus: %s", structured_query.get("competency_focus"))
+            logger.debug("  Filtered data: %d records", len(filtered_data))
         
-        print(f"DEBUG Text Analysis - Query Context:")
-        print(f"  Original query: {user_query}")
-        print(f"  Query type: {query_type}")
-        print(f"  Competency focus: {competency_focus}")
-        print(f"  Filtered data: {len(filtered_data)} records")
+        payload = self._build_inputs(user_query, structured_query, filtered_data)
         
         try:
-            # Use .invoke() with proper response extraction
-            response_dict = self.chain.invoke({
-                "user_query": user_query,
-                "query_type": query_type,
-                "competency_focus": competency_focus or "general",
-                "temporal_dimension": temporal_dimension,
-                "rotation_filters": rotation_filters,
-                "epa_filters": epa_filters,
-                "specific_numbers": specific_numbers,
-                "evidence_criteria": evidence_criteria,
-                "parsed_data": json.dumps(filtered_data[:10], indent=2)  # Limit to prevent token overflow
-            })
-            
-            # Extract the actual text response from the dict
-            if isinstance(response_dict, dict):
-                response = response_dict.get("text", str(response_dict))
-            else:
-                response = str(response_dict)
-            
-            # Extract JSON from the response
-            # Look for JSON block in markdown code blocks
-            json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # Try to find JSON-like structure in the response
-                json_match = re.search(r'\{.*\}', response, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
-                else:
-                    # If still no JSON found, try the whole response
-                    json_str = response
-            
-            # Parse LLM response
-            text_analysis = json.loads(json_str)
+            text_analysis = await self._cached_invoke(payload)
             
-            # ENHANCED: Apply pattern confidence calculation to LLM results
-            text_analysis = self._enhance_with_pattern_confidence(text_analysis)
-            
-            print(f"DEBUG Text Analysis Results:")
-            print(f"  Relevant feedback found: {text_analysis.get('relevant_feedback_found')}")
-            if text_analysis.get('competency_analysis'):
-                strengths = text_analysis['competency_analysis'].get('strengths', [])
-                improvements = text_analysis['competency_analysis'].get('improvements', [])
-                print(f"  Strengths found: {len(strengths)}")
-                print(f"  Improvements found: {len(improvements)}")
-            
-            # Apply number limitations if requested
-            text_analysis = self._apply_number_limits(text_analysis, specific_numbers)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Text Analysis Results:")
+                logger.debug("  Relevant feedback found: %s", text_analysis.get('relevant_feedback_found'))
+                if text_analysis.get('competency_analysis'):
+                    strengths = text_analysis['competency_analysis'].get('strengths', [])
+                    improvements = text_analysis['competency_analysis'].get('improvements', [])
+                    logger.debug("  Strengths found: %d", len(strengths))
+                    logger.debug("  Improvements found: %d", len(improvements))
             
         except Exception as e:
-            print(f"LLM text analysis failed: {e}")
-            print(f"Raw LLM response: {response if 'response' in locals() else 'No response'}")
+            logger.warning("LLM text analysis failed: %s", e)
             
             # ENHANCED FALLBACK: With proper pattern confidence calculation
-            text_analysis = self._enhanced_fallback_analysis(filtered_data, structured_query)
+            text_analysis = self._enhanced_fallback_analysis(
+                self._apply_filters(parsed_frame, structured_query) if parsed_frame is not None else filtered_data,
+                structured_query
+            )
         
         # Save to shared memory
-        self.shared_memory.set("text_analysis", text_analysis)
+        self.shared_memory.publish("text_analysis", text_analysis)
         
         return text_analysis
     
+    def run_many(self, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Analyze several queries (e.g. one per competency focus) with one batched LLM call so
+        the provider can reuse connections and its cached prompt prefix
+        
+        Args:
+            queries: Dicts with "user_query", "structured_query" and "parsed_data"
+            
+        Returns:
+            Text analysis per query, in input order
+        """
+        filtered = [
+            self._apply_filters(q.get("parsed_data") or [], q.get("structured_query") or {})
+            for q in queries
+        ]
+        payloads = [
+            self._build_inputs(q.get("user_query"), q.get("structured_query") or {}, filtered_data)
+            for q, filtered_data in zip(queries, filtered)
+        ]
+        
+        # Only payloads without a cached final result go to the LLM
+        cache_keys = [llm_cache.cache_key(self.cache_name, p) if self.cache_name else None for p in payloads]
+        results: List[Optional[Dict[str, Any]]] = [
+            jloads(cached) if key and (cached := llm_cache.get(key)) is not None else None
+            for key in cache_keys
+        ]
+        pending = [index for index, result in enumerate(results) if result is None]
+        responses = self.chain.batch(
+            [payloads[index] for index in pending],
+            config={"max_concurrency": MAX_CONCURRENT_LLM_CALLS}, return_exceptions=True
+        )
+        
+        for index, response in zip(pending, responses):
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                results[index] = self._finalize_response(response, payloads[index], cache_keys[index])
+            except Exception as e:
+                logger.warning("LLM text analysis failed: %s", e)
+                results[index] = self._enhanced_fallback_analysis(
+                    filtered[index], queries[index].get("structured_query") or {}
+                )
+        return results
+    
+    def _build_inputs(self, user_query: str, structured_query: Dict[str, Any],
+                      filtered_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Build the prompt input variables for one query
+        
+        Args:
+            filtered_data: parsed_data rows left after the query's rotation filters
+        """
+        return {
+            "user_query": user_query,
+            "query_type": structured_query.get("query_type", "general_performance"),
+            "competency_focus": structured_query.get("competency_focus") or "general",
+            "temporal_dimension": structured_query.get("temporal_dimension", False),
+            "rotation_filters": structured_query.get("rotation_filters", []),
+            "epa_filters": structured_query.get("epa_filters", []),
+            "specific_numbers": structured_query.get("specific_numbers", {}),
+            "evidence_criteria": structured_query.get("evidence_criteria", "Any relevant feedback"),
+            # Limit to prevent token overflow; compact JSON since indentation roughly doubles the tokens
+            "parsed_data": jdumps(
+                _reasoning_prompt_rows(filtered_data, _PROMPT_SAMPLE_SIZE)
+                if structured_query.get("competency_focus") == "clinical_reasoning" else
+                slim_for("text_analysis", _stratified_sample(filtered_data, _PROMPT_SAMPLE_SIZE))
+            )
+        }
+    
+    async def _cached_invoke(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Run the LLM and post-process its answer into the final text analysis, reusing a
+        cached final result for an identical payload when the model is deterministic
+        
+        Args:
+            payload: Prompt input variables
+            
+        Returns:
+            Text analysis with pattern confidence and number limits applied
+        """
+        cache_key = llm_cache.cache_key(self.cache_name, payload) if self.cache_name else None
+        if cache_key:
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                # Stored serialized so callers can't mutate the cached copy
+                return jloads(cached)
+        
+        # Stop reading once the JSON object has closed rather than waiting for trailing prose
+        response = await astream_json_limited(self.chain, payload)
+        return self._finalize_response(response, payload, cache_key)
+    
+    def _finalize_response(self, response: str, payload: Dict[str, Any], cache_key: Optional[str]) -> Dict[str, Any]:
+        """
+        Parse an LLM response into the final text analysis and cache it under cache_key, if any
+        """
+        try:
+            # Extract JSON from the response: the first balanced {...} object (this also
+            # finds objects inside markdown code blocks)
+            json_str = extract_json_block(response)
+            if json_str is None:
+                # Look for JSON block in markdown code blocks
+                json_match = _JSON_FENCE_RE.search(response)
+                # If still no JSON found, try the whole response
+                json_str = json_match.group(1) if json_match else response
+            
+            # Parse LLM response
+            text_analysis = jloads(json_str)
+            self._normalize_patterns(text_analysis.get("competency_analysis"))
+        except Exception:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw LLM response: %s", response)
+            raise
+        
+        # ENHANCED: Apply pattern confidence calculation to LLM results
+        text_analysis = self._enhance_with_pattern_confidence(text_analysis)
+        
+        # Apply number limitations if requested
+        text_analysis = self._apply_number_limits(text_analysis, payload["specific_numbers"])
+        
+        if cache_key:
+            llm_cache.set(cache_key, jdumps(text_analysis))
+        return text_analysis
+    
     def _calculate_pattern_confidence(self, supporting_evidence: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
         Calculate pattern confidence based on evaluator consensus and validation multipliers
@@ -153,16 +422,30 @@ class TextAnalysisAgent:
         # Context Validation Multipliers
         multiplier = 1.0
         
-        # Cross-rotation consistency check
+        # Collect rotations, dates and evaluator roles in one pass over the evidence
         unique_rotations = set()
+        unique_dates = set()
+        has_resident = False
+        has_attending = False
         for evidence in supporting_evidence:
             rotation = evidence.get("rotation", "Unknown")
             if rotation != "Unknown":
                 # Clean rotation name for comparison
-                clean_rotation = rotation.lower().replace("clinical performance assessment", "").strip()
+                clean_rotation = _clean_rotation_name(rotation)
                 if clean_rotation:
                     unique_rotations.add(clean_rotation)
+            
+            date = evidence.get("date", "")
+            if date and date != "Unknown date":
+                unique_dates.add(date)
+            
+            role = evidence.get("evaluator_role", "Unknown")
+            if role != "Unknown":
+                is_resident, is_attending = _role_flags(role)
+                has_resident = has_resident or is_resident
+                has_attending = has_attending or is_attending
         
+        # Cross-rotation consistency check
         rotation_count = len(unique_rotations)
         if rotation_count >= 3:
             multiplier *= 1.3  # Strong cross-rotation consistency
@@ -171,23 +454,12 @@ class TextAnalysisAgent:
         # rotation_count == 1 gets no boost
         
         # Temporal consistency check (if dates available)
-        unique_dates = set()
-        for evidence in supporting_evidence:
-            date = evidence.get("date", "")
-            if date and date != "Unknown date":
-                unique_dates.add(date)
-        
         if len(unique_dates) >= 2:
             # Check if dates span multiple months (basic temporal consistency)
             try:
-                parsed_dates = []
-                for date_str in unique_dates:
-                    for fmt in ["%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y"]:
-                        try:
-                            parsed_dates.append(datetime.strptime(date_str, fmt))
-                            break
-                        except ValueError:
-                            continue
+                parsed_dates = [
+                    parsed for parsed in map(_parse_evidence_date, unique_dates) if parsed is not None
+                ]
                 
                 if len(parsed_dates) >= 2:
                     # Check if dates span more than 30 days
@@ -200,17 +472,7 @@ class TextAnalysisAgent:
                 # If date parsing fails, give small boost for having multiple dates
                 multiplier *= 1.1
         
-        # Role diversity check
-        unique_roles = set()
-        for evidence in supporting_evidence:
-            role = evidence.get("evaluator_role", "Unknown")
-            if role != "Unknown":
-                unique_roles.add(role.lower())
-        
-        # Check if both residents and attendings are represented
-        has_resident = any("resident" in role for role in unique_roles)
-        has_attending = any("attending" in role for role in unique_roles)
-        
+        # Role diversity check - both residents and attendings represented
         if has_resident and has_attending:
             multiplier *= 1.1  # Role diversity boost
         
@@ -219,33 +481,15 @@ class TextAnalysisAgent:
         final_score = min(1.0, final_score)  # Cap at 1.0
         
         # Determine confidence level
-        if final_score >= 0.8:
-            confidence_level = "high"
-        elif final_score >= 0.6:
-            confidence_level = "medium-high"
-        elif final_score >= 0.35:
-            confidence_level = "medium"
-        elif final_score >= 0.15:
-            confidence_level = "low-medium"
-        else:
-            confidence_level = "low"
-        
-        # Create description
-        rotation_desc = f"{rotation_count} rotation{'s' if rotation_count != 1 else ''}" if rotation_count > 0 else "unknown rotations"
-        
-        description = f"{evaluator_count} evaluator{'s' if evaluator_count != 1 else ''} across {rotation_desc}"
+        confidence_level = _CONF_LABELS[bisect.bisect_right(_CONF_THRESHOLDS, final_score)]
         
+        # Create description from the precomputed phrases
+        description = (
+            f"{_EVALUATOR_COUNT_DESC.get(evaluator_count) or f'{evaluator_count} evaluators'} across "
+            f"{_ROTATION_COUNT_DESC.get(rotation_count) or f'{rotation_count} rotations'}"
+        )
         if multiplier > 1.0:
-            boosts = []
-            if rotation_count >= 2:
-                boosts.append("cross-rotation consistency")
-            if len(unique_dates) >= 2:
-                boosts.append("temporal consistency")
-            if has_resident and has_attending:
-                boosts.append("role diversity")
-            
-            if boosts:
-                description += f" (boosted by {', '.join(boosts)})"
+            description += _BOOST_DESC[(rotation_count >= 2, len(unique_dates) >= 2, has_resident and has_attending)]
         
         return {
             "confidence": confidence_level,
@@ -253,12 +497,12 @@ class TextAnalysisAgent:
             "description": description
         }
     
-    def _filter_by_confidence_threshold(self, patterns: List[Dict[str, Any]], min_confidence_score: float = 0.15) -> List[Dict[str, Any]]:
+    def _filter_by_confidence_threshold(self, patterns: Iterable[Dict[str, Any]], min_confidence_score: float = 0.15) -> List[Dict[str, Any]]:
         """
         Filter out low-confidence patterns below threshold
         
         Args:
-            patterns: List of pattern dictionaries with confidence scores
+            patterns: Pattern dictionaries with confidence scores (any iterable)
             min_confidence_score: Minimum confidence score to include
             
         Returns:
@@ -275,6 +519,19 @@ class TextAnalysisAgent:
         
         return filtered_patterns
     
+    def _normalize_patterns(self, comp_analysis: Optional[Dict[str, Any]]) -> None:
+        """
+        Convert bare-string strengths/improvements from the LLM into pattern dicts, in place
+        """
+        if not comp_analysis:
+            return
+        for key in ("strengths", "improvements"):
+            if key in comp_analysis:
+                comp_analysis[key] = [
+                    {"pattern_text": pattern, "supporting_evidence": []} if isinstance(pattern, str) else pattern
+                    for pattern in comp_analysis[key]
+                ]
+    
     def _enhance_with_pattern_confidence(self, text_analysis: Dict[str, Any]) -> Dict[str, Any]:
         """
         Enhance LLM results with pattern confidence calculations
@@ -284,140 +541,56 @@ class TextAnalysisAgent:
         
         comp_analysis = text_analysis["competency_analysis"]
         
-        # Calculate pattern confidence for strengths
-        if "strengths" in comp_analysis:
-            enhanced_strengths = []
-            for strength in comp_analysis["strengths"]:
-                # Handle case where strength is just a string
-                if isinstance(strength, str):
-                    strength_dict = {
-                        "pattern_text": strength,
-                        "supporting_evidence": []
-                    }
-                else:
-                    strength_dict = strength
-                
-                supporting_evidence = strength_dict.get("supporting_evidence", [])
-                confidence_info = self._calculate_pattern_confidence(supporting_evidence)
-                
-                strength_dict["confidence"] = confidence_info["confidence"]
-                strength_dict["confidence_info"] = confidence_info
-                strength_dict["confidence_description"] = confidence_info["description"]
-                enhanced_strengths.append(strength_dict)
-            
-            comp_analysis["strengths"] = enhanced_strengths
-        
-        # Calculate pattern confidence for improvements
-        if "improvements" in comp_analysis:
-            enhanced_improvements = []
-            for improvement in comp_analysis["improvements"]:
-                # Handle case where improvement is just a string
-                if isinstance(improvement, str):
-                    improvement_dict = {
-                        "pattern_text": improvement,
-                        "supporting_evidence": []
-                    }
-                else:
-                    improvement_dict = improvement
-                
-                supporting_evidence = improvement_dict.get("supporting_evidence", [])
-                confidence_info = self._calculate_pattern_confidence(supporting_evidence)
-                
-                improvement_dict["confidence"] = confidence_info["confidence"]
-                improvement_dict["confidence_info"] = confidence_info
-                improvement_dict["confidence_description"] = confidence_info["description"]
-                enhanced_improvements.append(improvement_dict)
-            
-            comp_analysis["improvements"] = enhanced_improvements
-        
-        # Filter by confidence threshold
-        if "strengths" in comp_analysis:
-            comp_analysis["strengths"] = self._filter_by_confidence_threshold(comp_analysis["strengths"])
-        if "improvements" in comp_analysis:
-            comp_analysis["improvements"] = self._filter_by_confidence_threshold(comp_analysis["improvements"])
+        # Score and threshold each list in a single pass (patterns are dicts, see _normalize_patterns)
+        for key in ("strengths", "improvements"):
+            if key in comp_analysis:
+                # Patterns too thinly supported to pass the threshold are dropped unscored
+                comp_analysis[key] = self._filter_by_confidence_threshold(map(self._score_pattern, (
+                    pattern for pattern in comp_analysis[key]
+                    if len(pattern.get("supporting_evidence") or ()) >= _MIN_THRESHOLD_EVIDENCE
+                )))
         
         return text_analysis
     
-    def _enhanced_fallback_analysis(self, parsed_data: List[Dict[str, Any]], structured_query: Dict[str, Any]) -> Dict[str, Any]:
+    def _score_pattern(self, pattern: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Attach confidence fields to a pattern dict in place and return it
+        """
+        confidence_info = self._calculate_pattern_confidence(pattern.get("supporting_evidence", []))
+        pattern["confidence"] = confidence_info["confidence"]
+        pattern["confidence_info"] = confidence_info
+        pattern["confidence_description"] = confidence_info["description"]
+        return pattern
+    
+    def _enhanced_fallback_analysis(self, parsed_data: Union[pd.DataFrame, List[Dict[str, Any]]],
+                                    structured_query: Dict[str, Any]) -> Dict[str, Any]:
         """
         ENHANCED fallback analysis with proper pattern confidence calculation
+        
+        Args:
+            parsed_data: Parsed frame from data ingestion, or legacy parsed_data rows
+            structured_query: Output of the query understanding agent
         """
-        print("Using enhanced fallback text analysis with pattern confidence...")
+        logger.debug("Using enhanced fallback text analysis with pattern confidence...")
         
         competency_focus = structured_query.get("competency_focus")
         temporal_dimension = structured_query.get("temporal_dimension", False)
         
-        # Enhanced keyword-based relevance for fallback
-        relevant_keywords = {
-            "clinical_reasoning": ["reasoning", "diagnostic", "differential", "decision", "analysis", "thinking", "succinct", "decisive", "assessment", "plan"],
-            "communication": ["communication", "listening", "patient interaction", "bedside manner", "empathy", "compassion"],
-            "professionalism": ["professional", "reliability", "ethics", "responsibility", "punctual", "integrity", "feedback"],
-            "patient_care": ["patient care", "bedside manner", "empathy", "compassion", "advocacy"],
-            "presentation_skills": ["presentation", "presenting", "oral", "rounds"],
-            "teamwork": ["team", "collaboration", "teamwork", "interaction"]
-        }
+        df = parsed_data if isinstance(parsed_data, pd.DataFrame) else pd.DataFrame(parsed_data)
         
         # Group similar feedback by pattern
-        strength_patterns = {}
-        improvement_patterns = {}
-        
-        for row in parsed_data:
-            # Process strengths
-            strength_text = row.get("strengths_comment", "")
-            if strength_text and self._is_relevant_text(strength_text, competency_focus, relevant_keywords):
-                # Simple pattern grouping by first few words
-                pattern_key = " ".join(strength_text.split()[:5]).lower()
-                
-                if pattern_key not in strength_patterns:
-                    strength_patterns[pattern_key] = {
-                        "pattern_text": strength_text[:150] + "..." if len(strength_text) > 150 else strength_text,
-                        "supporting_evidence": []
-                    }
-                
-                strength_patterns[pattern_key]["supporting_evidence"].append({
-                    "text": strength_text,
-                    "evaluator_role": row.get("evaluator_role", "Unknown"),
-                    "rotation": row.get("form_name", "Unknown rotation"),
-                    "date": row.get("release_date_str", "Unknown date"),
-                    "relevance_score": "medium"
-                })
-            
-            # Process improvements
-            improvement_text = row.get("improvements_comment", "")
-            if improvement_text and self._is_relevant_text(improvement_text, competency_focus, relevant_keywords):
-                # Simple pattern grouping by first few words
-                pattern_key = " ".join(improvement_text.split()[:5]).lower()
-                
-                if pattern_key not in improvement_patterns:
-                    improvement_patterns[pattern_key] = {
-                        "pattern_text": improvement_text[:150] + "..." if len(improvement_text) > 150 else improvement_text,
-                        "supporting_evidence": []
-                    }
-                
-                improvement_patterns[pattern_key]["supporting_evidence"].append({
-                    "text": improvement_text,
-                    "evaluator_role": row.get("evaluator_role", "Unknown"),
-                    "rotation": row.get("form_name", "Unknown rotation"),
-                    "date": row.get("release_date_str", "Unknown date"),
-                    "relevance_score": "medium"
-                })
-        
-        # Convert to lists and calculate pattern confidence
-        strengths = []
-        for pattern in strength_patterns.values():
-            confidence_info = self._calculate_pattern_confidence(pattern["supporting_evidence"])
-            pattern["confidence"] = confidence_info["confidence"]
-            pattern["confidence_info"] = confidence_info
-            pattern["confidence_description"] = confidence_info["description"]
-            strengths.append(pattern)
-        
-        improvements = []
-        for pattern in improvement_patterns.values():
-            confidence_info = self._calculate_pattern_confidence(pattern["supporting_evidence"])
-            pattern["confidence"] = confidence_info["confidence"]
-            pattern["confidence_info"] = confidence_info
-            pattern["confidence_description"] = confidence_info["description"]
-            improvements.append(pattern)
+        strength_evidence = self._group_fallback_evidence(df, "strengths_comment", competency_focus)
+        improvement_evidence = self._group_fallback_evidence(df, "improvements_comment", competency_focus)
+        
+        # Convert to lists and calculate pattern confidence, skipping groups too small to pass the threshold
+        strengths = [
+            self._build_fallback_pattern(evidence) for evidence in strength_evidence.values()
+            if len(evidence) >= _MIN_THRESHOLD_EVIDENCE
+        ]
+        improvements = [
+            self._build_fallback_pattern(evidence) for evidence in improvement_evidence.values()
+            if len(evidence) >= _MIN_THRESHOLD_EVIDENCE
+        ]
         
         # Filter by confidence threshold
         strengths = self._filter_by_confidence_threshold(strengths)
@@ -446,23 +619,111 @@ class TextAnalysisAgent:
             "alternative_suggestions": "Consider asking about general performance or specific areas where more feedback is available."
         }
     
-    def _apply_filters(self, parsed_data: List[Dict[str, Any]], structured_query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def _group_fallback_evidence(self, df: pd.DataFrame, text_column: str,
+                                 competency_focus: Optional[str]) -> Dict[str, List[Dict[str, Any]]]:
         """
-        Apply rotation and other filters to the data
+        Select the relevant comments in one text column and group their evidence by the
+        comment's first five words, in first-seen order
+        
+        Args:
+            df: Parsed data, one column per field
+            text_column: "strengths_comment" or "improvements_comment"
+            competency_focus: Competency to filter relevance by, or None for all comments
+            
+        Returns:
+            Pattern key -> evidence list
         """
-        filtered_data = parsed_data.copy()
+        if df.empty or text_column not in df.columns:
+            return {}
         
-        # Apply rotation filters
+        keywords = _RELEVANT_KEYWORD_TUPLES.get(competency_focus, ()) if competency_focus else None
+        if keywords == ():
+            return {}
+        
+        # Walk the needed columns side by side instead of looking fields up row by row
+        evidence_by_key = defaultdict(list)
+        for text, role, rotation, date in zip(
+            df[text_column].tolist(),
+            self._fallback_field(df, "evaluator_role", "Unknown"),
+            self._fallback_field(df, "form_name", "Unknown rotation"),
+            self._fallback_field(df, "release_date_str", "Unknown date", missing_value="Unknown date")
+        ):
+            # Non-empty strings only (missing values and non-text cells are skipped)
+            if not isinstance(text, str) or not text:
+                continue
+            if keywords is not None and not _contains_keyword(text.lower(), keywords):
+                continue
+            
+            # Simple pattern grouping by first few words (maxsplit stops after the fifth word)
+            pattern_key = " ".join(text.split(None, 5)[:5]).lower()
+            evidence_by_key[pattern_key].append({
+                "text": text,
+                "evaluator_role": role,
+                "rotation": rotation,
+                "date": date,
+                "relevance_score": "medium"
+            })
+        return evidence_by_key
+    
+    def _fallback_field(self, df: pd.DataFrame, column: str, default: Any, missing_value: Any = None) -> List[Any]:
+        """
+        Values of one evidence field: default when the column is absent, missing_value where
+        the cell is empty (the row layout keeps such fields as None)
+        """
+        if column not in df.columns:
+            return [default] * len(df)
+        values = df[column].astype(object)
+        return values.where(values.notna(), missing_value).tolist()
+    
+    def _build_fallback_pattern(self, supporting_evidence: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Build a fallback pattern from its grouped evidence, titled by the first comment
+        """
+        text = supporting_evidence[0]["text"]
+        if len(text) > _PATTERN_TEXT_MAX_CHARS:
+            text = text[:_PATTERN_TEXT_MAX_CHARS] + _PATTERN_TEXT_SUFFIX
+        
+        return self._score_pattern({"pattern_text": text, "supporting_evidence": supporting_evidence})
+    
+    def _apply_filters(self, parsed_data: Union[pd.DataFrame, List[Dict[str, Any]]],
+                       structured_query: Dict[str, Any]) -> Union[pd.DataFrame, List[Dict[str, Any]]]:
+        """
+        Apply rotation and other filters to the data (a parsed frame or parsed_data rows)
+        """
+        if isinstance(parsed_data, pd.DataFrame):
+            return self._apply_frame_filters(parsed_data, structured_query)
+        
+        # Nothing to filter - callers only read the rows, so no copy is needed
         rotation_filters = structured_query.get("rotation_filters", [])
-        if rotation_filters:
-            filtered_data = [
-                row for row in filtered_data
-                if any(rotation.lower() in row.get("form_name", "").lower() for rotation in rotation_filters)
-            ]
-            print(f"  Applied rotation filter {rotation_filters}: {len(filtered_data)} records remain")
+        if not rotation_filters:
+            return parsed_data
+        
+        # Apply rotation filters, lowercasing each rotation and form name once
+        rotations = tuple(rotation.lower() for rotation in rotation_filters)
+        filtered_data = []
+        for row in parsed_data:
+            form_name = (row.get("form_name") or "").lower()
+            if any(rotation in form_name for rotation in rotations):
+                filtered_data.append(row)
+        logger.debug("  Applied rotation filter %s: %d records remain", rotation_filters, len(filtered_data))
         
         return filtered_data
     
+    def _apply_frame_filters(self, df: pd.DataFrame, structured_query: Dict[str, Any]) -> pd.DataFrame:
+        """
+        Apply rotation and other filters to a parsed frame, matching each distinct form name once
+        """
+        rotation_filters = structured_query.get("rotation_filters", [])
+        if not rotation_filters or df.empty:
+            return df
+        if "form_name" not in df.columns:
+            return df.iloc[0:0]
+        
+        # Case-insensitive substring match against any requested rotation, once per form name
+        filtered_df = df[matches_any_term(df["form_name"], rotation_filters)]
+        logger.debug("  Applied rotation filter %s: %d records remain", rotation_filters, len(filtered_df))
+        return filtered_df
+    
     def _apply_number_limits(self, text_analysis: Dict[str, Any], specific_numbers: Dict[str, Any]) -> Dict[str, Any]:
         """
         Apply number limitations (top 3 strengths, etc.)
@@ -492,7 +753,7 @@ class TextAnalysisAgent:
         
         return text_analysis
     
-    def _is_relevant_text(self, text: str, competency_focus: str, relevant_keywords: Dict[str, List[str]]) -> bool:
+    def _is_relevant_text(self, text: str, competency_focus: str) -> bool:
         """
         Check if text is relevant to the competency focus
         """
@@ -503,7 +764,4 @@ class TextAnalysisAgent:
         if not competency_focus or not text:
             return True  
         
-        text_lower = text.lower()
-        keywords = relevant_keywords.get(competency_focus, [])
-        
-        return any(keyword in text_lower for keyword in keywords)
\ No newline at end of file
+        return _contains_keyword(text.lower(), _RELEVANT_KEYWORD_TUPLES.get(competency_focus, ()))
\ No newline at end of file
@@ -1,10 +1,52 @@
 """
 Constants and configuration file 
 """
+import hashlib
+import os
+import re
+
+from config.rubrics import TEXT_ANALYSIS_RUBRIC, TEXT_ANALYSIS_RUBRIC_NON_TEMPORAL
+
+# Maximum number of LLM calls allowed in flight at once (provider rate-limit protection)
+MAX_CONCURRENT_LLM_CALLS = 5
+
+# Query types whose consolidation is a deterministic ranking of text analysis patterns, done in
+# Python instead of by an LLM call (set LOCAL_CONSOLIDATION_ENABLED = False to always use the LLM)
+LOCAL_CONSOLIDATION_ENABLED = True
+LOCAL_CONSOLIDATION_QUERY_TYPES = ("current_strengths", "areas_for_improvement")
+# Findings listed when the query does not ask for a number
+LOCAL_CONSOLIDATION_DEFAULT_FINDINGS = 5
+
+# Shared LLM HTTP connection pool settings (kept alive across requests)
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+LLM_HTTP_TIMEOUT_SECONDS = 60
+
+# LLM response cache (only used for temperature-0 models); set LLM_CACHE_ENABLED=0 to turn it off
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+LLM_CACHE_TTL_SECONDS = 3600
+LLM_CACHE_MAX_ENTRIES = 1024
+# Opt-in on-disk tier behind the in-memory cache, so repeat runs survive restarts. Entries hold
+# evaluation comments, LLM analyses and final responses as plaintext JSON files, kept for
+# LLM_CACHE_DISK_TTL_DAYS. Set LLM_CACHE_DIR to a directory only the app can read to enable it.
+LLM_CACHE_DIR = os.path.abspath(os.environ["LLM_CACHE_DIR"]) if os.getenv("LLM_CACHE_DIR") else ""
+LLM_CACHE_DISK_TTL_DAYS = float(os.getenv("LLM_CACHE_DISK_TTL_DAYS", "7"))
+# Semantic cache of final responses for paraphrased queries (used when an embeddings client is configured)
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_TTL_SECONDS = 3600
+SEMANTIC_CACHE_MAX_SCOPES = 256
+SEMANTIC_CACHE_MAX_ENTRIES_PER_SCOPE = 32
+
+# Prompts are split into a static instruction prefix and a short dynamic suffix holding the
+# per-request fields. Keeping the per-request text last makes the long instructions an
+# identical prefix across calls, which providers with automatic prompt caching reuse.
+
+def _compact_json(example: str) -> str:
+    """Strip the line breaks and indentation from a JSON format example written readably below"""
+    return re.sub(r"\s*\n\s*", "", example.strip())
 
 # ENHANCED: Query Understanding Agent Prompt - Handles all query types
-QUERY_UNDERSTANDING_PROMPT = """
-Analyze this user query about clinical performance: "{user_query}"
+QUERY_UNDERSTANDING_STATIC = """
+Analyze the user query about clinical performance given at the end of this message.
 
 Extract ALL the following information and respond with a JSON object:
 
@@ -63,89 +105,24 @@ Examples:
 - "Compare my [rotation_A] vs [rotation_B] performance" → comparative_analysis, no focus, comparison_elements={{"rotations": ["rotation_A", "rotation_B"]}}
 - "How are my EPA1 and EPA2 scores?" → specific_skill_analysis, clinical_reasoning, epa_filters=["epa1", "epa2"]
 - "What patterns do evaluators mention about my [skill_area]?" → pattern_recognition, [skill_area]
+"""
+QUERY_UNDERSTANDING_DYNAMIC = """
+User query: "{user_query}"
 
 Return only valid JSON, no other text.
 """
+QUERY_UNDERSTANDING_PROMPT = QUERY_UNDERSTANDING_STATIC + QUERY_UNDERSTANDING_DYNAMIC
 #text analysis prompt 
-TEXT_ANALYSIS_PROMPT = """
-You are analyzing clinical performance feedback to answer this specific user query: "{user_query}"
-
-Query Analysis:
-- Query Type: {query_type}
-- Competency Focus: {competency_focus}
-- Temporal Dimension: {temporal_dimension}
-- Rotation Filters: {rotation_filters}
-- EPA Filters: {epa_filters}
-- Numbers Requested: {specific_numbers}
-- Evidence Criteria: {evidence_criteria}
-
-Assessment Data: {parsed_data}
-
-ENHANCED CLINICAL REASONING DETECTION:
-
-For CLINICAL REASONING queries, ONLY include feedback that contains these SPECIFIC indicators:
-
-1. **DIRECT CLINICAL REASONING TERMS** (High Priority - Must Include):
-   - "clinical reasoning", "clinical judgment", "clinical thinking"
-   - "diagnostic reasoning", "diagnostic thinking", "diagnostic approach"
-   - "differential diagnosis", "DDx", "differential"
-   - "decision-making", "medical decision", "clinical decision"
-   - "problem-solving", "analytical thinking", "clinical analysis"
-   - "assessment and plan", "A&P", "clinical planning"
-   - "synthesizing information", "integrating findings"
-   - "evidence-based", "literature application", "applying knowledge"
-
-2. **REASONING THROUGH CLINICAL ACTIONS** (Medium Priority):
-   - "thought process", "reasoning process", "explains reasoning"
-   - "clinical approach", "systematic approach", "methodical"
-   - "connects findings", "links symptoms", "correlates data"
-   - "anticipates", "predicts", "foresees clinical needs"
-   - "complex cases", "complicated patients", "challenging diagnosis"
-
-3. **PRESENTATION SKILLS SHOWING REASONING** (Include Only If Reasoning-Focused):
-   - "presents differential", "discusses reasoning", "explains thought process"
-   - "organized thinking", "logical progression", "systematic presentation"
-   - "shows clinical thinking", "demonstrates reasoning"
-   
-   BUT EXCLUDE general presentation comments like:
-   - "presents well", "good presentations", "concise presentations"
-   - Unless they specifically mention reasoning/thinking process
-
-4. **STRICT EXCLUSIONS** (Never Include These for Clinical Reasoning):
-   - General work traits: "hard working", "thorough", "reliable", "punctual"
-   - Attitude: "great attitude", "positive", "enthusiastic", "team player" 
-   - Basic skills: "asks questions", "prepared", "organized", "professional"
-   - Reading habits: "reads about patients", "studies", "looks things up"
-   - Communication: "good bedside manner", "communicates well"
-   - Unless these terms are specifically linked to reasoning (e.g., "asks thoughtful diagnostic questions")
-
-5. **RELEVANCE SCORING**:
-   - HIGH: Contains direct clinical reasoning terms from list 1
-   - MEDIUM: Contains reasoning-related actions from list 2, but no general traits
-   - LOW: General positive feedback without specific reasoning content
-   - EXCLUDE: Only contains terms from exclusion list
-
-6. **TEMPORAL ANALYSIS ENHANCEMENT**:
-   If temporal_dimension=true:
-   - ONLY track progression in actual reasoning-related feedback
-   - Compare early vs recent REASONING-SPECIFIC comments
-   - If no reasoning-specific feedback exists, state: "Limited specific clinical reasoning feedback available for temporal analysis"
-
-Example of GOOD clinical reasoning feedback:
-- "Demonstrates excellent clinical reasoning when working through complex cases"
-- "Shows strong diagnostic thinking and develops appropriate differential diagnoses"
-- "Clinical decision-making has improved significantly"
-
-Example of EXCLUDED general feedback:
-- "Very thorough and hard working" ❌ (General work trait)
-- "Asks appropriate questions and presents really well" ❌ (Unless questions are specified as diagnostic)
-- "Continue to read on your patients" ❌ (Study habit, not reasoning)
-
-CRITICAL RULE: If no HIGH or MEDIUM relevance feedback is found for clinical reasoning, return:
-- relevant_feedback_found: false
-- alternative_suggestions: "Available feedback focuses on [other areas like work habits, communication, etc.]. For clinical reasoning assessment, look for feedback on diagnostic thinking, clinical judgment, or decision-making processes."
+TEXT_ANALYSIS_STATIC = """
+You are analyzing clinical performance feedback to answer a specific user query. The query,
+its analysis and the assessment data are given at the end of this message. Judge the
+relevance of each feedback comment using the rubric in the system message. For clinical
+reasoning queries, rows carry a "relevance" tag (high/medium/low) from a keyword match against
+the rubric lists, and rows with only excluded terms are already removed; confirm or downgrade
+each tag based on whether the comment really describes reasoning.
 
 Return JSON format:
+""" + _compact_json("""
 {{
   "relevant_feedback_found": true/false,
   "clinical_reasoning_specific": {{
@@ -179,132 +156,98 @@ Return JSON format:
   }},
   "alternative_suggestions": "If limited clinical reasoning feedback, suggest other rich areas"
 }}
+""") + "\n"
+TEXT_ANALYSIS_DYNAMIC = """
+User query: "{user_query}"
 
-REMEMBER: Be extremely strict about clinical reasoning relevance. Better to say "insufficient specific feedback" than to include general work performance comments.
-"""
-
-# ENHANCED: Numeric Analysis Agent Prompt - Better temporal and comparative analysis
-NUMERIC_ANALYSIS_PROMPT = """
-Analyze clinical performance numerical data for this query: "{user_query}"
-
-Query Context:
+Query Analysis:
 - Query Type: {query_type}
 - Competency Focus: {competency_focus}
-- Temporal Analysis Needed: {temporal_dimension}
+- Temporal Dimension: {temporal_dimension}
 - Rotation Filters: {rotation_filters}
 - EPA Filters: {epa_filters}
+- Numbers Requested: {specific_numbers}
+- Evidence Criteria: {evidence_criteria}
 
-Parsed Data: {parsed_data}
-
-ANALYSIS REQUIREMENTS:
-
-1. BASIC STATISTICS: Calculate for all relevant scores:
-   - Weighted averages (using recency_weight)
-   - Min/max values
-   - Number of evaluations
-   - Score distributions
-
-2. TEMPORAL ANALYSIS (if temporal_dimension=true):
-   - Sort all scores chronologically by release_date
-   - Calculate trends for each EPA/competency area
-   - Compare early period vs recent period averages
-   - Identify improving/declining/stable patterns
-   - Include specific date ranges and score changes
-
-3. ROTATION-SPECIFIC ANALYSIS (if rotation_filters provided):
-   - Calculate statistics only for specified rotations
-   - Compare performance across different rotations
-   - Identify rotation-specific patterns
+Assessment Data: {parsed_data}
+"""
+TEXT_ANALYSIS_PROMPT = TEXT_ANALYSIS_STATIC + TEXT_ANALYSIS_DYNAMIC
 
-4. COMPETENCY-FOCUSED ANALYSIS:
-   - For clinical_reasoning: Focus on EPA1, EPA2, EPA3, EPA7
-   - For communication: Focus on comm_* fields and EPA6
-   - For professionalism: Focus on prof_* fields
-   - For patient_care: Focus on EPA1, EPA9, professionalism scores
+# Numeric Analysis Agent Prompt - statistics are computed in pandas; the LLM only summarizes them
+NUMERIC_ANALYSIS_STATIC = """
+The statistics below were computed from a student's clinical performance evaluations
+(scores on a 1-4 scale; "avg" is weighted toward recent evaluations, "raw_avg" is not).
+Summarize the key quantitative insights for the query given at the end of this message.
 
-5. COMPARATIVE ANALYSIS:
-   - If comparing rotations: provide side-by-side statistics
-   - If comparing time periods: show before/after metrics
-   - If comparing competencies: rank different skill areas
+- Use only the numbers given; do not recompute or invent values
+- Focus on the competencies, rotations and EPAs the query asks about
+- If temporal analysis was requested, state the direction and size of changes with their dates
+- Give 2-5 insights, one sentence each
 
 Return JSON format:
-{{
-  "query_specific_analysis": {{
-    "primary_metrics": {{"metric_name": {{"current": value, "trend": "direction", "change": numeric_change}}}},
-    "temporal_progression": {{
-      "time_span": "date range",
-      "early_period": {{"avg_scores": {{}}, "date_range": ""}},
-      "recent_period": {{"avg_scores": {{}}, "date_range": ""}},
-      "trends": {{"epa_name": {{"direction": "improving/stable/declining", "magnitude": 0.0-1.0}}}}
-    }},
-    "rotation_comparison": {{
-      "rotation_name": {{"avg_scores": {{}}, "evaluation_count": number}}
-    }}
-  }},
-  "by_epa": {{
-    "epa_name": {{"avg": value, "trend": {{}}, "rotation_breakdown": {{}}}}
-  }},
-  "by_competency": {{
-    "clinical_reasoning": {{"composite_score": value, "trend": {{}}}},
-    "communication": {{"composite_score": value, "trend": {{}}}},
-    "professionalism": {{"composite_score": value, "trend": {{}}}}
-  }},
-  "summary_insights": [
-    "Key quantitative insight 1",
-    "Key quantitative insight 2"
-  ]
-}}
-
-Focus on metrics most relevant to their specific query. Provide detailed temporal analysis if requested.
+{{"summary_insights": ["Key quantitative insight 1", "Key quantitative insight 2"]}}
 """
+NUMERIC_ANALYSIS_DYNAMIC = """
+Query: "{user_query}"
 
-# ENHANCED: Consolidation Agent Prompt - Handles all query types
-CONSOLIDATION_PROMPT = """
-You are consolidating clinical performance analysis results for this query: "{user_query}"
-
-Query Analysis: {structured_query}
-Numeric Analysis: {numeric_analysis}  
-Text Analysis: {text_analysis}
+Query Context:
+- Query Type: {query_type}
+- Competency Focus: {competency_focus}
+- Temporal Analysis Needed: {temporal_dimension}
+- Rotation Filters: {rotation_filters}
+- EPA Filters: {epa_filters}
 
-QUERY TYPE SPECIFIC CONSOLIDATION:
+Computed Statistics: {statistics}
+"""
+NUMERIC_ANALYSIS_PROMPT = NUMERIC_ANALYSIS_STATIC + NUMERIC_ANALYSIS_DYNAMIC
 
-1. For TEMPORAL_TRENDS queries:
+# ENHANCED: Consolidation Agent Prompt - Handles all query types
+# Query-type specific guidance. CONSOLIDATION_PROMPT carries every section; the prompt for a
+# known query type (CONSOLIDATION_PROMPTS_BY_QUERY_TYPE) carries only its own, so irrelevant
+# guidance is not sent while each variant is still a fixed prefix for prompt caching.
+CONSOLIDATION_QUERY_TYPE_SECTIONS = {
+    "temporal_trends": """For TEMPORAL_TRENDS queries:
    - Focus on progression over time with specific dates
    - Compare early vs recent feedback with quotes
    - Include EPA score trends with numerical changes
-   - Highlight what specifically changed
-
-2. For CURRENT_STRENGTHS queries:
+   - Highlight what specifically changed""",
+    "current_strengths": """For CURRENT_STRENGTHS queries:
    - Rank strengths by frequency and confidence
    - Provide specific evidence from multiple evaluators
    - Focus on consistent patterns across rotations
-   - If number requested (e.g., "top 3"), prioritize accordingly
-
-3. For AREAS_FOR_IMPROVEMENT queries:
+   - If number requested (e.g., "top 3"), prioritize accordingly""",
+    "areas_for_improvement": """For AREAS_FOR_IMPROVEMENT queries:
    - Identify actionable development areas
    - Group similar feedback themes
    - Provide context on how often mentioned
-   - Suggest specific next steps
-
-4. For ROTATION_SPECIFIC queries:
+   - Suggest specific next steps""",
+    "rotation_specific": """For ROTATION_SPECIFIC queries:
    - Focus only on the requested rotation(s)
    - Compare performance across different rotations if multiple
    - Highlight rotation-specific strengths/challenges
-   - Include rotation-specific EPA scores
-
-5. For COMPARATIVE_ANALYSIS queries:
+   - Include rotation-specific EPA scores""",
+    "comparative_analysis": """For COMPARATIVE_ANALYSIS queries:
    - Direct comparison between requested elements
    - Quantify differences where possible
    - Highlight unique aspects of each comparison target
-   - Use specific evidence to support comparisons
-
-6. For PATTERN_RECOGNITION queries:
+   - Use specific evidence to support comparisons""",
+    "pattern_recognition": """For PATTERN_RECOGNITION queries:
    - Identify recurring themes across evaluations
    - Note consistency of feedback across evaluators/rotations
    - Highlight evolution of patterns over time
-   - Group related feedback together
+   - Group related feedback together""",
+}
+_CONSOLIDATION_HEAD = """
+You are consolidating clinical performance analysis results for the query given at the end of
+this message, together with its query, numeric and text analyses.
+
+QUERY TYPE SPECIFIC CONSOLIDATION:
+
+"""
+_CONSOLIDATION_FORMAT = """
 
 Return JSON format:
+""" + _compact_json("""
 {{
   "summary": "Brief summary directly answering the user's specific question",
   "key_findings": [
@@ -341,21 +284,35 @@ Return JSON format:
     "confidence_assessment": "How reliable this analysis is"
   }}
 }}
+""") + """
 
 Focus specifically on what the user asked about. Don't provide generic summaries unless requested.
+"""
+CONSOLIDATION_STATIC = _CONSOLIDATION_HEAD + "\n\n".join(
+    f"{number}. {section}" for number, section in enumerate(CONSOLIDATION_QUERY_TYPE_SECTIONS.values(), 1)
+) + _CONSOLIDATION_FORMAT
+CONSOLIDATION_DYNAMIC = """
+Query: "{user_query}"
+
+Query Analysis: {structured_query}
+Numeric Analysis: {numeric_analysis}
+Text Analysis: {text_analysis}
+
 Return only valid JSON.
 """
+CONSOLIDATION_PROMPT = CONSOLIDATION_STATIC + CONSOLIDATION_DYNAMIC
+CONSOLIDATION_PROMPTS_BY_QUERY_TYPE = {
+    query_type: _CONSOLIDATION_HEAD + section + _CONSOLIDATION_FORMAT + CONSOLIDATION_DYNAMIC
+    for query_type, section in CONSOLIDATION_QUERY_TYPE_SECTIONS.items()
+}
 
 # ENHANCED: Response Generation Prompt - Tailored responses for each query type
 # MERGED: Response Generation Prompt - Enhanced intelligence + Old detailed formatting
-RESPONSE_GENERATION_PROMPT = """
+# Section 6 holds one response format per kind of query; as with consolidation, the prompt for
+# a query type with its own format (RESPONSE_GENERATION_PROMPTS_BY_QUERY_TYPE) carries only that one.
+_RESPONSE_GENERATION_HEAD = """
 You are helping a medical student understand their clinical performance assessment data.
-
-Original user query: {user_query}
-Structured query analysis: {structured_query}
-Consolidated summary: {consolidated_summary}
-Pattern information: {pattern_info}
-Raw evidence data: {raw_evidence}
+Their query and the analysis results are given at the end of this message.
 
 CRITICAL GUIDELINES:
 
@@ -397,7 +354,9 @@ CRITICAL GUIDELINES:
 
 6. RESPONSE FORMAT BY QUERY TYPE:
 
-TEMPORAL QUERIES ("over time", "improved", "changed"):
+"""
+RESPONSE_FORMAT_SECTIONS = {
+    "temporal": """TEMPORAL QUERIES ("over time", "improved", "changed"):
 Format: 
 # Clinical Reasoning Progression Over Time
 
@@ -413,15 +372,13 @@ Format:
 - [Specific change 1 with evidence]
 - [Specific change 2 with evidence]
 
-**Quantitative Trends:** [EPA scores or other metrics over time]
-
-STRENGTHS/IMPROVEMENTS QUERIES ("top 3 strengths", "areas to improve"):
+**Quantitative Trends:** [EPA scores or other metrics over time]""",
+    "lists": """STRENGTHS/IMPROVEMENTS QUERIES ("top 3 strengths", "areas to improve"):
 Format:
 # Your [Top X] [Strengths/Areas for Improvement]
 
-[Use the mandatory format above for each item, numbered 1, 2, 3, etc.]
-
-ROTATION-SPECIFIC QUERIES ("Surgery performance", "Medicine vs Pediatrics"):
+[Use the mandatory format above for each item, numbered 1, 2, 3, etc.]""",
+    "rotation": """ROTATION-SPECIFIC QUERIES ("Surgery performance", "Medicine vs Pediatrics"):
 Format:
 # Performance in [Rotation Name]
 
@@ -433,9 +390,8 @@ Format:
 **Development Areas in [Rotation]:**
 [Use mandatory format above for rotation-specific improvements]
 
-**Rotation-Specific Scores:** [Relevant EPA scores]
-
-COMPETENCY-SPECIFIC QUERIES ("communication skills", "clinical reasoning"):
+**Rotation-Specific Scores:** [Relevant EPA scores]""",
+    "competency": """COMPETENCY-SPECIFIC QUERIES ("communication skills", "clinical reasoning"):
 Format:
 # [Competency Name] Analysis
 
@@ -445,7 +401,9 @@ Format:
 [Use mandatory format above for competency-specific strengths]
 
 **Development Opportunities:**
-[Use mandatory format above for areas for growth]
+[Use mandatory format above for areas for growth]""",
+}
+_RESPONSE_GENERATION_TAIL = """
 
 7. QUOTE PRESERVATION: 
    - Keep all quoted evidence exactly as written in the original feedback
@@ -468,9 +426,31 @@ Format:
 10. ALWAYS use second-person perspective in analysis ("You demonstrate..." not "The student demonstrates...")
 
 The tone should be professional, constructive, and supportive - appropriate for medical education context.
+"""
+RESPONSE_GENERATION_STATIC = _RESPONSE_GENERATION_HEAD + "\n\n".join(RESPONSE_FORMAT_SECTIONS.values()) + _RESPONSE_GENERATION_TAIL
+RESPONSE_GENERATION_DYNAMIC = """
+Original user query: {user_query}
+Structured query analysis: {structured_query}
+Consolidated summary: {consolidated_summary}
+Pattern information: {pattern_info}
+Raw evidence data: {raw_evidence}
 
 Return a well-formatted response that directly answers the user's question with authentic quoted evidence using the mandatory format above.
 """
+RESPONSE_GENERATION_PROMPT = RESPONSE_GENERATION_STATIC + RESPONSE_GENERATION_DYNAMIC
+# Query type -> its RESPONSE_FORMAT_SECTIONS entry; other query types get every format
+_RESPONSE_FORMAT_BY_QUERY_TYPE = {
+    "temporal_trends": "temporal",
+    "current_strengths": "lists",
+    "areas_for_improvement": "lists",
+    "rotation_specific": "rotation",
+    "specific_skill_analysis": "competency",
+}
+RESPONSE_GENERATION_PROMPTS_BY_QUERY_TYPE = {
+    query_type: _RESPONSE_GENERATION_HEAD + RESPONSE_FORMAT_SECTIONS[section] + _RESPONSE_GENERATION_TAIL
+    + RESPONSE_GENERATION_DYNAMIC
+    for query_type, section in _RESPONSE_FORMAT_BY_QUERY_TYPE.items()
+}
 
 # Keep existing working prompts unchanged
 DATA_INGESTION_PROMPT = """
@@ -511,4 +491,30 @@ User query: {user_query}
 Raw table: {raw_table_summary}
 
 Please coordinate the work of each agent according to the steps above, and return the final natural language response.
-"""
\ No newline at end of file
+"""
+
+def _prompt_version(*prompts: str) -> str:
+    """Short content hash of the prompt texts, so any edit changes it"""
+    digest = hashlib.blake2b(digest_size=8)
+    for prompt in prompts:
+        digest.update(prompt.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+# Version of the prompts behind each cache name (see utils.llm_cache.cache_name_for). It is part
+# of every cache key, so editing a prompt or rubric stops cached responses to the old text from
+# being reused, while unchanged prompts keep hitting.
+_CONSOLIDATION_VERSION = _prompt_version(CONSOLIDATION_PROMPT, *CONSOLIDATION_PROMPTS_BY_QUERY_TYPE.values())
+_RESPONSE_GENERATION_VERSION = _prompt_version(
+    RESPONSE_GENERATION_PROMPT, *RESPONSE_GENERATION_PROMPTS_BY_QUERY_TYPE.values()
+)
+PROMPT_VERSIONS = {
+    "query_understanding": _prompt_version(QUERY_UNDERSTANDING_PROMPT),
+    "query_understanding_structured": _prompt_version(QUERY_UNDERSTANDING_PROMPT),
+    "numeric_insights": _prompt_version(NUMERIC_ANALYSIS_PROMPT),
+    "text_analysis": _prompt_version(TEXT_ANALYSIS_PROMPT, TEXT_ANALYSIS_RUBRIC, TEXT_ANALYSIS_RUBRIC_NON_TEMPORAL),
+    "consolidation": _CONSOLIDATION_VERSION,
+    "response_generation": _RESPONSE_GENERATION_VERSION,
+}
+# Cached final responses depend on every prompt in the pipeline
+PROMPT_VERSIONS["semantic_response"] = _prompt_version(*PROMPT_VERSIONS.values())
@@ -0,0 +1,53 @@
+"""
+Clinical reasoning relevance terms, mirroring the lists in the clinical reasoning rubric
+(config/rubrics.py). Used to tag feedback locally before it is sent to the text analysis LLM.
+"""
+import re
+from typing import Iterable, Pattern
+
+# Rubric list 1 - direct clinical reasoning terms
+HIGH_RELEVANCE_TERMS = (
+    "clinical reasoning", "clinical judgment", "clinical thinking",
+    "diagnostic reasoning", "diagnostic thinking", "diagnostic approach",
+    "differential diagnosis", "DDx", "differential",
+    "decision-making", "medical decision", "clinical decision",
+    "problem-solving", "analytical thinking", "clinical analysis",
+    "assessment and plan", "A&P", "clinical planning",
+    "synthesizing information", "integrating findings",
+    "evidence-based", "literature application", "applying knowledge",
+)
+
+# Rubric lists 2 and 3 - reasoning through clinical actions and reasoning-focused presentation
+MEDIUM_RELEVANCE_TERMS = (
+    "thought process", "reasoning process", "explains reasoning",
+    "clinical approach", "systematic approach", "methodical",
+    "connects findings", "links symptoms", "correlates data",
+    "anticipates", "predicts", "foresees clinical needs",
+    "complex cases", "complicated patients", "challenging diagnosis",
+    "presents differential", "discusses reasoning", "explains thought process",
+    "organized thinking", "logical progression", "systematic presentation",
+    "shows clinical thinking", "demonstrates reasoning",
+)
+
+# Rubric list 4 - general traits that never count as clinical reasoning on their own
+EXCLUSION_TERMS = (
+    "hard working", "thorough", "reliable", "punctual",
+    "great attitude", "positive", "enthusiastic", "team player",
+    "asks questions", "prepared", "organized", "professional",
+    "reads about patients", "studies", "looks things up",
+    "good bedside manner", "communicates well",
+)
+
+def _compile_terms(terms: Iterable[str]) -> Pattern:
+    """
+    Whole-word alternation of the lowercased terms, where spaces and hyphens match either.
+    Search lowercased text: re.IGNORECASE makes the search about 3x slower.
+    """
+    alternatives = (
+        re.escape(term.lower()).replace(r"\ ", r"[\s-]").replace(r"\-", r"[\s-]") for term in terms
+    )
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")\b")
+
+HIGH_RELEVANCE_RE = _compile_terms(HIGH_RELEVANCE_TERMS)
+MEDIUM_RELEVANCE_RE = _compile_terms(MEDIUM_RELEVANCE_TERMS)
+EXCLUSION_RE = _compile_terms(EXCLUSION_TERMS)
@@ -0,0 +1,81 @@
+"""
+Versioned analysis rubrics - static instruction blocks sent to the LLM as system messages.
+Their text is hashed into config.constants.PROMPT_VERSIONS, so cached responses built from an
+older rubric are not reused.
+"""
+
+# Relevance rules for clinical reasoning feedback, used by the text analysis agent
+CLINICAL_REASONING_RUBRIC_V1 = """
+ENHANCED CLINICAL REASONING DETECTION:
+
+For CLINICAL REASONING queries, ONLY include feedback that contains these SPECIFIC indicators:
+
+1. **DIRECT CLINICAL REASONING TERMS** (High Priority - Must Include):
+   - "clinical reasoning", "clinical judgment", "clinical thinking"
+   - "diagnostic reasoning", "diagnostic thinking", "diagnostic approach"
+   - "differential diagnosis", "DDx", "differential"
+   - "decision-making", "medical decision", "clinical decision"
+   - "problem-solving", "analytical thinking", "clinical analysis"
+   - "assessment and plan", "A&P", "clinical planning"
+   - "synthesizing information", "integrating findings"
+   - "evidence-based", "literature application", "applying knowledge"
+
+2. **REASONING THROUGH CLINICAL ACTIONS** (Medium Priority):
+   - "thought process", "reasoning process", "explains reasoning"
+   - "clinical approach", "systematic approach", "methodical"
+   - "connects findings", "links symptoms", "correlates data"
+   - "anticipates", "predicts", "foresees clinical needs"
+   - "complex cases", "complicated patients", "challenging diagnosis"
+
+3. **PRESENTATION SKILLS SHOWING REASONING** (Include Only If Reasoning-Focused):
+   - "presents differential", "discusses reasoning", "explains thought process"
+   - "organized thinking", "logical progression", "systematic presentation"
+   - "shows clinical thinking", "demonstrates reasoning"
+   
+   BUT EXCLUDE general presentation comments like:
+   - "presents well", "good presentations", "concise presentations"
+   - Unless they specifically mention reasoning/thinking process
+
+4. **STRICT EXCLUSIONS** (Never Include These for Clinical Reasoning):
+   - General work traits: "hard working", "thorough", "reliable", "punctual"
+   - Attitude: "great attitude", "positive", "enthusiastic", "team player" 
+   - Basic skills: "asks questions", "prepared", "organized", "professional"
+   - Reading habits: "reads about patients", "studies", "looks things up"
+   - Communication: "good bedside manner", "communicates well"
+   - Unless these terms are specifically linked to reasoning (e.g., "asks thoughtful diagnostic questions")
+
+5. **RELEVANCE SCORING**:
+   - HIGH: Contains direct clinical reasoning terms from list 1
+   - MEDIUM: Contains reasoning-related actions from list 2, but no general traits
+   - LOW: General positive feedback without specific reasoning content
+   - EXCLUDE: Only contains terms from exclusion list
+
+Example of GOOD clinical reasoning feedback:
+- "Demonstrates excellent clinical reasoning when working through complex cases"
+- "Shows strong diagnostic thinking and develops appropriate differential diagnoses"
+- "Clinical decision-making has improved significantly"
+
+Example of EXCLUDED general feedback:
+- "Very thorough and hard working" ❌ (General work trait)
+- "Asks appropriate questions and presents really well" ❌ (Unless questions are specified as diagnostic)
+- "Continue to read on your patients" ❌ (Study habit, not reasoning)
+
+CRITICAL RULE: If no HIGH or MEDIUM relevance feedback is found for clinical reasoning, return:
+- relevant_feedback_found: false
+- alternative_suggestions: "Available feedback focuses on [other areas like work habits, communication, etc.]. For clinical reasoning assessment, look for feedback on diagnostic thinking, clinical judgment, or decision-making processes."
+
+REMEMBER: Be extremely strict about clinical reasoning relevance. Better to say "insufficient specific feedback" than to include general work performance comments.
+"""
+
+# Temporal progression rules, used alongside the clinical reasoning rubric
+TEMPORAL_ANALYSIS_RUBRIC_V1 = """
+TEMPORAL ANALYSIS ENHANCEMENT:
+   If temporal_dimension=true:
+   - ONLY track progression in actual reasoning-related feedback
+   - Compare early vs recent REASONING-SPECIFIC comments
+   - If no reasoning-specific feedback exists, state: "Limited specific clinical reasoning feedback available for temporal analysis"
+"""
+
+# System messages for the text analysis agent, with and without the temporal rules
+TEXT_ANALYSIS_RUBRIC = CLINICAL_REASONING_RUBRIC_V1 + TEMPORAL_ANALYSIS_RUBRIC_V1
+TEXT_ANALYSIS_RUBRIC_NON_TEMPORAL = CLINICAL_REASONING_RUBRIC_V1
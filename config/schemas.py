@@ -2,45 +2,68 @@
 """
 Data schemas and structures
 """
-from typing import List, Dict, Any, Optional, Union
-from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Optional, Tuple, Union
+from pydantic import BaseModel, ConfigDict, Field, RootModel
 
 class NumericStats(BaseModel):
     #Numeric statistics model
+    model_config = ConfigDict(frozen=True, extra="forbid")
+    
     avg: float = Field(..., description="Average value")
     min: int = Field(..., description="Minimum value")
     max: int = Field(..., description="Maximum value")
 
 class DomainFeedback(BaseModel):
-    #Domain feedback model
-    strengths: List[str] = Field(default_factory=list, description="List of strengths")
-    improvements: List[str] = Field(default_factory=list, description="List of improvement points")
+    #Domain feedback model; list fields are tuples so defaults share one empty instance
+    model_config = ConfigDict(frozen=True, extra="forbid")
+    
+    strengths: Tuple[str, ...] = Field((), description="List of strengths")
+    improvements: Tuple[str, ...] = Field((), description="List of improvement points")
 
 class DomainSummary(BaseModel):
     #Domain summary model
+    model_config = ConfigDict(frozen=True)
+    
     numeric: Optional[NumericStats] = Field(None, description="Numeric statistics")
-    strengths: List[str] = Field(default_factory=list, description="List of strengths")
-    improvements: List[str] = Field(default_factory=list, description="List of improvement points")
+    strengths: Tuple[str, ...] = Field((), description="List of strengths")
+    improvements: Tuple[str, ...] = Field((), description="List of improvement points")
+
+class SpecificNumbers(BaseModel):
+    #Counts explicitly requested in the query
+    model_config = ConfigDict(frozen=True)
+    
+    strengths_requested: Optional[int] = Field(None, description="Number of strengths requested, or null")
+    improvements_requested: Optional[int] = Field(None, description="Number of improvement areas requested, or null")
+    top_requested: Optional[int] = Field(None, description="Number of top items requested (e.g. 'top 5 areas'), or null")
 
 class StructuredQuery(BaseModel):
-    #Structured query model
-    ask_strengths: Optional[int] = Field(None, description="Number of strengths requested")
-    ask_improvements: Optional[int] = Field(None, description="Number of improvement points requested")
-    ask_category_performance: List[str] = Field(default_factory=list, description="List of requested categories")
-    ask_epa_performance: List[str] = Field(default_factory=list, description="List of requested EPAs")
+    #Structured query model, as produced by the query understanding agent
+    model_config = ConfigDict(frozen=True)
+    
+    query_type: str = Field("general_performance", description="Primary analysis type, e.g. temporal_trends, current_strengths, areas_for_improvement, specific_skill_analysis, rotation_specific, comparative_analysis, pattern_recognition, general_performance")
+    competency_focus: Optional[str] = Field(None, description="Specific skill area, or null if multiple/general")
+    temporal_dimension: bool = Field(False, description="True if asking about changes over time")
+    specific_numbers: SpecificNumbers = Field(default_factory=SpecificNumbers, description="Numbers requested in the query")
+    rotation_filters: Tuple[str, ...] = Field((), description="Rotation names explicitly mentioned in the query")
+    epa_filters: Tuple[str, ...] = Field((), description="Specific EPAs mentioned, e.g. epa1")
+    comparison_elements: Optional[Dict[str, List[str]]] = Field(None, description="What is being compared (rotations, time_periods or competencies), or null")
+    evidence_criteria: str = Field("Any relevant feedback", description="What feedback text should be prioritized")
+
+class QueryAndRouting(BaseModel):
+    #Structured query plus which analyses are needed to answer it
+    structured_query: StructuredQuery = Field(..., description="Structured interpretation of the user query")
+    needs_numeric: bool = Field(True, description="Whether numeric score analysis is needed to answer the query")
+    needs_text: bool = Field(True, description="Whether analysis of written feedback comments is needed to answer the query")
 
 class NumericAnalysis(BaseModel):
     #Numeric analysis results model
     by_domain: Dict[str, NumericStats] = Field(default_factory=dict, description="Statistics organized by domain")
     by_epa: Dict[str, NumericStats] = Field(default_factory=dict, description="Statistics organized by EPA")
 
-class TextAnalysis(BaseModel):
+class TextAnalysis(RootModel[Dict[str, DomainFeedback]]):
     #Text analysis results model
-    __root__: Dict[str, DomainFeedback] = Field(..., description="Text feedback organized by domain")
+    root: Dict[str, DomainFeedback] = Field(..., description="Text feedback organized by domain")
 
-class ConsolidatedSummary(BaseModel):
+class ConsolidatedSummary(RootModel[Dict[str, DomainSummary]]):
     #Consolidated summary model
-    __root__: Dict[str, DomainSummary] = Field(..., description="Comprehensive summary organized by domain")
-    
-    class Config:
-        arbitrary_types_allowed = True
\ No newline at end of file
+    root: Dict[str, DomainSummary] = Field(..., description="Comprehensive summary organized by domain")
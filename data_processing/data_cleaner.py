@@ -1,8 +1,39 @@
 # data_processing/data_cleaner.py
+import numpy as np
 import pandas as pd
 import os
 import re
-from typing import Dict, List, Any, Optional
+from functools import lru_cache
+from typing import Dict, Optional
+
+# Columns holding a small set of values repeated on every row, read as categoricals so
+# comparisons, string tests and grouping work on the distinct values instead of every row
+CATEGORICAL_COLUMNS = [
+   'student', 'formname', 'phasename', 'academicyearname', 'questionname', 'text_answer_category'
+]
+
+# Raw export columns read by the cleaner; any others are skipped while parsing
+RAW_COLUMNS = CATEGORICAL_COLUMNS + [
+   'releasedate', 'questionchoicetext', 'ratingscalequestiontext', 'rating_answer_sortorder', 'text_answer'
+]
+
+# Question that opens each evaluator's block of answers within a form submission
+ROLE_QUESTION = "Please select your role:"
+
+# Patterns used per row, compiled once
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+_WS_RE = re.compile(r'\s+')
+_PLACEHOLDER_RE = re.compile(r'<[A-Z_]+>')
+_EPA_RE = re.compile(r'EPA\s*(\d+)')
+
+@lru_cache(maxsize=512)
+def _question_key(text: str) -> str:
+   """Snake_case key for a question text; the same few question texts repeat on every form"""
+   # Remove non-alphanumeric characters, convert to lowercase
+   text = _NON_WORD_RE.sub('', text.lower())
+   
+   # Replace spaces with underscores
+   return _WS_RE.sub('_', text.strip())
 
 class DataCleaner:
    """Data cleaner for medical student assessment data"""
@@ -15,6 +46,8 @@ class DataCleaner:
            input_file_path: Path to raw data file
            output_file_path: Path where clean data should be saved
                            If None, saves to cpa_data/cpa_clean.csv
+                           A .parquet path is written as zstd-compressed Parquet
+                           (requires pyarrow or fastparquet), anything else as CSV
        
        Returns:
            Path to cleaned file
@@ -27,19 +60,47 @@ class DataCleaner:
        
        try:
            # Read and process data
-           df = pd.read_csv(input_file_path, dtype=str)
-           df = df.fillna('')
+           df = self._read_raw_data(input_file_path)
            
            clean_data = self._process_data(df)
            
-           # Save cleaned data
-           clean_data.to_csv(output_file_path, index=False)
+           # Save cleaned data - Parquet keeps the column dtypes and loads much faster than CSV
+           if output_file_path.endswith('.parquet'):
+               clean_data.to_parquet(output_file_path, index=False, compression='zstd')
+           else:
+               clean_data.to_csv(output_file_path, index=False)
            
            return output_file_path
            
        except Exception as e:
            raise Exception(f"Error cleaning data: {str(e)}")
    
+   def _read_raw_data(self, input_file_path: str) -> pd.DataFrame:
+       """
+       Read the columns of the raw export the cleaner uses, as strings with missing values as ''.
+       Low-cardinality columns are parsed straight into categoricals.
+       
+       Args:
+           input_file_path: Path to raw data file
+           
+       Returns:
+           DataFrame with raw data
+       """
+       df = pd.read_csv(
+           input_file_path,
+           usecols=lambda column: column in RAW_COLUMNS,
+           dtype={column: 'category' if column in CATEGORICAL_COLUMNS else str for column in RAW_COLUMNS}
+       )
+       for column in df.columns:
+           if column not in CATEGORICAL_COLUMNS:
+               df[column] = df[column].fillna('')
+               continue
+           # Missing values become a '' category. Categories are kept sorted, since they order
+           # the groupby of evaluator blocks and so the output rows.
+           categories = df[column].cat.categories.tolist() + ([''] if df[column].hasnans else [])
+           df[column] = df[column].cat.set_categories(sorted(categories)).fillna('')
+       return df
+   
    def _process_data(self, df: pd.DataFrame) -> pd.DataFrame:
        """
        Process and clean the assessment data
@@ -50,133 +111,52 @@ class DataCleaner:
        Returns:
            DataFrame with cleaned data
        """
-       # Create a list to store clean rows
-       clean_rows = []
+       # Skip rows without a student ID, and forms missing their phase or academic year
+       df = df[(df['student'] != '') & (df['phasename'] != '') & (df['academicyearname'] != '')]
        
-       # Group by student
-       student_groups = df.groupby('student')
+       # Parse all ratings in one vectorized pass: whole numbers are kept, anything else is NaN
+       ratings = pd.to_numeric(df['rating_answer_sortorder'], errors='coerce')
+       df = df.assign(rating_answer_sortorder=ratings.where(ratings == ratings.round()))
        
-       for student_id, student_df in student_groups:
-           # Skip empty student IDs
-           if not student_id or pd.isna(student_id):
-               continue
-               
-           # Group by form submission (form, phase, year, date)
-           # Create a temporary column for grouping
-           student_df = student_df.copy()
-           student_df['form_key'] = student_df.apply(
-               lambda row: f"{row.get('formname', '')}|{row.get('phasename', '')}|{row.get('academicyearname', '')}|{row.get('releasedate', '')}", 
-               axis=1
-           )
-           
-           # Group by form key
-           form_groups = student_df.groupby('form_key')
-           
-           for form_key, form_df in form_groups:
-               # Skip invalid form keys
-               if '||' in form_key:
-                   continue
-                   
-               # Extract form metadata
-               form_parts = form_key.split('|')
-               if len(form_parts) != 4:
-                   continue
-                   
-               form_name, phase_name, academic_year, release_date = form_parts
-               
-               # Find evaluator blocks
-               evaluator_blocks = self._identify_evaluator_blocks(form_df)
-               
-               # Process each evaluator block
-               for evaluator_df in evaluator_blocks:
-                   # Skip blocks without role information
-                   role_row = evaluator_df[evaluator_df['questionname'] == "Please select your role:"]
-                   if role_row.empty:
-                       continue
-                       
-                   # Extract role and frequency
-                   role = role_row['questionchoicetext'].iloc[0] if not role_row['questionchoicetext'].empty else ''
-                   
-                   frequency_row = evaluator_df[evaluator_df['questionname'] == "Frequency"]
-                   frequency = frequency_row['questionchoicetext'].iloc[0] if not frequency_row.empty and not frequency_row['questionchoicetext'].empty else ''
-                   
-                   # Extract professionalism ratings
-                   prof_rows = evaluator_df[(evaluator_df['questionname'] == "Professionalism:") & 
-                                         (evaluator_df['rating_answer_sortorder'].notna())]
-                   
-                   # Extract communication ratings - include both Communication: questions and CES competency
-                   comm_rows = evaluator_df[
-                       (
-                           evaluator_df['questionname'].str.contains("Communication:", na=False) |
-                           evaluator_df['questionname'].str.contains("Advocates for patients by addressing social determinants", na=False) |
-                           evaluator_df['questionname'].str.contains("CES competency", na=False)
-                       ) & 
-                       (evaluator_df['rating_answer_sortorder'].notna())
-                   ]
-                   
-                   # Extract EPA skills
-                   epa_rows = evaluator_df[evaluator_df['questionname'].str.contains("EPA", na=False) & 
-                                        (evaluator_df['rating_answer_sortorder'].notna())]
-                   
-                   # Extract comments
-                   strength_row = evaluator_df[evaluator_df['text_answer_category'] == "positive"]
-                   strength_comment = self._clean_comment(strength_row['text_answer'].iloc[0]) if not strength_row.empty else ''
-                   
-                   improvement_row = evaluator_df[evaluator_df['text_answer_category'] == "improvement"]
-                   improvement_comment = self._clean_comment(improvement_row['text_answer'].iloc[0]) if not improvement_row.empty else ''
-                   
-                   # Create base row with student and form info
-                   base_row = {
-                       'student_id': student_id,
-                       'form_name': form_name,
-                       'phase_name': phase_name,
-                       'academic_year': academic_year,
-                       'release_date': self._format_date(release_date),
-                       'evaluator_role': role,
-                       'frequency': frequency,
-                       'strengths_comment': strength_comment,
-                       'improvements_comment': improvement_comment
-                   }
-                   
-                   # Add professionalism ratings
-                   for _, row in prof_rows.iterrows():
-                       question = row.get('ratingscalequestiontext', '')
-                       if question:
-                           key = f"prof_{self._convert_to_key(question)}"
-                           base_row[key] = self._safe_int(row.get('rating_answer_sortorder'))
-                   
-                   # Add communication ratings
-                   for _, row in comm_rows.iterrows():
-                       question_name = row.get('questionname', '')
-                       if 'Listening' in question_name or 'listening' in question_name:
-                           key = "comm_listening"
-                       elif 'shared decision' in question_name or 'decision making' in question_name:
-                           key = "comm_decision_making"
-                       elif 'Advocates for patients' in question_name or 'social determinants' in question_name or 'CES competency' in question_name:
-                           key = "comm_advocacy"
-                       else:
-                           continue  # Skip unknown communication questions
-                       
-                       base_row[key] = self._safe_int(row.get('rating_answer_sortorder'))
-                   
-                   # Add EPA ratings
-                   for _, row in epa_rows.iterrows():
-                       question_name = row.get('questionname', '')
-                       epa_match = re.search(r'EPA\s*(\d+)', question_name)
-                       if epa_match:
-                           epa_num = epa_match.group(1)
-                           key = f"epa{epa_num}"
-                           base_row[key] = self._safe_int(row.get('rating_answer_sortorder'))
-                   
-                   # Add row to results
-                   clean_rows.append(base_row)
-       
-       # Create DataFrame from rows
-       if not clean_rows:
+       # Number the evaluator blocks within each form submission (form, phase, year, date):
+       # each role question starts a new block, and rows before the first one (block 0) are dropped
+       form_keys = ['student', 'formname', 'phasename', 'academicyearname', 'releasedate']
+       df = df.assign(block_id=(df['questionname'] == ROLE_QUESTION).groupby([df[key] for key in form_keys], observed=True).cumsum())
+       df = df[df['block_id'] > 0]
+       
+       # Index every evaluator block in a single groupby pass; blocks are ordered by student,
+       # form submission and block number, and become the output rows in that order.
+       # Submissions sort field by field, so a form, phase or year sorts before any longer
+       # value it is a prefix of ("Med" before "Med CPA" and "Med-Peds").
+       evaluator_blocks = df.groupby(form_keys + ['block_id'], observed=True)
+       block_index = evaluator_blocks.ngroup().to_numpy()
+       n_blocks = evaluator_blocks.ngroups
+       if not n_blocks:
            return pd.DataFrame()
        
-       # Convert list of dictionaries to DataFrame
-       result_df = pd.DataFrame(clean_rows)
+       # Block-level fields, each filled into a preallocated column array indexed by block.
+       # A block's first row is its role question.
+       first_rows = self._first_row_per_block(block_index, n_blocks, np.ones(len(df), dtype=bool))
+       question_names = df['questionname']
+       text_categories = df['text_answer_category']
+       frequency_rows = self._first_row_per_block(block_index, n_blocks, (question_names == "Frequency").to_numpy())
+       strength_rows = self._first_row_per_block(block_index, n_blocks, (text_categories == "positive").to_numpy())
+       improvement_rows = self._first_row_per_block(block_index, n_blocks, (text_categories == "improvement").to_numpy())
+       
+       result_df = pd.DataFrame({
+           'student_id': df['student'].to_numpy()[first_rows],
+           'form_name': df['formname'].to_numpy()[first_rows],
+           'phase_name': df['phasename'].to_numpy()[first_rows],
+           'academic_year': df['academicyearname'].to_numpy()[first_rows],
+           'release_date': self._format_dates(df['releasedate'].to_numpy()[first_rows]),
+           'evaluator_role': df['questionchoicetext'].to_numpy()[first_rows],
+           'frequency': self._block_values(df['questionchoicetext'].to_numpy(), frequency_rows),
+           'strengths_comment': self._block_values(df['text_answer'].to_numpy(), strength_rows, self._clean_comment),
+           'improvements_comment': self._block_values(df['text_answer'].to_numpy(), improvement_rows, self._clean_comment)
+       })
+       
+       # Ratings of all blocks, extracted for the whole frame at once
+       result_df = pd.concat([result_df, self._extract_ratings(df, block_index, n_blocks)], axis=1)
        
        # Ensure consistent columns even if some data is missing
        # Add common columns that should always be present
@@ -211,44 +191,158 @@ class DataCleaner:
        
        return result_df
 
-   def _identify_evaluator_blocks(self, form_df: pd.DataFrame) -> List[pd.DataFrame]:
+   def _convert_to_key(self, text: str) -> str:
+       """Convert a question text to a snake_case key"""
+       if not text:
+           return ''
+       
+       return _question_key(text)
+
+   def _first_row_per_block(self, block_index: np.ndarray, n_blocks: int, mask: np.ndarray) -> np.ndarray:
        """
-       Identify evaluator blocks in form data
+       Position of the first row in each evaluator block matching a mask
        
        Args:
-           form_df: DataFrame with form data
+           block_index: Evaluator block of each row
+           n_blocks: Number of evaluator blocks
+           mask: Rows to consider
            
        Returns:
-           List of DataFrames, each containing data for one evaluator
+           Array of row positions indexed by block, -1 for blocks without a matching row
        """
-       # Reset index to get position information
-       form_df = form_df.reset_index(drop=True)
+       positions = np.flatnonzero(mask)
+       blocks, first = np.unique(block_index[positions], return_index=True)
+       rows = np.full(n_blocks, -1)
+       rows[blocks] = positions[first]
+       return rows
+
+   def _block_values(self, values: np.ndarray, rows: np.ndarray, convert=None) -> np.ndarray:
+       """
+       Values at each block's row from _first_row_per_block, '' for blocks without one
        
-       # Find rows that start new evaluator blocks
-       block_starts = form_df[form_df['questionname'] == "Please select your role:"].index.tolist()
+       Args:
+           values: Column values of all rows
+           rows: Row position per block, -1 for none
+           convert: Optional function applied to each present value
+           
+       Returns:
+           Object array of values indexed by block
+       """
+       result = np.full(len(rows), '', dtype=object)
+       present = rows >= 0
+       picked = values[rows[present]]
+       result[present] = [convert(value) for value in picked] if convert else picked
+       return result
+
+   def _extract_ratings(self, df: pd.DataFrame, block_index: np.ndarray, n_blocks: int) -> pd.DataFrame:
+       """
+       Scatter every professionalism, communication and EPA rating into its evaluator block's
+       output column in one vectorized pass over the frame
+       
+       Args:
+           df: Rows of the evaluator blocks, with parsed ratings
+           block_index: Evaluator block (output row) of each row
+           n_blocks: Number of evaluator blocks
+           
+       Returns:
+           DataFrame with one row per evaluator block and one column per rating key, in order of
+           first appearance. Within a block, a later rating for the same key overwrites earlier ones.
+       """
+       question_names = df['questionname'].astype('category')
+       ratings = df['rating_answer_sortorder'].to_numpy()
+       rated = ~np.isnan(ratings)
+       
+       # Rating key of each row as a professionalism, communication and EPA question; a row
+       # matching several kinds of question is written under each of its keys
+       prof_texts = df['ratingscalequestiontext'][(question_names == "Professionalism:") & (df['ratingscalequestiontext'] != '')]
+       prof_keys = ('prof_' + prof_texts.map(self._convert_to_key)).reindex(df.index)
+       
+       # Communication and EPA keys classified once per distinct question name, then looked up
+       # for every row through its category code
+       question_keys = self._question_keys(question_names.cat.categories)
+       codes = question_names.cat.codes.to_numpy()
+       comm_keys = pd.Series(question_keys['comm'].to_numpy()[codes], index=df.index)
+       epa_keys = pd.Series(question_keys['epa'].to_numpy()[codes], index=df.index)
+       
+       # One entry per (row, key); sorting by (block, kind, row position) orders them the way
+       # a block's row dict used to be filled
+       positions = np.arange(len(df))
+       entry_frames = []
+       for kind, keys in enumerate((prof_keys, comm_keys, epa_keys)):
+           mask = keys.notna().to_numpy() & rated
+           entry_frames.append(pd.DataFrame({
+               'block': block_index[mask], 'kind': kind, 'position': positions[mask],
+               'key': keys.to_numpy()[mask], 'rating': ratings[mask]
+           }))
+       entries = pd.concat(entry_frames).sort_values(['block', 'kind', 'position'], kind='stable')
        
-       # Add end marker
-       block_starts.append(len(form_df))
+       # Number the keys in order of first appearance, which is the output column order, so the
+       # dedupe and the scatter work on integer (block, column) pairs rather than key strings
+       key_codes, columns = pd.factorize(entries['key'])
+       entries = entries.assign(key=key_codes).drop_duplicates(['block', 'key'], keep='last')
        
-       # Extract blocks
-       blocks = []
-       for i in range(len(block_starts) - 1):
-           start_idx = block_starts[i]
-           end_idx = block_starts[i + 1]
-           blocks.append(form_df.iloc[start_idx:end_idx].copy())
+       values = np.full((n_blocks, len(columns)), np.nan)
+       values[entries['block'].to_numpy(), entries['key'].to_numpy()] = entries['rating'].to_numpy()
+       rating_df = pd.DataFrame(values, columns=columns)
        
-       return blocks
+       # Columns rated in every block hold whole numbers only
+       complete = [column for column in columns if rating_df[column].notna().all()]
+       return rating_df.astype({column: 'int64' for column in complete})
 
-   def _convert_to_key(self, text: str) -> str:
-       """Convert a question text to a snake_case key"""
-       if not text:
-           return ''
+   def _question_keys(self, question_names: pd.Index) -> pd.DataFrame:
+       """
+       Communication and EPA rating keys of each distinct question name
+       
+       Args:
+           question_names: Distinct question names
+           
+       Returns:
+           DataFrame aligned with question_names with 'comm' and 'epa' columns, None where a
+           question is not of that kind
+       """
+       names = pd.Series(question_names, dtype=object)
        
-       # Remove non-alphanumeric characters, convert to lowercase
-       text = re.sub(r'[^\w\s]', '', text.lower())
+       # Communication ratings - include both Communication: questions and CES competency;
+       # unknown communication questions are skipped
+       is_comm = names.str.contains(
+           "Communication:|Advocates for patients by addressing social determinants|CES competency"
+       ).to_numpy(dtype=bool)
+       comm_keys = np.select(
+           [
+               names.str.contains("Listening|listening").to_numpy(dtype=bool),
+               names.str.contains("shared decision|decision making").to_numpy(dtype=bool),
+               names.str.contains("Advocates for patients|social determinants|CES competency").to_numpy(dtype=bool)
+           ],
+           ["comm_listening", "comm_decision_making", "comm_advocacy"],
+           default=None
+       )
        
-       # Replace spaces with underscores
-       return re.sub(r'\s+', '_', text.strip())
+       return pd.DataFrame({
+           'comm': np.where(is_comm, comm_keys, None),
+           'epa': ('epa' + names.str.extract(_EPA_RE, expand=False)).to_numpy(dtype=object)
+       })
+
+   def _format_dates(self, dates: np.ndarray) -> np.ndarray:
+       """
+       Format date strings to ISO standard, parsing each distinct string once in one vectorized pass
+       
+       Args:
+           dates: Date strings, m/d/yy with or without a time
+           
+       Returns:
+           Object array of ISO dates aligned with dates; strings in any other format fall back
+           to _format_date
+       """
+       codes, unique_dates = pd.factorize(dates)
+       unique_dates = pd.Series(unique_dates, dtype=object)
+       parsed = pd.to_datetime(unique_dates, format='%m/%d/%y %H:%M', errors='coerce')
+       for date_format in ('%m/%d/%y %H:%M:%S', '%m/%d/%y'):
+           parsed = parsed.combine_first(pd.to_datetime(unique_dates, format=date_format, errors='coerce'))
+       iso_dates = np.array([
+           iso_date if isinstance(iso_date, str) else self._format_date(date)
+           for date, iso_date in zip(unique_dates, parsed.dt.strftime('%Y-%m-%d'))
+       ], dtype=object)
+       return iso_dates[codes]
 
    def _format_date(self, date_string: str) -> str:
        """Format date to ISO standard"""
@@ -273,20 +367,11 @@ class DataCleaner:
            return ''
        
        # Remove placeholder tags like <LOCATION>, <ADDRESSES>, etc.
-       comment = re.sub(r'<[A-Z_]+>', '[REDACTED]', comment)
+       comment = _PLACEHOLDER_RE.sub('[REDACTED]', comment)
        # Fix common formatting issues
-       comment = re.sub(r'\s+', ' ', comment).strip()
+       comment = _WS_RE.sub(' ', comment).strip()
        
        return comment
-
-   def _safe_int(self, value: Any) -> Optional[int]:
-       """Safely convert a value to integer"""
-       if value is None or pd.isna(value) or value == '':
-           return None
-       try:
-           return int(value)
-       except (ValueError, TypeError):
-           return None
        
 if __name__ == "__main__":
     import os
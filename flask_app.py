@@ -1,30 +1,55 @@
 from flask import Flask, render_template, request, jsonify, send_file
+from flask.json.provider import DefaultJSONProvider
 import pandas as pd
 import numpy as np
 import os
 import sys
-import json
+import re
 import time
 import io
+import gzip
+import logging
+import threading
+from contextlib import nullcontext
+from functools import lru_cache
 from pathlib import Path
+import httpx
 from dotenv import load_dotenv
 MINIMUM_FORMS_FOR_TEMPORAL_ANALYSIS = 8  # 时间趋势分析需要的最小评估数
 MINIMUM_FORMS_FOR_GENERAL_ANALYSIS = 3   # 一般分析需要的最小评估数
+# 时间趋势查询关键词
+TEMPORAL_QUERY_RE = re.compile(r'over time|changed|improved|progress|progression|trend|evolution', re.IGNORECASE)
 # Load environment variables
 load_dotenv()
 
+# Agent progress is logged at INFO; set LOG_LEVEL=DEBUG for agent diagnostics
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(levelname)s %(name)s: %(message)s")
+
 # Add the CPA system directory to the path
 sys.path.append(".")
 
 # Import from your system
 from agents.orchestrator_agent import OrchestratorAgent
 from memory.shared_memory import SharedMemory
+from config.constants import LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS, LLM_HTTP_TIMEOUT_SECONDS
+from utils.llm_cache import llm_cache
+from utils.json_helpers import jdumps, jloads
+
+# Set LLM_NO_CACHE=1 to bypass the LLM response cache (e.g. while editing prompts)
+if os.getenv("LLM_NO_CACHE"):
+    llm_cache.enabled = False
 
 # Fixed import - use the function we created in main.py
+@lru_cache(maxsize=1)
 def get_llm_client():
     """
-    Create LLM client - uses Azure OpenAI in production, regular OpenAI in development
+    Create LLM client - uses Azure OpenAI in production, regular OpenAI in development.
+    Built once per process so every request and agent shares the same keep-alive connection pools.
     """
+    http_limits = httpx.Limits(max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS)
+    http_client = httpx.Client(limits=http_limits, timeout=LLM_HTTP_TIMEOUT_SECONDS)
+    http_async_client = httpx.AsyncClient(limits=http_limits, timeout=LLM_HTTP_TIMEOUT_SECONDS)
+    
     # Check if we're using Azure OpenAI (production)
     azure_endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
     azure_api_key = os.getenv('AZURE_OPENAI_API_KEY')
@@ -38,12 +63,14 @@ def get_llm_client():
             openai_api_key=azure_api_key,
             azure_endpoint=azure_endpoint,
             openai_api_version="2024-02-15-preview",
-            temperature=0
+            temperature=0,
+            http_client=http_client,
+            http_async_client=http_async_client
         )
     else:
         # Fall back to regular OpenAI (local development)
         print("Using regular OpenAI...")
-        from langchain_community.chat_models import ChatOpenAI
+        from langchain_openai import ChatOpenAI
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
             raise Exception("No OpenAI API key configured")
@@ -51,10 +78,102 @@ def get_llm_client():
         return ChatOpenAI(
             temperature=0, 
             model_name="gpt-4o", 
-            openai_api_key=api_key
+            openai_api_key=api_key,
+            http_client=http_client,
+            http_async_client=http_async_client
         )
 
+@lru_cache(maxsize=1)
+def get_embeddings_client():
+    """
+    Create the embeddings client used by the semantic response cache, or None when no
+    embedding model is configured (AZURE_OPENAI_EMBEDDING_DEPLOYMENT / OPENAI_EMBEDDING_MODEL)
+    """
+    azure_endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
+    azure_api_key = os.getenv('AZURE_OPENAI_API_KEY')
+    embedding_deployment = os.getenv('AZURE_OPENAI_EMBEDDING_DEPLOYMENT')
+    if azure_endpoint and azure_api_key and embedding_deployment:
+        from langchain_openai import AzureOpenAIEmbeddings
+        return AzureOpenAIEmbeddings(
+            azure_deployment=embedding_deployment,
+            openai_api_key=azure_api_key,
+            azure_endpoint=azure_endpoint,
+            openai_api_version="2024-02-15-preview"
+        )
+    
+    embedding_model = os.getenv('OPENAI_EMBEDDING_MODEL')
+    api_key = os.getenv('OPENAI_API_KEY')
+    if embedding_model and api_key:
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=embedding_model, openai_api_key=api_key)
+    return None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, matching the serialization used by the agents"""
+    
+    def dumps(self, obj, **kwargs):
+        # Keys are sorted like Flask's default provider (sort_keys=True)
+        return jdumps(obj, indent=bool(kwargs.get("indent")), sort_keys=kwargs.get("sort_keys", self.sort_keys))
+    
+    def loads(self, s, **kwargs):
+        return jloads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+DEFAULT_DATA_PATH = "cpa_data/cpa_clean.csv"
+# Parquet copy of the cleaned data (DataCleaner output with a .parquet path), preferred when present
+PARQUET_DATA_PATH = "cpa_data/cpa_clean.parquet"
+# Downloaded reports larger than this are sent gzipped
+DOWNLOAD_GZIP_MIN_BYTES = 64 * 1024
+
+# Cleaned assessment data, shared by all requests and re-read only when the file changes
+_data_cache = {'source': None, 'df': None, 'students': None, 'by_student': None, 'score_means': None, 'score_counts': None}
+_data_cache_lock = threading.Lock()
+
+# Prefixes of the EPA, professionalism and communication score columns
+SCORE_PREFIXES = ('epa', 'prof_', 'comm_')
+# Columns the agents read besides the score columns; the rest (student ID, phase, academic
+# year, frequency) are not sent to /analyze's orchestrator
+ORCHESTRATOR_COLUMNS = ('form_name', 'release_date', 'evaluator_role', 'strengths_comment', 'improvements_comment')
+
+def _read_data(path):
+    """Read the cleaned data, falling back to the CSV when no Parquet engine is installed"""
+    if path.endswith('.parquet'):
+        try:
+            return pd.read_parquet(path)
+        except ImportError:
+            logging.getLogger(__name__).warning("No Parquet engine installed, reading %s instead", DEFAULT_DATA_PATH)
+            path = DEFAULT_DATA_PATH
+    return pd.read_csv(path)
+
+def _get_data_cache():
+    """
+    Get the cached data, loading the file only on first use and after it is modified. The rows of
+    each student, and their means and counts of every score column, are computed once per load.
+    """
+    path = PARQUET_DATA_PATH if os.path.exists(PARQUET_DATA_PATH) else DEFAULT_DATA_PATH
+    source = (path, os.stat(path).st_mtime_ns)
+    with _data_cache_lock:
+        if _data_cache['source'] != source:
+            df = _read_data(path)
+            by_student = df.groupby('student_id', sort=False)
+            score_cols = [col for col in df.columns if col.startswith(SCORE_PREFIXES)]
+            _data_cache.update(
+                source=source, df=df,
+                students=list(by_student.groups),
+                by_student=dict(iter(by_student)),
+                score_means=by_student[score_cols].mean(),
+                score_counts=by_student[score_cols].count()
+            )
+        return _data_cache
+
+def get_student_data(student_id):
+    """
+    Get one student's rows of the cleaned data, or None when there are none. Callers must treat
+    the returned DataFrame as read-only, since it is shared by all requests.
+    """
+    return _get_data_cache()['by_student'].get(student_id)
 
 # Sample queries
 sample_queries = [
@@ -72,10 +191,7 @@ def home():
 @app.route('/get_students', methods=['POST'])
 def get_students():
     try:
-        default_data_path = "cpa_data/cpa_clean.csv"
-        df = pd.read_csv(default_data_path)
-        unique_student_ids = df['student_id'].unique().tolist()
-        return jsonify({'students': unique_student_ids})
+        return jsonify({'students': _get_data_cache()['students']})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -85,12 +201,10 @@ def get_student_info():
         data = request.json
         student_id = data.get('student_id')
         
-        default_data_path = "cpa_data/cpa_clean.csv"
-        df = pd.read_csv(default_data_path)
+        data_cache = _get_data_cache()
+        student_data = data_cache['by_student'].get(student_id)
         
-        student_data = df[df['student_id'] == student_id]
-        
-        if student_data.empty:
+        if student_data is None:
             return jsonify({'error': f'No data found for Student ID: {student_id}'}), 404
         
         num_assessments = len(student_data)
@@ -106,24 +220,27 @@ def get_student_info():
         if not dates.empty and not all(pd.isna(dates)):
             date_range = f"{dates.min().strftime('%m/%d/%Y')} to {dates.max().strftime('%m/%d/%Y')}"
         
-        # Calculate individual EPA averages with assessment counts (dynamically find all EPAs)
-        epa_averages = {}
-        # Find all EPA columns that exist in the data
-        epa_cols = [col for col in student_data.columns if col.startswith('epa')]
+        # Score averages with assessment counts, precomputed per student at load time
+        score_means = data_cache['score_means'].loc[student_id]
+        score_counts = data_cache['score_counts'].loc[student_id]
+        
+        def score_summary(col):
+            # Only include columns the student has actual data for (not all NaN/null)
+            if col not in score_counts.index or not score_counts[col]:
+                return None
+            return {
+                'score': round(float(score_means[col]), 2),
+                'count': int(score_counts[col])
+            }
         
-        for epa_col in epa_cols:
-            epa_data = student_data[epa_col].dropna()
-            # Only include if student has actual data (not all NaN/null)
-            if not epa_data.empty:
-                epa_avg = epa_data.mean()
-                epa_averages[epa_col.upper()] = {
-                    'score': round(float(epa_avg), 2),
-                    'count': len(epa_data)
-                }
+        # Individual EPA averages (dynamically find all EPAs)
+        epa_averages = {}
+        for epa_col in score_counts.index:
+            if epa_col.startswith('epa') and (summary := score_summary(epa_col)):
+                epa_averages[epa_col.upper()] = summary
         
-        # Calculate professionalism averages with assessment counts in specified order
+        # Professionalism averages in specified order
         professionalism_averages = {}
-        prof_cols = [col for col in student_data.columns if col.startswith('prof_')]
         
         # Define the desired order and display names
         prof_order = [
@@ -135,18 +252,11 @@ def get_student_info():
         ]
         
         for prof_col, display_name in prof_order:
-            if prof_col in prof_cols:
-                prof_data = student_data[prof_col].dropna()
-                if not prof_data.empty:
-                    prof_avg = prof_data.mean()
-                    professionalism_averages[display_name] = {
-                        'score': round(float(prof_avg), 2),
-                        'count': len(prof_data)
-                    }
+            if summary := score_summary(prof_col):
+                professionalism_averages[display_name] = summary
         
-        # Calculate communication averages with assessment counts
+        # Communication averages
         communication_averages = {}
-        comm_cols = [col for col in student_data.columns if col.startswith('comm_')]
         
         # Custom mapping for communication column names to match assessment form
         comm_name_mapping = {
@@ -155,16 +265,11 @@ def get_student_info():
             'comm_advocacy': 'Advocates for patients by addressing social determinants of health'
         }
         
-        for comm_col in comm_cols:
-            comm_data = student_data[comm_col].dropna()
-            if not comm_data.empty:
-                comm_avg = comm_data.mean()
+        for comm_col in score_counts.index:
+            if comm_col.startswith('comm_') and (summary := score_summary(comm_col)):
                 # Use custom mapping
                 display_name = comm_name_mapping.get(comm_col, comm_col.replace('comm_', '').replace('_', ' ').title())
-                communication_averages[display_name] = {
-                    'score': round(float(comm_avg), 2),
-                    'count': len(comm_data)
-                }
+                communication_averages[display_name] = summary
         
         return jsonify({
             'num_assessments': num_assessments,
@@ -217,18 +322,15 @@ def analyze():
             return jsonify({'error': 'Missing required fields'}), 400
         
         # Load data
-        default_data_path = "cpa_data/cpa_clean.csv"
-        df = pd.read_csv(default_data_path)
-        student_data = df[df['student_id'] == student_id]
+        student_data = get_student_data(student_id)
         
-        if student_data.empty:
+        if student_data is None:
             return jsonify({'error': f'No data found for Student ID: {student_id}'}), 404
         
         num_assessments = len(student_data)
         
         # 检查是否是时间趋势查询
-        temporal_keywords = ['over time', 'changed', 'improved', 'progress', 'progression', 'trend', 'evolution']
-        is_temporal_query = any(keyword in query.lower() for keyword in temporal_keywords)
+        is_temporal_query = bool(TEMPORAL_QUERY_RE.search(query))
         
         # 数据充足性检查
         if num_assessments < MINIMUM_FORMS_FOR_GENERAL_ANALYSIS:
@@ -247,11 +349,11 @@ def analyze():
         llm = get_llm_client()
         
         shared_memory = SharedMemory()
-        orchestrator = OrchestratorAgent(llm=llm, shared_memory=shared_memory)
+        orchestrator = OrchestratorAgent(llm=llm, shared_memory=shared_memory, embeddings=get_embeddings_client())
         
-        # Prepare data
-        selected_rows = student_data.values.tolist()
-        columns = student_data.columns.tolist()
+        # Prepare data - only the columns the agents read
+        columns = [col for col in student_data.columns if col in ORCHESTRATOR_COLUMNS or col.startswith(SCORE_PREFIXES)]
+        selected_rows = student_data[columns].values.tolist()
         
         # Run analysis
         response = orchestrator.run(
@@ -276,22 +378,21 @@ def download_analysis():
         response_text = data.get('response')
         student_id = data.get('student_id')
         
-        # Create a text file in memory
-        output = io.StringIO()
-        output.write(f"Student Analysis Report - ID: {student_id}\n")
-        output.write("="*50 + "\n\n")
-        output.write(response_text)
-        
-        # Convert to bytes
+        # Encode straight into one in-memory file; large reports are gzipped
+        header = f"Student Analysis Report - ID: {student_id}\n{'=' * 50}\n\n".encode('utf-8')
+        body = response_text.encode('utf-8')
+        compress = len(header) + len(body) > DOWNLOAD_GZIP_MIN_BYTES
         mem = io.BytesIO()
-        mem.write(output.getvalue().encode('utf-8'))
+        with (gzip.GzipFile(fileobj=mem, mode='wb') if compress else nullcontext(mem)) as output:
+            output.write(header)
+            output.write(body)
         mem.seek(0)
         
         return send_file(
             mem,
             as_attachment=True,
-            download_name=f'student_{student_id}_analysis.txt',
-            mimetype='text/plain'
+            download_name=f'student_{student_id}_analysis.txt' + ('.gz' if compress else ''),
+            mimetype='application/gzip' if compress else 'text/plain'
         )
         
     except Exception as e:
@@ -2,19 +2,149 @@
 Shared memory implementation - Central data storage for all agents in the system
 """
 
-from typing import Dict, Any, List, Optional
+import threading
+from types import MappingProxyType
+from typing import Dict, Any, Iterable, List, Optional
+
+# Static mappings - immutable data shared by every SharedMemory instance
+
+# Column name -> value type, used to cast raw table columns
+COLUMN_TYPE_MAP = MappingProxyType({
+    "student_id": "text",
+    "form_name": "text",
+    "phase_name": "text",
+    "academic_year": "date",
+    "release_date": "date",
+    "evaluator_role": "text",
+    "frequency": "text",
+    "strengths_comment": "text",
+    "improvements_comment": "text",
+    # Professionalism EPA fields (numeric scale)
+    "prof_shows_dependability_truthfulness_and_integrity": "int",
+    "prof_acknowledges_and_demonstrates_awareness_of_limitations": "int",
+    "prof_takes_initiative_for_own_learning_and_patient_care": "int",
+    "prof_remains_open_to_feedback_and_attempts_to_implement_it": "int",
+    "prof_treats_all_patients_with_respect_and_compassion_protects_patient_confidentiality": "int",
+    # Communication fields
+    "comm_listening": "int",
+    "comm_decision_making": "int",
+    "comm_advocacy": "int",
+    "comm_other": "text",
+    # EPA fields (numeric scale)
+    "epa1": "int",  # History Taking and Physical Exam
+    "epa2": "int",  # Clinical Reasoning, Differential Diagnosis
+    "epa3": "int",  # Recommend & Interpret Tests
+    "epa4": "int",  # Enter & Discuss Orders and Prescriptions
+    "epa5": "int",  # Written Notes
+    "epa6": "int",  # Oral Presentation of Patient
+    "epa7": "int",  # Medical Decision Making
+    "epa8": "int",  # Providing Appropriate Patient Transitions
+    "epa9": "int",  # Contributes as a Member of the Team
+    "epa10": "int", # Recognition of Patients Needing Urgent Care
+    "epa14": "int", # Teaching of Students
+})
+
+# Keyword to field mapping (no domains, direct field mapping)
+KEYWORD_FIELD_MAP = MappingProxyType({
+    # EPA mappings
+    "history taking": "epa1",
+    "history": "epa1", 
+    "H&P": "epa1",
+    "HandP": "epa1",
+    "physical exam": "epa1",
+    "PE": "epa1",
+    "clinical reasoning": "epa2",
+    "differential diagnosis": "epa2",
+    "ddx": "epa2",
+    "diagnostic tests": "epa3",
+    "screening tests": "epa3",
+    "interpret tests": "epa3",
+    "recommend tests": "epa3",
+    "orders": "epa4",
+    "prescriptions": "epa4",
+    "documentation": "epa5",
+    "written notes": "epa5",
+    "oral presentation": "epa6",
+    "presentation": "epa6",
+    "medical decision": "epa7",
+    "literature": "epa7",
+    "transitions": "epa8",
+    "handoff": "epa8",
+    "team member": "epa9",
+    "teamwork": "epa9",
+    "interaction": "epa9",
+    "urgent care": "epa10",
+    "emergent care": "epa10",
+    "teaching": "epa14",
+    "mentoring": "epa14",
+    
+    # Communication mappings
+    "listening": "comm_listening",
+    "decision making": "comm_decision_making",
+    "shared decision": "comm_decision_making",
+    "social determinants": "comm_advocacy",
+    "advocacy": "comm_advocacy",
+    "advocates": "comm_advocacy",
+    "patient advocacy": "comm_advocacy",
+    
+    # Professionalism mappings
+    "professionalism": "professionalism_category",
+    "integrity": "prof_shows_dependability_truthfulness_and_integrity",
+    "dependability": "prof_shows_dependability_truthfulness_and_integrity",
+    "limitations": "prof_acknowledges_and_demonstrates_awareness_of_limitations",
+    "initiative": "prof_takes_initiative_for_own_learning_and_patient_care",
+    "open to feedback": "prof_remains_open_to_feedback_and_attempts_to_implement_it",
+    "respect": "prof_treats_all_patients_with_respect_and_compassion_protects_patient_confidentiality",
+    "compassion": "prof_treats_all_patients_with_respect_and_compassion_protects_patient_confidentiality",
+    "confidentiality": "prof_treats_all_patients_with_respect_and_compassion_protects_patient_confidentiality",
+    
+    # Text fields
+    "feedback": "strengths_comment,improvements_comment",
+    "strengths": "strengths_comment",
+    "improvements": "improvements_comment",
+})
+
+# KEYWORD_FIELD_MAP keyed by lowercased keyword, for matching against lowercased text
+KEYWORD_FIELD_MAP_LOWER = MappingProxyType({keyword.lower(): field for keyword, field in KEYWORD_FIELD_MAP.items()})
+
+# Professionalism fields grouped for easy reference
+PROFESSIONALISM_FIELDS = (
+    "prof_shows_dependability_truthfulness_and_integrity",
+    "prof_acknowledges_and_demonstrates_awareness_of_limitations",
+    "prof_takes_initiative_for_own_learning_and_patient_care",
+    "prof_remains_open_to_feedback_and_attempts_to_implement_it",
+    "prof_treats_all_patients_with_respect_and_compassion_protects_patient_confidentiality",
+)
+
+_STATIC_MAPPINGS = MappingProxyType({
+    "column_type_map": COLUMN_TYPE_MAP,
+    "keyword_field_map": KEYWORD_FIELD_MAP,
+    "keyword_field_map_lower": KEYWORD_FIELD_MAP_LOWER,
+    "professionalism_fields": PROFESSIONALISM_FIELDS,
+})
 
 
 class SharedMemory:
     """
     Shared memory implementation, serving as the central "blackboard" for all agents.
     Stores parsed data, structured queries, and various analysis results.
+    
+    Writers publish by replacing the whole memory dict with an updated copy, so readers
+    always see a consistent snapshot without taking a lock.
     """
     
+    __slots__ = ("_write_lock", "_memory", "_session_memory")
+    
+    # Static mappings are the same read-only data for every instance
+    _static_mappings = _STATIC_MAPPINGS
+    
     def __init__(self):
+        self._write_lock = threading.Lock()
         self._memory: Dict[str, Any] = {
             "parsed_data": None,  # Parsed data
+            "parsed_frame": None,  # Parsed data as a columnar DataFrame
             "structured_query": None,  # Structured query
+            "structured_query_json": None,  # Structured query rendered as prompt JSON
             "numeric_analysis": None,  # Numeric analysis
             "text_analysis": None,  # Text analysis
             "consolidated_summary": None,  # Consolidated summary
@@ -23,118 +153,8 @@ class SharedMemory:
             "user_query": None,  # User query
         }
         
-       
-        self._static_mappings = {
-            
-            "column_type_map": {
-                "student_id": "text",
-                "form_name": "text",
-                "phase_name": "text",
-                "academic_year": "date",
-                "release_date": "date",
-                "evaluator_role": "text",
-                "frequency": "text",
-                "strengths_comment": "text",
-                "improvements_comment": "text",
-                # Professionalism EPA fields (numeric scale)
-                "prof_shows_dependability_truthfulness_and_integrity": "int",
-                "prof_acknowledges_and_demonstrates_awareness_of_limitations": "int",
-                "prof_takes_initiative_for_own_learning_and_patient_care": "int",
-                "prof_remains_open_to_feedback_and_attempts_to_implement_it": "int",
-                "prof_treats_all_patients_with_respect_and_compassion_protects_patient_confidentiality": "int",
-                # Communication fields
-                "comm_listening": "int",
-                "comm_decision_making": "int",
-                "comm_advocacy": "int",
-                "comm_other": "text",
-                # EPA fields (numeric scale)
-                "epa1": "int",  # History Taking and Physical Exam
-                "epa2": "int",  # Clinical Reasoning, Differential Diagnosis
-                "epa3": "int",  # Recommend & Interpret Tests
-                "epa4": "int",  # Enter & Discuss Orders and Prescriptions
-                "epa5": "int",  # Written Notes
-                "epa6": "int",  # Oral Presentation of Patient
-                "epa7": "int",  # Medical Decision Making
-                "epa8": "int",  # Providing Appropriate Patient Transitions
-                "epa9": "int",  # Contributes as a Member of the Team
-                "epa10": "int", # Recognition of Patients Needing Urgent Care
-                "epa14": "int", # Teaching of Students
-            },
-            
-            # Keyword to field mapping (no domains, direct field mapping)
-            "keyword_field_map": {
-                # EPA mappings
-                "history taking": "epa1",
-                "history": "epa1", 
-                "H&P": "epa1",
-                "HandP": "epa1",
-                "physical exam": "epa1",
-                "PE": "epa1",
-                "clinical reasoning": "epa2",
-                "differential diagnosis": "epa2",
-                "ddx": "epa2",
-                "diagnostic tests": "epa3",
-                "screening tests": "epa3",
-                "interpret tests": "epa3",
-                "recommend tests": "epa3",
-                "orders": "epa4",
-                "prescriptions": "epa4",
-                "documentation": "epa5",
-                "written notes": "epa5",
-                "oral presentation": "epa6",
-                "presentation": "epa6",
-                "medical decision": "epa7",
-                "literature": "epa7",
-                "transitions": "epa8",
-                "handoff": "epa8",
-                "team member": "epa9",
-                "teamwork": "epa9",
-                "interaction": "epa9",
-                "urgent care": "epa10",
-                "emergent care": "epa10",
-                "teaching": "epa14",
-                "mentoring": "epa14",
-                
-                # Communication mappings
-                "listening": "comm_listening",
-                "decision making": "comm_decision_making",
-                "shared decision": "comm_decision_making",
-                "social determinants": "comm_advocacy",
-                "advocacy": "comm_advocacy",
-                "advocates": "comm_advocacy",
-                "patient advocacy": "comm_advocacy",
-                
-                # Professionalism mappings
-                "professionalism": "professionalism_category",
-                "integrity": "prof_shows_dependability_truthfulness_and_integrity",
-                "dependability": "prof_shows_dependability_truthfulness_and_integrity",
-                "limitations": "prof_acknowledges_and_demonstrates_awareness_of_limitations",
-                "initiative": "prof_takes_initiative_for_own_learning_and_patient_care",
-                "open to feedback": "prof_remains_open_to_feedback_and_attempts_to_implement_it",
-                "respect": "prof_treats_all_patients_with_respect_and_compassion_protects_patient_confidentiality",
-                "compassion": "prof_treats_all_patients_with_respect_and_compassion_protects_patient_confidentiality",
-                "confidentiality": "prof_treats_all_patients_with_respect_and_compassion_protects_patient_confidentiality",
-                
-                # Text fields
-                "feedback": "strengths_comment,improvements_comment",
-                "strengths": "strengths_comment",
-                "improvements": "improvements_comment",
-            },
-            
-            # Professionalism fields grouped for easy reference
-            "professionalism_fields": [
-                "prof_shows_dependability_truthfulness_and_integrity",
-                "prof_acknowledges_and_demonstrates_awareness_of_limitations",
-                "prof_takes_initiative_for_own_learning_and_patient_care",
-                "prof_remains_open_to_feedback_and_attempts_to_implement_it",
-                "prof_treats_all_patients_with_respect_and_compassion_protects_patient_confidentiality"
-            ]
-        }
-        
-        
-        self._session_memory: Dict[str, Any] = {
-            "last_response": None  # Last response, for multi-turn follow-up
-        }
+        # Session memory (e.g. "last_response", for multi-turn follow-up), created on first write
+        self._session_memory: Optional[Dict[str, Any]] = None
     
     def get(self, key: str, default: Any = None) -> Any:
         """
@@ -147,34 +167,79 @@ class SharedMemory:
         Returns:
             The value associated with the key, or default if not found
         """
-        if key in self._memory:
-            value = self._memory.get(key)
-            return value if value is not None else default
-        return default
+        value = self._memory.get(key)
+        return value if value is not None else default
+    
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Get several values from one snapshot of shared memory, so related values
+        published together are read together
+        
+        Args:
+            keys: The keys to retrieve
+            
+        Returns:
+            Mapping of each key to its value (None if not found)
+        """
+        memory = self._memory
+        return {key: memory.get(key) for key in keys}
     
     def set(self, key: str, value: Any) -> None:
         """Set a value in shared memory"""
-        if key in self._memory:
-            self._memory[key] = value
+        self.publish(key, value)
+    
+    def publish(self, key: str, value: Any) -> None:
+        """
+        Publish a value by swapping in an updated copy of the memory dict. Concurrent
+        writers are serialized; readers never block and never see a half-applied write.
+        
+        Args:
+            key: The key to set (unknown keys are ignored)
+            value: The value to store
+        """
+        if key not in self._memory:
+            return
+        with self._write_lock:
+            self._memory = {**self._memory, key: value}
+    
+    def set_many(self, values: Dict[str, Any]) -> None:
+        """Set several values in shared memory in one swap"""
+        self.publish_many(values)
+    
+    def publish_many(self, values: Dict[str, Any]) -> None:
+        """
+        Publish several related values in one swap, so readers see all or none of them
+        
+        Args:
+            values: Mapping of keys to values (unknown keys are ignored)
+        """
+        updates = {key: value for key, value in values.items() if key in self._memory}
+        if not updates:
+            return
+        with self._write_lock:
+            self._memory = {**self._memory, **updates}
     
-    def get_static_mapping(self, mapping_name: str) -> Dict[str, Any]:
-        """Get a static mapping"""
+    def get_static_mapping(self, mapping_name: str) -> Any:
+        """Get a static mapping (read-only)"""
         return self._static_mappings.get(mapping_name, {})
     
     def get_session_data(self, key: str) -> Any:
         """Get a value from session memory"""
-        return self._session_memory.get(key)
+        session_memory = self._session_memory
+        return session_memory.get(key) if session_memory is not None else None
     
     def set_session_data(self, key: str, value: Any) -> None:
         """Set a value in session memory"""
+        if self._session_memory is None:
+            self._session_memory = {}
         self._session_memory[key] = value
     
     def clear_session(self) -> None:
         """Clear session data"""
-        self._session_memory = {"last_response": None}
+        self._session_memory = None
     
     def clear_all(self) -> None:
         """Clear all data, including main memory"""
-        for key in self._memory:
-            self._memory[key] = None
+        with self._write_lock:
+            self._memory = dict.fromkeys(self._memory)
         self.clear_session()
\ No newline at end of file
@@ -1,14 +1,61 @@
 """
 Data processing helper functions
 """
-from typing import List, Dict, Any, Union, Tuple
+from typing import Iterable, List, Dict, Any, Optional, Union, Tuple
 import re
-import json
+import sys
+import calendar
+import heapq
 from datetime import datetime, timedelta
+from functools import lru_cache
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+
+# Patterns used per cell or per text, compiled once
+_EPA_COLUMN_RE = re.compile(r'^epa\d+$')
+_BULLET_SPLIT_RE = re.compile(r'[-•*]\s*')
+
+# Sort key of scored items, a C callable rather than a Python lambda
+_score_key = itemgetter('score')
+
+# Translation of every sentence ending to '.', for extract_sentences
+_SENTENCE_END_TRANS = str.maketrans('!?', '..')
+
+# Release date formats tried by clean_cell_value, in order
+_CELL_DATE_FORMATS = ('%m/%d/%y', '%m/%d/%Y', '%Y-%m-%d', '%d/%m/%Y')
+
+# parse_date's formats - %Y-%m-%d, %m/%d/%y, %m/%d/%Y, %d/%m/%Y and %B %d, %Y, in that order - as
+# the regexes datetime.strptime builds for them, so a date is matched without raising on every miss
+_MONTH_RE = r'(?P<m>1[0-2]|0[1-9]|[1-9])'
+_DAY_RE = r'(?P<d>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])'
+_MONTH_NUMBERS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+_PARSE_DATE_RES = (
+    re.compile(rf'(?P<Y>\d\d\d\d)-{_MONTH_RE}-{_DAY_RE}'),
+    re.compile(rf'{_MONTH_RE}/{_DAY_RE}/(?P<y>\d\d)'),
+    re.compile(rf'{_MONTH_RE}/{_DAY_RE}/(?P<Y>\d\d\d\d)'),
+    re.compile(rf'{_DAY_RE}/{_MONTH_RE}/(?P<Y>\d\d\d\d)'),
+    re.compile(rf'(?P<B>{"|".join(sorted(_MONTH_NUMBERS, key=len, reverse=True))})\s+{_DAY_RE},\s+(?P<Y>\d\d\d\d)', re.IGNORECASE),
+)
+
+# Low-cardinality text columns whose values are interned, so the rows share one string
+# object per rotation, phase, role, frequency and academic year
+_INTERNED_COLUMNS = frozenset(('form_name', 'phase_name', 'evaluator_role', 'frequency', 'academic_year'))
+
+# Lowercased cell values treated as missing
+_NULL_TOKENS = frozenset(('none', 'null', 'na', 'n/a', '#name?'))
+
+@lru_cache(maxsize=256)
+def _is_int_column(col_name: str) -> bool:
+    """
+    Whether a column holds integer scores (EPA, professionalism and communication columns).
+    Cached because a table has a handful of columns and every cell asks.
+    """
+    return bool(_EPA_COLUMN_RE.match(col_name)) or col_name.startswith(('prof_', 'comm_'))
 
 def clean_csv_data(raw_data: List[List[str]], columns: List[str]) -> List[Dict[str, Any]]:
     """
-    Clean and convert raw CSV data
+    Clean and convert raw CSV data, converting one whole column at a time
     
     Args:
         raw_data: Raw CSV row data
@@ -17,37 +64,74 @@ def clean_csv_data(raw_data: List[List[str]], columns: List[str]) -> List[Dict[s
     Returns:
         List of cleaned data dictionaries
     """
-    cleaned_data = []
-    
-    for row in raw_data:
-        
-        if len(row) != len(columns):
-            continue
-            
-        row_dict = {}
-        for i, col_name in enumerate(columns):
-            
-            value = clean_cell_value(row[i], col_name)
-            row_dict[col_name] = value
-            
+    rows = [row for row in raw_data if len(row) == len(columns)]
+    if not rows or not columns:
+        return [{} for _ in rows]
+    
+    # A repeated column name keeps its last column, as when filling a row dict
+    table = pd.DataFrame(rows, dtype=object)
+    cleaned = {}
+    for i, col_name in enumerate(columns):
+        cleaned[col_name] = _clean_column(table[i], col_name)
+    df = pd.DataFrame(cleaned)
+    
+    has_release_date = None
+    if 'release_date' in cleaned:
         # Add recency weight based on release date
-        if 'release_date' in row_dict:
-            row_dict['recency_weight'] = calculate_recency_weight(row_dict['release_date'])
-            
-            # Preserve original date string for display in evidence
-            original_date = None
-            for i, col_name in enumerate(columns):
-                if col_name == 'release_date' and i < len(row):
-                    original_date = row[i]
-                    break
-                    
-            if original_date:
-                row_dict['release_date_str'] = original_date
-            
-        cleaned_data.append(row_dict)
+        df['recency_weight'] = _recency_weights(cleaned['release_date'])
+        
+        # Preserve original date string for display in evidence
+        original_dates = table[columns.index('release_date')]
+        has_release_date = original_dates.astype(bool)
+        df['release_date_str'] = original_dates.where(has_release_date)
+    
+    # Each row dict is built in one call at its final size from the column value lists
+    df = df.astype(object).where(df.notna(), None)
+    keys = [sys.intern(key) for key in df.columns]
+    column_values = [
+        _intern_values(df[key].tolist()) if key in _INTERNED_COLUMNS else df[key].tolist() for key in keys
+    ]
+    cleaned_data = [dict(zip(keys, values)) for values in zip(*column_values)]
+    
+    # Rows without an original release date carry no release_date_str key
+    if has_release_date is not None and not has_release_date.all():
+        for row_dict, has_date in zip(cleaned_data, has_release_date):
+            if not has_date:
+                del row_dict['release_date_str']
     
     return cleaned_data
 
+def _intern_values(values: List[Any]) -> List[Any]:
+    """Share one interned string object per distinct value of a low-cardinality column"""
+    interned = {value: sys.intern(value) for value in set(values) if isinstance(value, str)}
+    return [interned.get(value, value) for value in values]
+
+def _clean_column(values: pd.Series, col_name: str) -> pd.Series:
+    """
+    Clean and convert a whole column the way clean_cell_value converts each cell
+    
+    Args:
+        values: Raw column values
+        col_name: Column name
+        
+    Returns:
+        Cleaned column; missing integers are NA and other missing values None
+    """
+    missing = ~values.astype(bool) | values.astype(str).str.lower().isin(_NULL_TOKENS)
+    values = values.where(~missing, None)
+    
+    if _is_int_column(col_name):
+        numbers = pd.to_numeric(values, errors='coerce')
+        return np.trunc(numbers.where(np.isfinite(numbers))).astype('Int64')
+    
+    if col_name == 'release_date':
+        # Release dates repeat across rows, so each distinct one is formatted once
+        formatted = {date: _format_release_date(date) for date in values[~missing].unique()}
+        return values.map(formatted).astype(object).where(~missing, None)
+    
+    # Default keep as string
+    return values
+
 def clean_cell_value(value: str, col_name: str) -> Any:
     """
     Clean and convert a single cell value
@@ -60,11 +144,11 @@ def clean_cell_value(value: str, col_name: str) -> Any:
         Cleaned and converted value
     """
     
-    if not value or str(value).lower() in ('none', 'null', 'na', 'n/a', '#name?'):
+    if not value or (value if isinstance(value, str) else str(value)).lower() in _NULL_TOKENS:
         return None
         
     
-    if re.match(r'^epa\d+$', col_name) or col_name.startswith('prof_') or col_name.startswith('comm_'):
+    if _is_int_column(col_name):
         try:
             return int(float(value))
         except (ValueError, TypeError):
@@ -72,19 +156,23 @@ def clean_cell_value(value: str, col_name: str) -> Any:
     
     
     if col_name == 'release_date':
-        # Try multiple date formats
-        for fmt in ('%m/%d/%y', '%m/%d/%Y', '%Y-%m-%d', '%d/%m/%Y'):
-            try:
-                return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
-            except ValueError:
-                continue
-        
-        # If no format works, return the original value
-        return value
+        return _format_release_date(value)
     
     # Default keep as string
     return value
 
+def _format_release_date(value: str) -> str:
+    """Format a release date to ISO standard, returning the original value if no format works"""
+    # Try multiple date formats
+    for fmt in _CELL_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    
+    # If no format works, return the original value
+    return value
+
 def parse_date(date_str: str) -> Union[datetime, None]:
     """
     Parse date string to datetime object
@@ -102,16 +190,34 @@ def parse_date(date_str: str) -> Union[datetime, None]:
     if isinstance(date_str, datetime):
         return date_str
     
+    return _parse_date_str(date_str)
+
+@lru_cache(maxsize=4096)
+def _parse_date_str(date_str: str) -> Union[datetime, None]:
+    """
+    Parse a date string, trying every supported format.
+    Cached because the same few release dates recur across rows and calls.
+    """
     # Try various formats including the standardized Y-m-d format
-    for fmt in ('%Y-%m-%d', '%m/%d/%y', '%m/%d/%Y', '%d/%m/%Y', '%B %d, %Y'):
+    for date_re in _PARSE_DATE_RES:
+        match = date_re.fullmatch(date_str)
+        if match is None:
+            continue
+        fields = match.groupdict()
+        if 'y' in fields:
+            year = int(fields['y'])
+            year += 2000 if year <= 68 else 1900
+        else:
+            year = int(fields['Y'])
+        month = _MONTH_NUMBERS[fields['B'].lower()] if 'B' in fields else int(fields['m'])
         try:
-            return datetime.strptime(date_str, fmt)
+            return datetime(year, month, int(fields['d']))
         except ValueError:
             continue
             
     return None
 
-def calculate_recency_weight(date_value: Any) -> float:
+def calculate_recency_weight(date_value: Any, now_ym: Optional[int] = None) -> float:
     """
     Calculate recency weight based on date
     - 1.0 for dates within last 3 months
@@ -120,6 +226,8 @@ def calculate_recency_weight(date_value: Any) -> float:
     
     Args:
         date_value: Date value (string, datetime, or ISO format)
+        now_ym: Current month as year * 12 + month (see current_month_number), so callers
+            weighting many dates read the clock once; defaults to the current month
         
     Returns:
         Recency weight between 0.0 and 1.0
@@ -133,8 +241,9 @@ def calculate_recency_weight(date_value: Any) -> float:
         return 0.5  # Default mid-weight if parsing fails
     
     # Calculate months between date and current date
-    current_date = datetime.now()
-    months_difference = (current_date.year - date_obj.year) * 12 + (current_date.month - date_obj.month)
+    if now_ym is None:
+        now_ym = current_month_number()
+    months_difference = now_ym - (date_obj.year * 12 + date_obj.month)
     
     # Apply weighting rule
     if months_difference <= 3:
@@ -147,6 +256,29 @@ def calculate_recency_weight(date_value: Any) -> float:
         # Linear decay between 3-9 months
         return 1.0 - (months_difference - 3) / 6
 
+def current_month_number() -> int:
+    """Current month as year * 12 + month, for calculate_recency_weight"""
+    current_date = datetime.now()
+    return current_date.year * 12 + current_date.month
+
+def _recency_weights(dates: pd.Series) -> pd.Series:
+    """
+    calculate_recency_weight for a whole column of dates, parsing each distinct date once
+    
+    Args:
+        dates: Date strings, None for missing dates
+        
+    Returns:
+        Recency weights between 0.0 and 1.0
+    """
+    parsed = {date: parse_date(date) for date in dates.dropna().unique()}
+    month_numbers = dates.map({date: d.year * 12 + d.month for date, d in parsed.items() if d}).astype(float)
+    months_difference = current_month_number() - month_numbers
+    
+    # Full weight for the last 3 months, linear decay to zero at 9 months, and the default
+    # mid-weight for missing or unparseable dates
+    return (1.0 - (months_difference - 3) / 6).clip(0.0, 1.0).fillna(0.5)
+
 def format_date_for_display(date_str: str) -> str:
     """
     Format date string for display in evidence citations
@@ -177,8 +309,9 @@ def calculate_trend(scores_with_dates: List[Dict[str, Any]]) -> Dict[str, Any]:
     if not scores_with_dates or len(scores_with_dates) < 2:
         return {"direction": "stable", "magnitude": 0, "change": 0}
     
-    # Convert dates and sort chronologically
-    dated_scores = []
+    # Convert dates, keeping the scores alongside
+    dates = []
+    scores = []
     for item in scores_with_dates:
         date_str = item.get("date")
         score = item.get("score")
@@ -186,17 +319,29 @@ def calculate_trend(scores_with_dates: List[Dict[str, Any]]) -> Dict[str, Any]:
         if date_str and score is not None:
             date_obj = parse_date(date_str)
             if date_obj:
-                dated_scores.append({"date": date_obj, "score": float(score)})
+                dates.append(date_obj)
+                scores.append(float(score))
     
-    if len(dated_scores) < 2:
+    if len(dates) < 2:
         return {"direction": "stable", "magnitude": 0, "change": 0}
     
-    # Sort by date
-    dated_scores.sort(key=lambda x: x["date"])
+    return _calculate_trend_from_arrays(np.array(dates, dtype="datetime64[us]"), np.array(scores))
+
+def _calculate_trend_from_arrays(dates: np.ndarray, scores: np.ndarray) -> Dict[str, Any]:
+    """
+    Calculate performance trend from parallel arrays of at least two dates and scores
     
-    # Get earliest and most recent scores
-    earliest = dated_scores[0]["score"]
-    most_recent = dated_scores[-1]["score"]
+    Args:
+        dates: datetime64 dates
+        scores: Scores, one per date
+        
+    Returns:
+        Dictionary with trend information
+    """
+    # Earliest is the first score on the minimum date, most recent the last on the maximum,
+    # as after a stable chronological sort
+    earliest = float(scores[np.argmin(dates)])
+    most_recent = float(scores[len(dates) - 1 - np.argmax(dates[::-1])])
     
     # Calculate change
     change = most_recent - earliest
@@ -234,13 +379,21 @@ def categorize_text(text: str, keyword_map: Dict[str, Dict[str, str]]) -> str:
         
     text_lower = text.lower()
     
-    # Check if each keyword exists in the text
-    for keyword, mapping in keyword_map.items():
-        if keyword.lower() in text_lower:
-            return mapping.get("domain", default_domain)
+    # Check if each keyword exists in the text, in keyword_map order
+    for keyword_lower, keyword in _keyword_table(tuple(keyword_map)):
+        if keyword_lower in text_lower:
+            return keyword_map[keyword].get("domain", default_domain)
     
     return default_domain
 
+@lru_cache(maxsize=32)
+def _keyword_table(keywords: Tuple[str, ...]) -> Tuple[Tuple[str, str], ...]:
+    """
+    Lowercased form of each keyword of a keyword map, paired with the keyword. Keyed on the
+    keywords themselves, so a keyword map is only lowercased again after its keys change.
+    """
+    return tuple((keyword.lower(), keyword) for keyword in keywords)
+
 def extract_sentences(text: str) -> List[str]:
     """
     Extract sentences from text
@@ -255,8 +408,9 @@ def extract_sentences(text: str) -> List[str]:
         return []
         
     
-    sentences = re.split(r'[.!?]', text)
-    sentences = [s.strip() for s in sentences if s.strip()]
+    # Map '!' and '?' onto '.', so one plain split handles all three sentence endings
+    sentences = (s.strip() for s in text.translate(_SENTENCE_END_TRANS).split('.'))
+    sentences = [s for s in sentences if s]
     
     return sentences
 
@@ -274,7 +428,7 @@ def extract_bullet_points(text: str) -> List[str]:
         return []
     
    
-    bullet_points = re.split(r'[-•*]\s*', text)
+    bullet_points = _BULLET_SPLIT_RE.split(text)
     bullet_points = [point.strip() for point in bullet_points if point.strip()]
     
     
@@ -297,10 +451,14 @@ def limit_items(items: List[Any], count: int = None) -> List[Any]:
     if count is None or count >= len(items):
         return items
     
-    # For scored items (dicts with a 'score' key), sort by score
+    # For scored items (dicts with a 'score' key), keep the highest scores - the same items,
+    # in the same order, as a stable sort by score, without sorting the whole list
     if items and isinstance(items[0], dict) and 'score' in items[0]:
-        sorted_items = sorted(items, key=lambda x: x.get('score', 0), reverse=True)
-        return sorted_items[:count]
+        try:
+            return heapq.nlargest(count, items, key=_score_key)
+        except KeyError:
+            # Some items have no score; they rank as 0
+            return heapq.nlargest(count, items, key=lambda x: x.get('score', 0))
     
     # For regular items, just take first N
     return items[:count]
@@ -318,18 +476,38 @@ def weighted_mean(values: List[float], weights: List[float] = None) -> float:
     """
     if not values:
         return 0.0
-        
+    
+    values = np.asarray(values, dtype=np.float64)
+    
     if not weights:
-        return sum(values) / len(values)
+        return float(values.mean())
         
     if len(values) != len(weights):
         # Fallback to simple average if lengths don't match
-        return sum(values) / len(values)
+        return float(values.mean())
         
-    numerator = sum(value * weight for value, weight in zip(values, weights))
-    denominator = sum(weights)
+    weights = np.asarray(weights, dtype=np.float64)
+    denominator = weights.sum()
     
     if denominator == 0:
         return 0.0
         
-    return numerator / denominator
\ No newline at end of file
+    return float(values @ weights / denominator)
+
+def matches_any_term(values: pd.Series, terms: Iterable[str]) -> np.ndarray:
+    """
+    Case-insensitive substring match of a column against any of the terms. Each distinct value
+    is tested once, and rows pick up their result through the value's integer code.
+    
+    Args:
+        values: Column of strings, with a handful of distinct values (e.g. form names)
+        terms: Substrings to look for
+        
+    Returns:
+        Boolean array aligned with values; missing values never match
+    """
+    pattern = re.compile("|".join(map(re.escape, terms)), re.IGNORECASE)
+    codes, uniques = pd.factorize(values)
+    matched = np.fromiter((pattern.search(str(value)) is not None for value in uniques), dtype=bool, count=len(uniques))
+    # Missing values have code -1, which picks the trailing False
+    return np.append(matched, False)[codes]
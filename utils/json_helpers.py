@@ -0,0 +1,110 @@
+"""
+JSON serialization helper functions (orjson-backed)
+"""
+from typing import Any, Optional, Union
+
+import orjson
+
+# Non-string dict keys (e.g. int scale levels) are written as strings, as json.dumps does
+_DUMPS_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def jdumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+    """
+    Serialize an object to a JSON string
+
+    Datetimes and numpy values are serialized natively; any other unsupported
+    type falls back to its string representation.
+
+    Args:
+        obj: Object to serialize
+        indent: Pretty-print with 2-space indentation
+        sort_keys: Write dict keys in sorted order
+
+    Returns:
+        JSON string
+    """
+    option = _DUMPS_OPTIONS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=str, option=option).decode("utf-8")
+
+def jloads(data: Union[str, bytes]) -> Any:
+    """
+    Parse a JSON string or bytes
+
+    Args:
+        data: JSON text
+
+    Returns:
+        Parsed object
+    """
+    return orjson.loads(data)
+
+class JsonObjectScanner:
+    """
+    Incremental brace-depth scanner that finds the first balanced {...} object
+    in (possibly streamed) text. Braces inside JSON strings are ignored.
+    """
+    
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._start = -1
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.result: Optional[str] = None
+    
+    def feed(self, chunk: str) -> Optional[str]:
+        """
+        Append text and continue scanning from where the last call stopped
+
+        Args:
+            chunk: Newly received text
+
+        Returns:
+            The complete JSON object text once its closing brace arrives, else None
+        """
+        if self.result is not None:
+            return self.result
+        
+        self._text += chunk
+        text = self._text
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._start < 0:
+                if char == "{":
+                    self._start = i
+                    self._depth = 1
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.result = text[self._start:i + 1]
+                    return self.result
+        self._pos = len(text)
+        return None
+
+def extract_json_block(text: str) -> Optional[str]:
+    """
+    Find the first balanced {...} object in text in a single linear pass
+
+    Args:
+        text: Text that may contain a JSON object among other content
+
+    Returns:
+        The JSON object text, or None if no balanced object is found
+    """
+    return JsonObjectScanner().feed(text)
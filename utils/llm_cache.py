@@ -0,0 +1,284 @@
+"""
+LLM response cache - reuses completions for identical prompts sent to deterministic models
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import orjson
+
+from config.constants import (
+    LLM_CACHE_ENABLED, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_DIR, LLM_CACHE_DISK_TTL_DAYS,
+    SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_SECONDS, SEMANTIC_CACHE_MAX_SCOPES,
+    SEMANTIC_CACHE_MAX_ENTRIES_PER_SCOPE, PROMPT_VERSIONS
+)
+
+logger = logging.getLogger(__name__)
+
+class InMemoryCacheBackend:
+    """
+    Thread-safe LRU store with per-entry expiry. Any object exposing the same
+    get(key) / set(key, value, ttl_seconds) methods (e.g. a Redis wrapper for
+    multi-worker deploys) can be used instead.
+    """
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl_seconds: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+class FileCacheBackend:
+    """
+    Store with one JSON file per entry ({key}.json holding value, created_at and expires_at),
+    so cached responses survive restarts. Values must be JSON-serializable.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: Optional[float] = None):
+        """
+        Args:
+            directory: Directory holding the entry files, created on first write
+            ttl_seconds: Entry lifetime, overriding the one passed to set() when given
+        """
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        if entry.get("expires_at", 0) < time.time():
+            return None
+        return entry.get("value")
+
+    def set(self, key: str, value: Any, ttl_seconds: float) -> None:
+        now = time.time()
+        entry = {
+            "value": value,
+            "created_at": now,
+            "expires_at": now + (self.ttl_seconds if self.ttl_seconds is not None else ttl_seconds)
+        }
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(orjson.dumps(entry, default=str))
+            # Atomic rename, so concurrent readers never see a partial file
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write LLM cache entry %s: %s", path, e)
+
+    def clear(self) -> None:
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".json"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+class TieredCacheBackend:
+    """
+    Backends checked fastest first; a hit in a slower tier is copied into the faster ones
+    """
+
+    def __init__(self, *backends: Any):
+        self.backends = backends
+
+    def get(self, key: str) -> Optional[Any]:
+        for index, backend in enumerate(self.backends):
+            value = backend.get(key)
+            if value is not None:
+                for faster in self.backends[:index]:
+                    faster.set(key, value, LLM_CACHE_TTL_SECONDS)
+                return value
+        return None
+
+    def set(self, key: str, value: Any, ttl_seconds: float) -> None:
+        for backend in self.backends:
+            backend.set(key, value, ttl_seconds)
+
+    def clear(self) -> None:
+        for backend in self.backends:
+            backend.clear()
+
+class LLMCache:
+    """
+    Cache of LLM responses keyed by prompt name and prompt inputs
+    """
+
+    def __init__(self, backend: Any = None, ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+                 enabled: bool = LLM_CACHE_ENABLED):
+        self.backend = backend if backend is not None else InMemoryCacheBackend()
+        self.ttl_seconds = ttl_seconds
+        # When False, cache_name_for() returns None so every call bypasses the cache
+        self.enabled = enabled
+
+    def cache_key(self, prompt_name: str, inputs: Dict[str, Any]) -> str:
+        """
+        Build a stable key for a prompt invocation
+
+        Args:
+            prompt_name: Name of the prompt / agent issuing the call
+            inputs: Prompt input variables
+
+        Returns:
+            SHA-256 hex digest of the prompt name and inputs
+        """
+        payload = orjson.dumps(
+            {"prompt_name": prompt_name, "inputs": inputs},
+            default=str,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.backend.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self.backend.set(key, value, self.ttl_seconds)
+
+class SemanticCache:
+    """
+    Values keyed by query embedding: a lookup hits when a stored embedding in the same scope
+    has cosine similarity of at least the threshold. Scopes separate queries that must never
+    share a value (different data, filters or requested counts) however similar their wording.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS,
+                 max_scopes: int = SEMANTIC_CACHE_MAX_SCOPES,
+                 max_entries_per_scope: int = SEMANTIC_CACHE_MAX_ENTRIES_PER_SCOPE):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_scopes = max_scopes
+        self.max_entries_per_scope = max_entries_per_scope
+        # scope -> list of (unit embedding, value, expires_at)
+        self._scopes: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(embedding: Any) -> Any:
+        # numpy is imported on first use, keeping it off the import path of the agents
+        import numpy as np
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, scope: str, embedding: Any) -> Optional[Any]:
+        """
+        Get the value stored under the most similar embedding in a scope
+
+        Args:
+            scope: Scope key, e.g. from LLMCache.cache_key
+            embedding: Query embedding
+
+        Returns:
+            The stored value, or None when no embedding is similar enough
+        """
+        import numpy as np
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if not entries:
+                return None
+            now = time.monotonic()
+            entries[:] = [entry for entry in entries if entry[2] >= now]
+            if not entries:
+                del self._scopes[scope]
+                return None
+            self._scopes.move_to_end(scope)
+            vectors = np.stack([entry[0] for entry in entries])
+            values = [entry[1] for entry in entries]
+        
+        similarities = vectors @ self._unit(embedding)
+        best = int(np.argmax(similarities))
+        return values[best] if similarities[best] >= self.threshold else None
+
+    def set(self, scope: str, embedding: Any, value: Any) -> None:
+        entry = (self._unit(embedding), value, time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            entries = self._scopes.setdefault(scope, [])
+            entries.append(entry)
+            del entries[:-self.max_entries_per_scope]
+            self._scopes.move_to_end(scope)
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scopes.clear()
+
+def _default_backend() -> Any:
+    """In-memory LRU, backed by the on-disk tier when the LLM_CACHE_DIR env variable is set"""
+    memory_backend = InMemoryCacheBackend()
+    if not LLM_CACHE_DIR:
+        return memory_backend
+    return TieredCacheBackend(
+        memory_backend, FileCacheBackend(LLM_CACHE_DIR, ttl_seconds=LLM_CACHE_DISK_TTL_DAYS * 86400)
+    )
+
+# Process-wide caches shared by all agents
+llm_cache = LLMCache(backend=_default_backend())
+semantic_cache = SemanticCache()
+
+def _model_id(llm: Any) -> str:
+    """Identify the model behind a chat client, so different models never share entries"""
+    return (
+        getattr(llm, "model_name", None) or getattr(llm, "deployment_name", None)
+        or getattr(llm, "model", None) or type(llm).__name__
+    )
+
+def cache_name_for(llm: Any, prompt_name: str) -> Optional[str]:
+    """
+    Get the cache name for an agent's calls, or None when responses must not be cached
+
+    Only temperature-0 models are cached, since their completions are (near) deterministic.
+
+    Args:
+        llm: Chat model used by the agent
+        prompt_name: Name identifying the agent prompt (a key of PROMPT_VERSIONS)
+
+    Returns:
+        prompt_name qualified by its prompt version and the model id when caching applies, else None
+    """
+    if not llm_cache.enabled or getattr(llm, "temperature", None) != 0:
+        return None
+    version = PROMPT_VERSIONS.get(prompt_name)
+    if version is not None:
+        prompt_name = f"{prompt_name}:{version}"
+    return f"{prompt_name}@{_model_id(llm)}"
@@ -0,0 +1,287 @@
+"""
+LLM invocation helper functions
+"""
+import asyncio
+import string
+import threading
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Any, Iterator, List, Optional, Tuple, TypeVar, TYPE_CHECKING
+
+from config.constants import MAX_CONCURRENT_LLM_CALLS
+from utils.json_helpers import JsonObjectScanner
+from utils.llm_cache import llm_cache
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableLambda
+
+T = TypeVar("T")
+
+class CompiledTemplate:
+    """
+    A {name}-placeholder template (str.format syntax, with {{ and }} for literal braces)
+    split once into literal text and placeholder names, so rendering is a single join
+    rather than a re-parse of the whole prompt on every call
+    """
+    
+    def __init__(self, template: str):
+        self.parts: List[Tuple[str, Optional[str]]] = []
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(template):
+            if format_spec or conversion:
+                raise ValueError(f"Unsupported placeholder in prompt: {{{field_name}!{conversion}:{format_spec}}}")
+            self.parts.append((literal, field_name))
+        self.input_variables = sorted({field_name for _, field_name in self.parts if field_name})
+    
+    def render(self, inputs: Dict[str, Any]) -> str:
+        """Fill the placeholders, same result as template.format(**inputs)"""
+        chunks = []
+        for literal, field_name in self.parts:
+            chunks.append(literal)
+            if field_name is not None:
+                chunks.append(str(inputs[field_name]))
+        return "".join(chunks)
+
+@lru_cache(maxsize=64)
+def _prompt_renderer(prompt_str: str, system_prompt: Optional[str] = None) -> Callable[[Dict[str, Any]], Any]:
+    """Get the function rendering input variables into a ChatPromptValue, compiled once per prompt"""
+    from langchain_core.messages import HumanMessage, SystemMessage
+    from langchain_core.prompt_values import ChatPromptValue
+    
+    human_template = CompiledTemplate(prompt_str)
+    system_template = CompiledTemplate(system_prompt) if system_prompt else None
+    # A system prompt without placeholders renders the same every call, so its message is
+    # built once and shared (messages are only read when the request is serialized)
+    static_system_message = (
+        SystemMessage(content=system_template.render({}))
+        if system_template is not None and not system_template.input_variables else None
+    )
+    
+    def render(inputs: Dict[str, Any]) -> ChatPromptValue:
+        messages = [HumanMessage(content=human_template.render(inputs))]
+        if static_system_message is not None:
+            messages.insert(0, static_system_message)
+        elif system_template is not None:
+            messages.insert(0, SystemMessage(content=system_template.render(inputs)))
+        return ChatPromptValue(messages=messages)
+    
+    return render
+
+def _render_runnable(render: Callable[[Dict[str, Any]], Any], name: str) -> "RunnableLambda":
+    """Wrap a render function as a runnable usable at the head of a chain"""
+    from langchain_core.runnables import RunnableLambda
+    
+    async def arender(inputs: Dict[str, Any]) -> Any:
+        # Rendering is cheap; an async twin keeps it off the executor in async chains
+        return render(inputs)
+    
+    return RunnableLambda(render, afunc=arender, name=name)
+
+@lru_cache(maxsize=32)
+def compiled_prompt(prompt_str: str, system_prompt: Optional[str] = None) -> "RunnableLambda":
+    """
+    Get the chat prompt for a human-message prompt, compiled once per prompt string
+
+    Behaves like ChatPromptTemplate.from_messages([("system", ...), ("human", ...)]) in a
+    chain (input dict in, ChatPromptValue out) without re-parsing the templates per call.
+
+    Args:
+        prompt_str: Prompt text from config.constants
+        system_prompt: Optional static system message sent ahead of the prompt (e.g. a rubric
+            from config.rubrics), so it forms a cacheable prefix shared by every call
+
+    Returns:
+        Shared runnable rendering the prompt
+    """
+    return _render_runnable(_prompt_renderer(prompt_str, system_prompt), "compiled_prompt")
+
+@lru_cache(maxsize=32)
+def compiled_prompt_switch(variable: str, variants: Tuple[Tuple[Any, str, Optional[str]], ...],
+                           default_prompt: str, default_system_prompt: Optional[str] = None) -> "RunnableLambda":
+    """
+    Get a chat prompt that picks its template by the value of one input variable, e.g. a
+    prompt variant per query type holding only the instructions for that type
+
+    Each variant is compiled once and stays a fixed prefix, so provider prompt caching still
+    applies per variant. The selecting variable need not appear in any template.
+
+    Args:
+        variable: Input variable whose value selects the variant
+        variants: (value, prompt, system prompt or None) per variant
+        default_prompt: Prompt for values without a variant
+        default_system_prompt: System prompt for values without a variant
+
+    Returns:
+        Shared runnable rendering the selected prompt
+    """
+    renderers = {value: _prompt_renderer(prompt_str, system_prompt) for value, prompt_str, system_prompt in variants}
+    default_renderer = _prompt_renderer(default_prompt, default_system_prompt)
+    
+    def render(inputs: Dict[str, Any]) -> Any:
+        return renderers.get(inputs.get(variable), default_renderer)(inputs)
+    
+    return _render_runnable(render, "compiled_prompt_switch")
+
+# Compiled prompt | llm | parser chains, keyed by (id(llm), prompt, system prompt). Entries
+# hold the LLM, so its id cannot be reused by another object while cached.
+_CHAIN_CACHE_SIZE = 32
+_chain_cache: "OrderedDict[Tuple[int, str, Optional[str]], Tuple[Any, Any]]" = OrderedDict()
+_chain_cache_lock = threading.Lock()
+
+def compiled_chain(llm: Any, prompt_str: str, system_prompt: Optional[str] = None) -> Any:
+    """
+    Get the prompt | llm | StrOutputParser() chain for an LLM and prompt, built once and
+    shared by every agent instance using the same pair
+
+    Args:
+        llm: Chat model
+        prompt_str: Prompt text from config.constants
+        system_prompt: Optional static system message, see compiled_prompt
+
+    Returns:
+        Shared runnable chain
+    """
+    key = (id(llm), prompt_str, system_prompt)
+    with _chain_cache_lock:
+        entry = _chain_cache.get(key)
+        if entry is not None:
+            _chain_cache.move_to_end(key)
+            return entry[1]
+    
+    from langchain_core.output_parsers import StrOutputParser
+    chain = compiled_prompt(prompt_str, system_prompt) | llm | StrOutputParser()
+    with _chain_cache_lock:
+        entry = _chain_cache.setdefault(key, (llm, chain))
+        _chain_cache.move_to_end(key)
+        while len(_chain_cache) > _CHAIN_CACHE_SIZE:
+            _chain_cache.popitem(last=False)
+    return entry[1]
+
+# Persistent event loop for sync callers, so async HTTP connection pools held by a
+# long-lived LLM client stay bound to one loop and are reused across requests
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_loop_lock = threading.Lock()
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """Get (starting on first use) the shared background event loop"""
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name="llm-event-loop", daemon=True).start()
+    return _background_loop
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """
+    Run a coroutine on the shared background event loop and wait for its result
+
+    Args:
+        coro: Coroutine to run; must not be called from the background loop itself
+
+    Returns:
+        The coroutine result
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_background_loop()).result()
+
+# One semaphore per event loop - asyncio primitives cannot be shared across loops
+_llm_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _get_llm_semaphore() -> asyncio.Semaphore:
+    """Get the LLM concurrency semaphore for the running event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+        _llm_semaphores[loop] = semaphore
+    return semaphore
+
+async def ainvoke_limited(chain: Any, inputs: Dict[str, Any], cache_name: Optional[str] = None) -> Any:
+    """
+    Invoke a chain asynchronously, capping concurrent LLM calls to protect against provider rate limits
+
+    Args:
+        chain: LangChain runnable exposing ainvoke
+        inputs: Prompt input variables
+        cache_name: Prompt name to cache the response under, or None to bypass the cache
+
+    Returns:
+        The chain output
+    """
+    cache_key = llm_cache.cache_key(cache_name, inputs) if cache_name else None
+    if cache_key:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
+    async with _get_llm_semaphore():
+        response = await chain.ainvoke(inputs)
+    
+    if cache_key:
+        llm_cache.set(cache_key, response)
+    return response
+
+async def astream_json_limited(chain: Any, inputs: Dict[str, Any], cache_name: Optional[str] = None) -> str:
+    """
+    Stream a completion and stop reading as soon as a complete JSON object has arrived,
+    so trailing prose after the JSON is never waited on
+
+    Args:
+        chain: LangChain runnable producing string chunks (prompt | llm | StrOutputParser())
+        inputs: Prompt input variables
+        cache_name: Prompt name to cache the response under, or None to bypass the cache
+
+    Returns:
+        The streamed response text up to the end of the first JSON object
+    """
+    cache_key = llm_cache.cache_key(cache_name, inputs) if cache_name else None
+    if cache_key:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
+    scanner = JsonObjectScanner()
+    chunks = []
+    async with _get_llm_semaphore():
+        stream = chain.astream(inputs)
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                if scanner.feed(chunk) is not None:
+                    break
+        finally:
+            await stream.aclose()
+    
+    response = "".join(chunks)
+    if cache_key:
+        llm_cache.set(cache_key, response)
+    return response
+
+def stream_cached(chain: Any, inputs: Dict[str, Any], cache_name: Optional[str] = None) -> Iterator[str]:
+    """
+    Stream a completion, replaying a cached response as a single chunk when available
+
+    The response is only cached once the stream has been fully consumed.
+
+    Args:
+        chain: LangChain runnable producing string chunks
+        inputs: Prompt input variables
+        cache_name: Prompt name to cache the response under, or None to bypass the cache
+
+    Yields:
+        Response text chunks
+    """
+    if not cache_name:
+        yield from chain.stream(inputs)
+        return
+    
+    cache_key = llm_cache.cache_key(cache_name, inputs)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+    
+    chunks = []
+    for chunk in chain.stream(inputs):
+        chunks.append(chunk)
+        yield chunk
+    llm_cache.set(cache_key, "".join(chunks))
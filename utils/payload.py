@@ -0,0 +1,38 @@
+"""
+Prompt payload helper functions - trim parsed data rows to the fields each agent's prompt uses
+"""
+from typing import Any, Dict, Iterable, List
+
+# Parsed data fields each agent's prompt reads. The numeric analysis agent sends computed
+# statistics rather than rows, and the consolidation agent only sees the analyses.
+PROMPT_FIELDS = {
+    "text_analysis": ("strengths_comment", "improvements_comment", "evaluator_role", "form_name", "release_date_str"),
+    "response_generation": ("strengths_comment", "improvements_comment", "evaluator_role", "form_name", "release_date_str"),
+}
+
+def slim_row(row: Dict[str, Any], fields: Iterable[str]) -> Dict[str, Any]:
+    """
+    Project a row onto the given fields, leaving out empty ones
+
+    Args:
+        row: Parsed data row
+        fields: Fields to keep
+
+    Returns:
+        The non-empty values of the fields
+    """
+    return {field: row[field] for field in fields if row.get(field) not in (None, "")}
+
+def slim_for(agent: str, rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Trim parsed data rows to the fields an agent's prompt uses
+
+    Args:
+        agent: Key of PROMPT_FIELDS
+        rows: Parsed data rows
+
+    Returns:
+        The projected rows, in order
+    """
+    fields = PROMPT_FIELDS[agent]
+    return [slim_row(row, fields) for row in rows]